@@ -9,8 +9,144 @@ def list2col(rawInput,fill=np.arange(3564)):
     
     Output: 
     A df containing the same data, splitted bbb in each column
+    (the rows shorter than the others are padded with NaN)
+
+    For long series consider importData.cals2vectors, which avoids the python lists altogether.
+    '''
+    aux = rawInput.dropna()
+    fill = pd.unique(np.asarray(fill))
+    if len(aux) == 0:
+        return pd.DataFrame(columns=fill)
+    # one 2D array for all the rows, then one column per bunch
+    lengths = [len(i) for i in aux.values]
+    if len(set(lengths)) == 1:
+        myArray = np.stack(aux.values)
+    else:
+        # rows of different length are padded with NaN
+        myArray = np.full((len(aux), max(lengths)), np.nan)
+        for i, j in enumerate(aux.values):
+            myArray[i, :len(j)] = j
+    return pd.DataFrame(myArray[:, fill], index=aux.index, columns=fill)
+
+class BunchLifetime:
+    '''
+    Bunch-by-bunch lifetime of a beam, computed for all the bunches at once and updated incrementally.
+
+    The intensities are averaged in bins of resample_second (as pandas resample(...).mean(),
+    with the bins aligned to the midnight of the first sample), then for each pair of consecutive bins
+    lifetime = -(a/b)/3600 [h], with a the mean intensity and b=diff(a)/resample_second.
+    The last bin stays open until a later sample (or flush) closes it.
+
+    Input of update:
+    index is a DatetimeIndex of the new samples (later than the previous ones)
+    intensities is a 2D array (samples x bunches), e.g., from importData.cals2vectors
+    
+    Output of update and flush:
+    A df with the lifetimes of the bins closed by the update, one column per bunch
+
+    ===Example===
+    engine=MDanalysis.BunchLifetime(resample_second=60)
+    FBCT=importData.cals2vectors(['LHC.BCTFR.A6R4.B1:BUNCH_INTENSITY'], t1, t2)['LHC.BCTFR.A6R4.B1:BUNCH_INTENSITY']
+    engine.update(FBCT.index, FBCT.values)
+    # ... later, the new samples only
+    engine.update(newIndex, newValues)
+    engine.flush()
+    engine.lifetime
+    '''
+    def __init__(self, resample_second=60, columnName='lifetime of bunch {} [h]'):
+        self.resample_second=resample_second
+        self.columnName=columnName
+        self.lifetime=pd.DataFrame()
+        self._binWidth=int(round(resample_second*1e9))
+        self._origin=None
+        self._tz=None
+        # the bin still open (sum and number of valid samples per bunch)
+        self._openBin=None
+        self._openSum=None
+        self._openCount=None
+        # the last closed bin (mean intensity per bunch)
+        self._lastBin=None
+        self._lastMean=None
+
+    def _close(self, bins, sums, counts):
+        # from the closed bins to the new lifetime rows
+        if len(bins)==0:
+            return pd.DataFrame()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means=sums/counts
+        if self._lastBin is not None:
+            bins=np.concatenate([[self._lastBin], bins])
+            means=np.vstack([self._lastMean, means])
+        self._lastBin, self._lastMean = bins[-1], means[-1]
+        if len(bins)<2:
+            return pd.DataFrame()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            b=(means[1:]-means[:-1])/self.resample_second
+            lifetime=-(means[1:]/b)/3600.
+        # as the resampled series has empty bins in the gaps, there is no lifetime across a gap
+        lifetime[np.diff(bins)!=1]=np.nan
+        index=pd.to_datetime(self._origin+bins[1:]*self._binWidth)
+        if self._tz is not None:
+            index=index.tz_localize('UTC').tz_convert(self._tz)
+        out=pd.DataFrame(lifetime, index=index,
+                         columns=[self.columnName.format(i) for i in range(lifetime.shape[1])]).dropna(how='all')
+        self.lifetime=out if len(self.lifetime)==0 else pd.concat([self.lifetime, out])
+        return out
+
+    @staticmethod
+    def _UTCns(index):
+        # the ns since epoch (UTC for the tz-aware index)
+        if index.tz is not None:
+            index=index.tz_convert('UTC').tz_localize(None)
+        return index.values.astype('datetime64[ns]').astype(np.int64)
+
+    def update(self, index, intensities):
+        index=pd.DatetimeIndex(index)
+        intensities=np.asarray(intensities, dtype=float)
+        if len(index)==0:
+            return pd.DataFrame()
+        if self._origin is None:
+            self._tz=index.tz
+            # the local midnight, the bins are computed in UTC (no shift across the DST changes)
+            self._origin=self._UTCns(index[:1].normalize())[0]
+        ns=self._UTCns(index)
+        bins=(ns-self._origin)//self._binWidth
+        valid=np.isfinite(intensities)
+        # one sum per bin for all the bunches
+        starts=np.concatenate([[0], np.where(np.diff(bins)!=0)[0]+1])
+        sums=np.add.reduceat(np.where(valid, intensities, 0.), starts, axis=0)
+        counts=np.add.reduceat(valid.astype(float), starts, axis=0)
+        bins=bins[starts]
+        if self._openBin is not None:
+            if bins[0]==self._openBin:
+                sums[0]+=self._openSum
+                counts[0]+=self._openCount
+            else:
+                bins=np.concatenate([[self._openBin], bins])
+                sums=np.vstack([self._openSum, sums])
+                counts=np.vstack([self._openCount, counts])
+        self._openBin, self._openSum, self._openCount = bins[-1], sums[-1], counts[-1]
+        return self._close(bins[:-1], sums[:-1], counts[:-1])
+
+    def flush(self):
+        if self._openBin is None:
+            return pd.DataFrame()
+        bins, sums, counts = np.array([self._openBin]), self._openSum[np.newaxis], self._openCount[np.newaxis]
+        self._openBin=None
+        return self._close(bins, sums, counts)
+
+# TEST FUNCTIONS
+
+def _testList2col():
+    '''
+    Check list2col against the original one-column-per-bunch apply, also with rows of different length.
+    It returns True if they agree.
     '''
-    DF = pd.DataFrame()
-    for i in fill:
-        DF[i] = rawInput.dropna().apply(lambda x:x[i])
-    return DF
+    rawInput=pd.Series([np.arange(10.), np.arange(12.)+100, None, np.arange(11.)+200],
+                       index=pd.date_range('2018-01-01', periods=4, freq='1s'))
+    fill=np.array([0, 3, 9])
+    aux=rawInput.dropna()
+    reference=pd.DataFrame({i: aux.apply(lambda x: x[i]) for i in fill})
+    result=list2col(rawInput, fill)
+    return np.array_equal(result.values, reference.values) and result.index.equals(reference.index) \
+        and np.isnan(list2col(rawInput, [11]).values[[0,2]]).all()
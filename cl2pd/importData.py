@@ -2,10 +2,18 @@ import pandas as pd
 import numpy as np
 import os
 import inspect
+import re
+import time
+import hashlib
+import threading
+import uuid
 # Fundamental contribution by R. De Maria et al.
 import pytimber
 from . import dotdict
-#For the dBLM2pd
+from . import tfsFunctions
+# mat2pd, mat2dict and MatlabFile are in matFunctions (no pytimber, used by the process pool of mat2pd)
+from .matFunctions import mat2dict, MatlabFile, mat2pd
+#For the dBLM2pd and the CALS cache
 import h5py
 
 
@@ -14,6 +22,24 @@ dotdict=dotdict.dotdict
 # TODO: discuss about the possible problem if the user has already defined a variable named 'cals' 
 cals=pytimber.LoggingDB()
 
+# Configuration of the local CALS cache (see _calsGet).
+# The user can change it at run time, e.g.
+# importData.calsCache.folder='/eos/user/s/sterbini/calsCache'
+# importData.calsCache.enabled=False
+# - folder: where the HDF5 files (one per variable) are stored
+# - maxSize_MB: when the folder is larger, the least recently used files are removed
+# - latency_s: the data more recent than now-latency_s are never flagged as cached,
+#   since CALS can still receive them
+# - fillIndexStart: the oldest time synchronized in the local index of the LHC fills
+#   when a fill older than the ones already indexed is requested (see LHCFillsByNumber)
+calsCache=dotdict({'folder': os.environ.get('CL2PD_CACHE_FOLDER',
+                                            os.path.join(os.path.expanduser('~'),'.cl2pd','calsCache')),
+                   'maxSize_MB': 2000.,
+                   'latency_s': 3600.,
+                   'fillIndexStart': pd.Timestamp('2010-01-01', tz='UTC'),
+                   'enabled': True})
+_calsCacheLock=threading.RLock()
+
 def _smartList(myList):
     '''
     Return a list with no duplicate and resolve the '%' search pattern.
@@ -37,7 +63,335 @@ def _smartList(myList):
             newList=newList+[i]
     return list(np.unique(newList))
 
-def _noSplitcals2pd(listOfVariables, t1, t2, fundamental='', verbose=False):
+def _cacheFileName(variable):
+    '''
+    Return the HDF5 file of the CALS cache associated to the variable.
+    The hash avoids collisions between names that differ only by special characters.
+    '''
+    safeName=re.sub(r'[^A-Za-z0-9_.-]','_',variable)
+    return os.path.join(calsCache.folder, safeName+'_'+hashlib.md5(variable.encode()).hexdigest()[:8]+'.h5')
+
+def _mergeIntervals(intervals):
+    '''
+    Return the sorted union of the list of [start,end] intervals as a (n,2) array.
+    Overlapping and adjacent intervals are fused.
+    '''
+    intervals=sorted([list(i) for i in intervals])
+    merged=[]
+    for i in intervals:
+        if merged and i[0]<=merged[-1][1]:
+            merged[-1][1]=max(merged[-1][1],i[1])
+        else:
+            merged.append(i)
+    return np.array(merged, dtype=float).reshape(-1,2)
+
+def _missingIntervals(intervals, t1, t2):
+    '''
+    Return the list of the sub-intervals of [t1,t2] not covered by the (sorted, disjoint) intervals.
+    '''
+    missing=[]
+    start=t1
+    for a,b in intervals:
+        if b<start: continue
+        if a>t2: break
+        if a>start: missing.append((start,a))
+        start=max(start,b)
+        if start>=t2: break
+    if start<t2: missing.append((start,t2))
+    return missing
+
+def _cacheableValues(values):
+    '''
+    Return the values as a regular numpy array that can be stored in HDF5 (numbers, strings or
+    vectors of the same length). Return None if this is not possible (e.g., vectors of different length).
+    '''
+    values=np.asarray(values)
+    if values.dtype.kind in 'biuf':
+        return values
+    if values.dtype.kind in 'US':
+        return values.astype(str)
+    if values.dtype.kind=='O':
+        if len(values)==0:
+            return np.array([], dtype=float)
+        if all(isinstance(i,str) for i in values):
+            return values.astype(str)
+        try:
+            aux=np.stack(values)
+        except ValueError:
+            return None
+        if aux.dtype.kind in 'biuf':
+            return aux
+    return None
+
+def _stitchChunks(chunks):
+    '''
+    Stitch a list of (intervals, timestamps, values) in a single (intervals, timestamps, values)
+    with sorted and unique timestamps.
+    Return None if the values cannot be stored together (not cacheable or different shapes).
+    '''
+    if any(values is None for intervals, timestamps, values in chunks):
+        return None
+    nonEmpty=[(timestamps,values) for intervals, timestamps, values in chunks if len(timestamps)]
+    if len(set(values.shape[1:] for timestamps, values in nonEmpty))>1:
+        return None
+    intervals=_mergeIntervals([j for i in chunks for j in i[0]])
+    if len(nonEmpty)==0:
+        return intervals, np.array([]), np.array([])
+    timestamps=np.concatenate([i for i,j in nonEmpty])
+    values=np.concatenate([j for i,j in nonEmpty])
+    timestamps, myIndex = np.unique(timestamps, return_index=True)
+    return intervals, timestamps, values[myIndex]
+
+def _readCache(variable):
+    '''
+    Return the tuple (intervals, timestamps, values) stored in the cache for the variable or None.
+    The timestamps and the intervals are in UNIX seconds (UTC).
+    '''
+    fileName=_cacheFileName(variable)
+    if not os.path.exists(fileName):
+        return None
+    try:
+        with h5py.File(fileName,'r') as myFile:
+            intervals=myFile['intervals'][()]
+            timestamps=myFile['timestamps'][()]
+            if myFile['values'].attrs.get('isString',False):
+                values=myFile['values'].asstr()[()].astype(str)
+            else:
+                values=myFile['values'][()]
+    except (OSError, KeyError):
+        # corrupted file, e.g. interrupted session: it will be rebuilt
+        os.remove(fileName)
+        return None
+    # the modification time is used for the least-recently-used eviction
+    os.utime(fileName)
+    return intervals, timestamps, values
+
+def _writeCache(variable, intervals, timestamps, values):
+    '''
+    Store (intervals, timestamps, values) in the cache file of the variable.
+    The file is written aside (with a name unique to the writer, as the folder can be shared by several
+    processes or hosts) and then renamed to never leave an incomplete file.
+    A failure is printed and not raised: the data are already fetched.
+    '''
+    fileName=_cacheFileName(variable)
+    tmpFileName=fileName+'.'+uuid.uuid4().hex+'.tmp'
+    try:
+        if not os.path.exists(calsCache.folder):
+            os.makedirs(calsCache.folder, exist_ok=True)
+        with h5py.File(tmpFileName,'w') as myFile:
+            myFile.attrs['variable']=str(variable)
+            myFile['intervals']=intervals
+            myFile['timestamps']=timestamps
+            if values.dtype.kind=='U':
+                myFile.create_dataset('values', data=values.astype(object), dtype=h5py.string_dtype())
+                myFile['values'].attrs['isString']=True
+            else:
+                myFile['values']=values
+        os.replace(tmpFileName, fileName)
+    except Exception as e:
+        print(('The cache of '+str(variable)+' is not written: '+str(e)))
+        if os.path.exists(tmpFileName):
+            try:
+                os.remove(tmpFileName)
+            except OSError:
+                pass
+
+def _evictCache():
+    '''
+    Remove the least recently used files of the cache until its size is below calsCache.maxSize_MB.
+    '''
+    if not os.path.exists(calsCache.folder):
+        return
+    myStats=[]
+    for i in os.listdir(calsCache.folder):
+        if i.endswith('.h5'):
+            try:
+                myStats.append((os.path.join(calsCache.folder,i), os.stat(os.path.join(calsCache.folder,i))))
+            except OSError:
+                pass # removed by another process in the meanwhile
+    myStats=sorted(myStats, key=lambda x: x[1].st_mtime)
+    myFiles=[i[0] for i in myStats]
+    sizes=[i[1].st_size for i in myStats]
+    totalSize=np.sum(sizes)
+    for i,j in zip(myFiles,sizes):
+        if totalSize<=calsCache.maxSize_MB*1024*1024: break
+        try:
+            os.remove(i)
+        except OSError:
+            pass # already removed by another process
+        totalSize-=j
+
+def clearCalsCache(listOfVariables=None):
+    '''
+    Remove from the local CALS cache the listOfVariables (all the variables if None).
+
+    ===Example===
+    importData.clearCalsCache(['LHC.BCTDC.A6R4.B1:BEAM_INTENSITY'])
+    importData.clearCalsCache()
+    '''
+    with _calsCacheLock:
+        if listOfVariables is None:
+            if os.path.exists(calsCache.folder):
+                for i in os.listdir(calsCache.folder):
+                    if i.endswith('.h5'): os.remove(os.path.join(calsCache.folder,i))
+        else:
+            for i in _smartList(listOfVariables):
+                if os.path.exists(_cacheFileName(i)): os.remove(_cacheFileName(i))
+
+def _calsGet(listOfVariables, t1, t2, fundamental='', verbose=False, useCache=True):
+    '''
+    It is a cals.get using the local cache.
+
+    This function is supposed to be private.
+
+    t1 and t2 are tz-aware pandas datetime (t2 can be also 'last' or 'next').
+    It returns the same dictionary of cals.get: for each variable the tuple (timestamps, values).
+
+    For each variable the cache stores the intervals already extracted.
+    Only the missing sub-intervals of [t1,t2] are requested to CALS and the result is stitched
+    on the cached data. The cache is bypassed if useCache is False, if calsCache.enabled is False,
+    if a fundamental filter is used, if t2 is a string or if t2<=t1.
+    '''
+    if (not useCache) or (not calsCache.enabled) or isinstance(t2, str) or fundamental!='' or not (t1<t2):
+        if fundamental=='':
+            return cals.get(listOfVariables,t1,t2)
+        else:
+            return cals.get(listOfVariables,t1,t2,fundamental)
+
+    start, end = t1.timestamp(), t2.timestamp()
+    # the most recent data could be still arriving to CALS
+    lastCacheable=time.time()-calsCache.latency_s
+
+    cached={}
+    toFetch={}
+    with _calsCacheLock:
+        for i in listOfVariables:
+            cached[i]=_readCache(i)
+            intervals=np.zeros((0,2)) if cached[i] is None else cached[i][0]
+            missing=tuple(_missingIntervals(intervals,start,end))
+            if len(missing):
+                toFetch.setdefault(missing,[]).append(i)
+
+    # variables sharing the same missing intervals are extracted together
+    fetched={i:[] for i in listOfVariables}
+    for missing in toFetch:
+        for a,b in missing:
+            if verbose: print(('Cache miss: '+str(pd.Timestamp(a,unit='s'))+' - '+str(pd.Timestamp(b,unit='s'))))
+            DATA=cals.get(toFetch[missing],
+                          pd.Timestamp(a,unit='s',tz='UTC').astimezone('CET'),
+                          pd.Timestamp(b,unit='s',tz='UTC').astimezone('CET'))
+            for i in toFetch[missing]:
+                if i in DATA:
+                    fetched[i].append((a,b)+tuple(DATA[i]))
+                else:
+                    fetched[i].append((a,b,np.array([]),np.array([])))
+
+    DATA={}
+    for i in listOfVariables:
+        if len(fetched[i])==0:
+            intervals, timestamps, values = cached[i]
+        else:
+            chunks=[] if cached[i] is None else [cached[i]]
+            for a,b,aux1,aux2 in fetched[i]:
+                chunks.append(([[a,min(b,lastCacheable)]] if min(b,lastCacheable)>a else [],
+                               np.asarray(aux1,dtype=float), _cacheableValues(aux2)))
+            with _calsCacheLock:
+                # another thread could have updated the same variable in the meanwhile
+                latest=_readCache(i)
+                if latest is not None: chunks.append(latest)
+                stitched=_stitchChunks(chunks)
+                if stitched is not None:
+                    intervals, timestamps, values = stitched
+                    _writeCache(i,intervals,timestamps,values)
+            if stitched is None:
+                # not cacheable (e.g., vectors of variable length): direct answer
+                if verbose: print(('Variable not cacheable: '+i))
+                if (cached[i] is None) and (len(fetched[i])==1):
+                    DATA[i]=fetched[i][0][2:]
+                else:
+                    DATA[i]=cals.get([i],t1,t2).get(i,(np.array([]),np.array([])))
+                continue
+        myFilter=(timestamps>=start) & (timestamps<=end)
+        DATA[i]=(timestamps[myFilter],values[myFilter])
+    if len(toFetch):
+        with _calsCacheLock:
+            _evictCache()
+    return DATA
+
+def _kWayMerge(listOfArrays):
+    '''
+    Return the sorted union (no duplicates) of a list of sorted arrays.
+
+    The concatenated arrays are k sorted runs: the stable sort (timsort) detects and merges them in O(N log k).
+    '''
+    if len(listOfArrays)==0:
+        return np.array([])
+    aux=np.sort(np.concatenate(listOfArrays), kind='stable')
+    if len(aux)==0:
+        return aux
+    return aux[np.concatenate(([True], aux[1:]!=aux[:-1]))]
+
+def _mergeLoopDATA2pd(DATA, listOfVariables):
+    '''
+    The original conversion of the cals.get dictionary in a pandas dataframe (one outer merge per variable).
+    It is used by _DATA2pd for the timestamps with duplicates and as reference for _benchmarkDATA2pd.
+
+    This function is supposed to be private.
+    '''
+    myDataFrame=pd.DataFrame()
+    if DATA!={}:
+        for i in listOfVariables:
+            auxDataFrame=pd.DataFrame()
+            auxDataFrame[i]=pd.Series(DATA[i][1].tolist(),pd.to_datetime(DATA[i][0],unit='s'))
+            myDataFrame=pd.merge(myDataFrame,auxDataFrame, how='outer',left_index=True,right_index=True)
+    if len(myDataFrame):
+        myDataFrame.index=myDataFrame.index.tz_localize('UTC')
+    return myDataFrame
+
+def _DATA2pd(DATA, listOfVariables):
+    '''
+    Convert the dictionary returned by cals.get in a pandas dataframe.
+
+    This function is supposed to be private.
+
+    The union of the timestamps is computed once and each variable is scattered in its column
+    in a single pass, keeping its numpy dtype (integers become float and booleans object only if they
+    have missing values). The vector variables are stored as one numpy array (a view) per row.
+    The index timestamps of the output are UTC-localized.
+    If a variable has duplicated (or not increasing) timestamps, e.g., from cals.get without the cache
+    or with a fundamental filter, the variables are merged one by one (see _mergeLoopDATA2pd)
+    to keep all the rows.
+    '''
+    if DATA=={}:
+        return pd.DataFrame()
+    listOfVariables=[i for i in listOfVariables if i in DATA]
+    stamps=[np.asarray(DATA[i][0],dtype=float) for i in listOfVariables]
+    if any(np.any(np.diff(i)<=0) for i in stamps):
+        return _mergeLoopDATA2pd(DATA, listOfVariables)
+    timestamps=_kWayMerge(stamps)
+    myColumns={}
+    for i, myStamps in zip(listOfVariables, stamps):
+        positions=np.searchsorted(timestamps, myStamps)
+        values=np.asarray(DATA[i][1])
+        if values.ndim>1:
+            column=np.full(len(timestamps), np.nan, dtype=object)
+            for j,k in enumerate(positions):
+                column[k]=values[j]
+        elif np.array_equal(positions, np.arange(len(timestamps))):
+            column=values
+        else:
+            if values.dtype.kind in 'fc':
+                column=np.full(len(timestamps), np.nan, dtype=values.dtype)
+            elif values.dtype.kind in 'iu':
+                column=np.full(len(timestamps), np.nan)
+            else:
+                column=np.full(len(timestamps), np.nan, dtype=object)
+            column[positions]=values
+        myColumns[i]=column
+    return pd.DataFrame(myColumns, index=pd.to_datetime(timestamps,unit='s').tz_localize('UTC'),
+                        columns=listOfVariables)
+
+def _noSplitcals2pd(listOfVariables, t1, t2, fundamental='', verbose=False, useCache=True):
     '''
     It is a cals2pd without splitting feature.
 
@@ -49,6 +403,7 @@ def _noSplitcals2pd(listOfVariables, t1, t2, fundamental='', verbose=False):
     This function returns a pandas dataframe of the listOfVariables within the interval [t1,t2].
     It can be used in the verbose mode if the corresponding flag is True.
     It can be used to filter fundamentals (especially intended for the injectors).
+    The local CALS cache is used unless useCache is False (see _calsGet).
     The index timestamps of the output are UTC-localized.
     '''
 
@@ -74,29 +429,79 @@ def _noSplitcals2pd(listOfVariables, t1, t2, fundamental='', verbose=False):
         
     # Retrieving the variables
     listOfVariableToAdd=list(set(listOfVariables))
-    if fundamental=='':
-        if verbose: print('No fundamental filter.')
-        DATA=cals.get(listOfVariableToAdd,t1,t2 )
-    else:
-        DATA=cals.get(listOfVariableToAdd,t1,t2,fundamental)
-    myDataFrame=pd.DataFrame()
-
-    if DATA!={}:
-        for i in listOfVariableToAdd:
-            if verbose: print(('Elaborating variable: '+ i))
-            auxDataFrame=pd.DataFrame()                
-            auxDataFrame[i]=pd.Series(DATA[i][1].tolist(),pd.to_datetime(DATA[i][0],unit='s'))
-            # important function to keep in mind
-            myDataFrame=pd.merge(myDataFrame,auxDataFrame, how='outer',left_index=True,right_index=True)
-        
-    #Time-zone localization
-    if len(myDataFrame):
-        myDataFrame.index=myDataFrame.index.tz_localize('UTC')
-    return myDataFrame
+    if verbose: print('No fundamental filter.' if fundamental=='' else 'Fundamental filter: '+fundamental)
+    DATA=_calsGet(listOfVariableToAdd,t1,t2,fundamental,verbose=verbose,useCache=useCache)
+    if verbose: print(('Elaborating variables: '+ str(len(DATA))))
+    return _DATA2pd(DATA, listOfVariableToAdd)
     
-def cals2pd(listOfVariables, t1, t2, fundamental='', split=1, verbose=False): 
+def _fetchWindow(listOfVariables, t1, t2, fundamental='', verbose=False, useCache=True, retries=2):
+    '''
+    It is a _noSplitcals2pd retrying the extraction (with a growing delay) in case of failure.
+
+    This function is supposed to be private.
+    '''
+    for attempt in range(retries+1):
+        try:
+            return _noSplitcals2pd(listOfVariables, t1, t2, fundamental=fundamental, verbose=verbose, useCache=useCache)
+        except Exception as e:
+            if attempt==retries:
+                raise
+            if verbose: print(('Window '+str(t1)+' - '+str(t2)+' failed ('+str(e)+'), retrying.'))
+            time.sleep(2**attempt)
+
+def _bytesPerSecond(listOfVariables, t1, t2, probe=pd.Timedelta('1min'), fundamental='', useCache=True):
+    '''
+    Estimate the size (bytes per second) of the extraction of listOfVariables around [t1,t2].
+    The point density and the size of a point of each variable are taken from the local CALS cache
+    when it has some data of the variable, otherwise from a probe extraction of [t1, t1+probe]
+    (the probe is cached, so it is not extracted twice).
+    '''
+    if t1.tz is None: t1=t1.tz_localize('UTC')
+    if t2.tz is None: t2=t2.tz_localize('UTC')
+    t1=t1.astimezone('CET')
+    t2=t2.astimezone('CET')
+    rate=0.
+    toProbe=[]
+    for variable in listOfVariables:
+        cached=None
+        if useCache and calsCache.enabled and fundamental=='':
+            with _calsCacheLock:
+                cached=_readCache(variable)
+        if cached is None or len(cached[1])==0:
+            toProbe.append(variable)
+            continue
+        intervals, timestamps, values = cached
+        coveredTime=np.sum(intervals[:,1]-intervals[:,0])
+        rate+=len(timestamps)/max(coveredTime,1.)*(8.+np.asarray(values[0]).nbytes)
+    if len(toProbe):
+        probeEnd=min(t1+pd.Timedelta(probe), t2)
+        DATA=_calsGet(toProbe, t1, probeEnd, fundamental=fundamental, useCache=useCache)
+        probeTime=max((probeEnd-t1).total_seconds(),1.)
+        for variable in DATA:
+            if len(DATA[variable][0]):
+                rate+=len(DATA[variable][0])/probeTime*(8.+np.asarray(DATA[variable][1][0]).nbytes)
+    return rate
+
+def _fetchAdaptive(listOfVariables, t1, t2, fundamental='', verbose=False, useCache=True, minSpan=pd.Timedelta('1s')):
+    '''
+    As _noSplitcals2pd but a failing window is halved (recursively, down to minSpan) and its halves extracted instead.
+    As for the fixed split of cals2pd, a timestamp on the boundary between two halves is kept from both.
+    '''
+    try:
+        return _noSplitcals2pd(listOfVariables, t1, t2, fundamental=fundamental, verbose=verbose, useCache=useCache)
+    except Exception as e:
+        if (t2-t1)<=2*minSpan:
+            raise
+        middle=t1+(t2-t1)/2
+        if verbose: print(('Window '+str(t1)+' - '+str(t2)+' failed ('+str(e)+'), halving it.'))
+        return pd.concat([_fetchAdaptive(listOfVariables, t1, middle, fundamental, verbose, useCache, minSpan),
+                          _fetchAdaptive(listOfVariables, middle, t2, fundamental, verbose, useCache, minSpan)], sort=True)
+
+def cals2pd(listOfVariables, t1, t2, fundamental='', split=1, verbose=False, useCache=True,
+            max_workers=4, retries=2, targetBytes=50e6): 
     '''
-    cals2pd(listOfVariables, t1, t2, fundamental='', split=1, verbose=False)
+    cals2pd(listOfVariables, t1, t2, fundamental='', split=1, verbose=False, useCache=True,
+            max_workers=4, retries=2, targetBytes=50e6)
 
     This is the most important function of the importData class.
 
@@ -109,6 +514,16 @@ def cals2pd(listOfVariables, t1, t2, fundamental='', split=1, verbose=False):
     It can be used to filter fundamentals (especially intended for the injectors).
     It can be used in the verbose mode if the corresponding flag is True.
     The data extraction can be done splitting it in several n intervals (split=n). 
+    The n intervals are extracted in parallel by a pool of max_workers threads.
+    A failing interval is retried up to retries times while the other intervals keep going;
+    if it still fails an exception is raised at the end (the intervals already extracted are in the cache).
+    With split='auto' the number of intervals is chosen so that each request is about targetBytes,
+    using the point density and the point size of each variable (from the local cache or from a small probe
+    at t1), and a failing interval is halved and extracted again instead of being retried as it is.
+
+    The extracted data are stored in a local cache (see importData.calsCache for its folder and size),
+    so that only the intervals never extracted before are requested to CALS.
+    To bypass the cache use useCache=False.
 
     ===Example===     
 
@@ -119,23 +534,407 @@ def cals2pd(listOfVariables, t1, t2, fundamental='', split=1, verbose=False):
     # By default the index timezone is UTC but, even if not encouraged, you can chance the index time zone.
     raw_data.index=raw_data.index.tz_convert('CET')
     '''
+    adaptive=(split=='auto')
+    if adaptive:
+        # the '%' patterns are resolved once for the probe and all the windows
+        listOfVariables=_smartList(listOfVariables)
+        rate=_bytesPerSecond(listOfVariables, t1, t2, fundamental=fundamental, useCache=useCache)
+        split=int(np.ceil(rate*(t2-t1).total_seconds()/float(targetBytes)))
+        if verbose: print(('Estimated '+str(rate)+' bytes/s: '+str(max(split,1))+' windows.'))
     if split<1: split=1
 
     if split==1: 
-        myDF=_noSplitcals2pd(listOfVariables, t1, t2, fundamental, verbose)
+        if adaptive:
+            myDF=_fetchAdaptive(listOfVariables, t1, t2, fundamental, verbose, useCache)
+        else:
+            myDF=_noSplitcals2pd(listOfVariables, t1, t2, fundamental, verbose, useCache)
     else:
+        from concurrent.futures import ThreadPoolExecutor
         times= pd.to_datetime(np.linspace(t1.value, t2.value, split+1))
-        myDF=pd.DataFrame()
-        for i in range(len(times)-1):
-            if verbose: print(('Time window: '+str(i+1))) 
-            aux=_noSplitcals2pd(listOfVariables,times[i],times[i+1], fundamental=fundamental, verbose=verbose)
-            myDF=pd.concat([myDF,aux], sort=True)
+        # the '%' patterns are resolved once for all the windows
+        listOfVariables=_smartList(listOfVariables)
+        listDF=[None]*split
+        failedWindows=[]
+        with ThreadPoolExecutor(max_workers=max(1,min(max_workers,split))) as executor:
+            if adaptive:
+                futures=[executor.submit(_fetchAdaptive, listOfVariables, times[i], times[i+1],
+                                         fundamental, verbose, useCache) for i in range(split)]
+            else:
+                futures=[executor.submit(_fetchWindow, listOfVariables, times[i], times[i+1],
+                                         fundamental, verbose, useCache, retries) for i in range(split)]
+            for i in range(split):
+                if verbose: print(('Time window: '+str(i+1)))
+                try:
+                    listDF[i]=futures[i].result()
+                except Exception as e:
+                    failedWindows.append((times[i],times[i+1],e))
+        if len(failedWindows):
+            raise RuntimeError('Extraction failed for the time windows: '+
+                               ', '.join([str(a)+' - '+str(b)+' ('+str(e)+')' for a,b,e in failedWindows]))
+        myDF=pd.concat(listDF, sort=True)
     return myDF.sort_index(axis=1)
 
-def cycleStamp2pd(variablesList,cycleStampList,verbose=False):
+def cals2pd_iter(listOfVariables, t1, t2, chunk=pd.Timedelta('1h'), maxBytes=None, fundamental='',
+                 verbose=False, useCache=True, retries=2):
+    '''
+    cals2pd_iter(listOfVariables, t1, t2, chunk=pd.Timedelta('1h'), maxBytes=None, fundamental='',
+                 verbose=False, useCache=True, retries=2)
+
+    Generator version of cals2pd: it yields the listOfVariables within the interval [t1,t2]
+    as time-ordered dataframes of limited size (same format as cals2pd), so that long extractions
+    can be reduced chunk by chunk with constant memory.
+
+    - chunk: the time span of each extraction.
+    - maxBytes: if not None, the time span of the next chunk is rescaled from the memory footprint
+      of the previous one, so that each chunk is about maxBytes (chunk is then only the first span).
+
+    A timestamp is yielded only once even if it falls on the boundary between two chunks.
+
+    ===Example===
+    t1 = pd.Timestamp('2017-10-01', tz='CET')
+    t2 = pd.Timestamp('2017-10-31', tz='CET')
+    listDF=[]
+    for myDF in importData.cals2pd_iter(['LHC.BCTFR.A6R4.B1:BUNCH_INTENSITY'], t1, t2, maxBytes=200e6):
+        listDF.append(myDF.resample('10min').first())
+    '''
+    t1=pd.Timestamp(t1)
+    t2=pd.Timestamp(t2)
+    if t1.tz is None: t1=t1.tz_localize('UTC')
+    if t2.tz is None: t2=t2.tz_localize('UTC')
+    # the '%' patterns are resolved once for all the chunks
+    listOfVariables=_smartList(listOfVariables)
+    span=pd.Timedelta(chunk)
+    start=t1
+    lastTimestamp=None
+    while start<t2:
+        end=min(start+span, t2)
+        if verbose: print(('Chunk: '+str(start)+' - '+str(end)))
+        myDF=_fetchWindow(listOfVariables, start, end, fundamental, verbose, useCache, retries)
+        if lastTimestamp is not None and len(myDF):
+            myDF=myDF[myDF.index>lastTimestamp]
+        if maxBytes is not None and len(myDF):
+            myBytes=myDF.memory_usage(deep=True).sum()
+            # vectors are stored as views on arrays, their payload is not counted by pandas
+            for column in myDF.columns[myDF.dtypes==object]:
+                myBytes+=sum([np.asarray(x).nbytes for x in myDF[column].values if isinstance(x, np.ndarray)])
+            span=max(pd.Timedelta('1s'), (end-start)*float(maxBytes)/max(myBytes,1))
+        if len(myDF):
+            lastTimestamp=myDF.index[-1]
+            yield myDF.sort_index(axis=1)
+        start=end
+
+def _nullColumns2object(myDF):
+    '''
+    Return myDF with the columns without data as object columns of None:
+    pyarrow converts them to null values of any type of the schema.
+    '''
+    myDF=myDF.copy()
+    for i in myDF.columns:
+        if myDF[i].isna().all():
+            myDF[i]=pd.Series([None]*len(myDF), index=myDF.index, dtype=object)
+    return myDF
+
+def _chunks2parquet(chunks, columns, fileName, probe):
+    '''
+    Append the pd.DataFrame chunks to the Parquet file fileName (one row group per chunk) with the columns.
+    The schema is fixed at the first chunk: the type of the columns without data in the first chunk
+    is the one of the value returned by probe(listOfColumns) (a dict column->value, float64 if missing).
+    It returns the number of rows written.
+
+    This function is supposed to be private.
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer=None
+    noOfRows=0
+    try:
+        for myDF in chunks:
+            myDF=_nullColumns2object(myDF.reindex(columns=columns))
+            if writer is None:
+                schema=pa.Table.from_pandas(myDF, preserve_index=True).schema
+                nullColumns=[i for i in columns if schema.field(i).type==pa.null()]
+                samples=probe(nullColumns) if len(nullColumns) else {}
+                for i in nullColumns:
+                    aux=samples.get(i, np.nan)
+                    myType=pa.float64() if np.ndim(aux)==0 and pd.isnull(aux) else pa.array([aux], from_pandas=True).type
+                    schema=schema.set(schema.get_field_index(i), pa.field(i, myType))
+                writer=pq.ParquetWriter(fileName, schema)
+            writer.write_table(pa.Table.from_pandas(myDF, schema=writer.schema, preserve_index=True))
+            noOfRows+=len(myDF)
+    finally:
+        if writer is not None:
+            writer.close()
+    return noOfRows
+
+def cals2parquet(listOfVariables, t1, t2, fileName, chunk=pd.Timedelta('1h'), maxBytes=None, fundamental='',
+                 verbose=False, useCache=True, retries=2):
+    '''
+    cals2parquet(listOfVariables, t1, t2, fileName, chunk=pd.Timedelta('1h'), maxBytes=None, fundamental='',
+                 verbose=False, useCache=True, retries=2)
+
+    Extract the listOfVariables within the interval [t1,t2] with cals2pd_iter and append the chunks
+    to the Parquet file fileName (one row group per chunk), without keeping the whole interval in memory.
+    It requires pyarrow. The schema is fixed by the first chunk: the type of a variable without data
+    in the first chunk (e.g., a sparse telegram) is taken from its first value after t1 (see calsAsOf).
+    All the variables are written in every row group (null where a variable has no data in a chunk).
+    It returns the number of rows written.
+
+    ===Example===
+    t1 = pd.Timestamp('2017-10-01', tz='CET')
+    t2 = pd.Timestamp('2017-10-31', tz='CET')
+    importData.cals2parquet(['LHC.BCTFR.A6R4.B1:BUNCH_INTENSITY'], t1, t2, 'FBCT_B1.parquet', maxBytes=200e6)
+    myDF=pd.read_parquet('FBCT_B1.parquet')
+    '''
+    listOfVariables=_smartList(listOfVariables)
+    columns=sorted([str(i) for i in listOfVariables])
+
+    def probe(nullColumns):
+        if verbose: print(('Type from the first value of: '+str(nullColumns)))
+        aux=calsAsOf([(i, t1, 'next') for i in nullColumns], verbose=verbose, useCache=useCache)
+        return dict(zip(aux['variable'], aux['value']))
+
+    return _chunks2parquet(cals2pd_iter(listOfVariables, t1, t2, chunk=chunk, maxBytes=maxBytes,
+                                        fundamental=fundamental, verbose=verbose, useCache=useCache,
+                                        retries=retries),
+                           columns, fileName, probe)
+
+class CALSVector:
+    '''
+    A vector-valued CALS variable (e.g., LHC.BCTFR.A6R4.B1:BUNCH_INTENSITY) represented as a
+    contiguous 2D numpy array of shape (n_timestamps, n_elements) with a timestamp index.
+
+    - name: the CALS variable
+    - index: the UTC-localized pd.DatetimeIndex of the rows
+    - values: the 2D numpy array (it can be a read-only np.memmap)
+
+    ===Example===
+    myVectors=importData.cals2vectors(['LHC.BCTFR.A6R4.B%:BUNCH_INTENSITY'], t1, t2)
+    B1=myVectors['LHC.BCTFR.A6R4.B1:BUNCH_INTENSITY']
+    B1.bunch(10).plot()          # the bunch slot 10 (a view, no copy)
+    B1.toDataFrame([10,11,12])   # as MDanalysis.list2col
+    '''
+    def __init__(self, name, index, values):
+        self.name=name
+        self.index=index
+        self.values=values
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return 'CALSVector('+self.name+', shape='+str(self.values.shape)+', dtype='+str(self.values.dtype)+')'
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def bunch(self, noBunch):
+        '''
+        Return the pd.Series of the element noBunch (e.g., the bunch slot) of the vector.
+        The values are a view of the 2D array.
+        '''
+        return pd.Series(self.values[:,noBunch], index=self.index, name=noBunch, copy=False)
+
+    def toDataFrame(self, bunchList=None):
+        '''
+        Return a pd.DataFrame with one column per element in bunchList (all the elements if None).
+        '''
+        if bunchList is None:
+            bunchList=np.arange(self.values.shape[1])
+        bunchList=pd.unique(np.asarray(bunchList))
+        return pd.DataFrame(self.values[:,bunchList], index=self.index, columns=bunchList)
+
+def _vectors2array(values):
+    '''
+    Return the vector values of cals.get as a contiguous 2D array.
+    Vectors of different length are padded with NaN.
+    '''
+    values=np.asarray(values)
+    if values.ndim==2:
+        return np.ascontiguousarray(values)
+    if len(values)==0:
+        return np.zeros((0,0))
+    lengths=[len(i) for i in values]
+    if len(set(lengths))==1:
+        return np.ascontiguousarray(np.stack(values))
+    aux=np.full((len(values),max(lengths)), np.nan)
+    for i,j in enumerate(values):
+        aux[i,:len(j)]=j
+    return aux
+
+def cals2vectors(listOfVariables, t1, t2, fundamental='', verbose=False, useCache=True, memmapFolder=None):
+    '''
+    cals2vectors(listOfVariables, t1, t2, fundamental='', verbose=False, useCache=True, memmapFolder=None)
+
+    Return a dotdict with a CALSVector for each vector-valued variable of listOfVariables within the interval [t1,t2].
+    Instead of one python list per row (as in cals2pd), each variable is a contiguous 2D numpy array
+    (n_timestamps, n_elements), e.g. (n_timestamps, 3564) for the bunch-by-bunch variables.
+    The scalar variables are ignored.
+
+    t1 and t2 are pandas datetime (tz-naive expressions will be consider UTC-localized).
+    If memmapFolder is given the arrays are stored there as .npy files and returned as read-only memory maps.
+    The local CALS cache is used unless useCache is False (see cals2pd).
+
+    ===Example===
+    t1 = pd.Timestamp('2018-07-01 10:00', tz='CET')
+    t2 = pd.Timestamp('2018-07-01 12:00', tz='CET')
+    myVectors=importData.cals2vectors(['LHC.BCTFR.A6R4.B%:BUNCH_INTENSITY','ATLAS:BUNCH_LUMI_INST'],t1,t2)
+    myVectors['ATLAS:BUNCH_LUMI_INST'].bunch(1000)
+    '''
+    listOfVariables=_smartList(listOfVariables)
+    if t1.tz==None: t1=t1.tz_localize('UTC')
+    t1=t1.astimezone('CET')
+    if not isinstance(t2, str):
+        if t2.tz==None: t2=t2.tz_localize('UTC')
+        t2=t2.astimezone('CET')
+    DATA=_calsGet(listOfVariables,t1,t2,fundamental,verbose=verbose,useCache=useCache)
+
+    myVectors=dotdict()
+    for i in listOfVariables:
+        if i not in DATA: continue
+        values=np.asarray(DATA[i][1])
+        if (values.ndim<2) and not (values.dtype.kind=='O' and len(values) and np.ndim(values[0])==1):
+            if verbose: print(('Not a vector variable: '+i))
+            continue
+        values=_vectors2array(values)
+        myIndex=pd.to_datetime(np.asarray(DATA[i][0],dtype=float),unit='s').tz_localize('UTC')
+        if memmapFolder is not None:
+            if not os.path.exists(memmapFolder):
+                os.makedirs(memmapFolder)
+            fileName=os.path.join(memmapFolder, re.sub(r'[^A-Za-z0-9_.-]','_',i)+'_'+
+                                  hashlib.md5((i+str(t1)+str(t2)).encode()).hexdigest()[:8]+'.npy')
+            aux=np.lib.format.open_memmap(fileName, mode='w+', dtype=values.dtype, shape=values.shape)
+            aux[:]=values
+            aux.flush()
+            del aux
+            values=np.load(fileName, mmap_mode='r')
+            if verbose: print(('Memory map: '+fileName))
+        myVectors[str(i)]=CALSVector(str(i), myIndex, values)
+    return myVectors
+
+def _asOf(timestamps, intervals, instants, direction):
+    '''
+    For each instant return the position in the sorted timestamps of the last (direction='last') or
+    next (direction='next') point, or -1 if it cannot be trusted, i.e. if the interval between the
+    instant and the point is not entirely covered by one of the (sorted, disjoint) intervals
+    where the timestamps are complete.
+    '''
+    positions=np.full(len(instants), -1)
+    if len(intervals)==0:
+        return positions
+    k=np.searchsorted(intervals[:,0], instants, side='right')-1
+    inside=(k>=0)
+    inside[inside]=instants[inside]<=intervals[k[inside],1]
+    if direction=='last':
+        aux=np.searchsorted(timestamps, instants, side='right')-1
+        valid=inside & (aux>=0)
+        valid[valid]=timestamps[aux[valid]]>=intervals[k[valid],0]
+    else:
+        aux=np.searchsorted(timestamps, instants, side='left')
+        valid=inside & (aux<len(timestamps))
+        valid[valid]=timestamps[aux[valid]]<=intervals[k[valid],1]
+    positions[valid]=aux[valid]
+    return positions
+
+def calsAsOf(queries, lookback=pd.Timedelta('1h'), gap=pd.Timedelta('1h'), verbose=False, useCache=True):
+    '''
+    calsAsOf(queries, lookback=pd.Timedelta('1h'), gap=pd.Timedelta('1h'), verbose=False, useCache=True)
+
+    Return the value of many variables at many instants, with the minimum number of CALS requests.
+
+    queries is a DataFrame (or a list of tuples) with the columns variable, timestamp and direction
+    (direction is 'last' or 'next', as for cals2pd(variable, timestamp, direction)).
+    It returns the queries with the columns valueTimestamp and value (NaT and NaN if nothing is found).
+
+    The queries are resolved
+    1. from the local CALS cache, when the cached intervals cover the instant and the point found,
+    2. by extracting the windows [timestamp-lookback, timestamp] ('last') or [timestamp, timestamp+lookback] ('next')
+       of all the variables together: the windows closer than gap are coalesced in a single request,
+    3. by one cals.get(variables, timestamp, direction) per instant (all the variables together)
+       for the remaining queries (no point within lookback).
+    Tz-naive timestamps will be consider UTC-localized.
+
+    ===Example===
+    now=pd.Timestamp.now(tz='CET')
+    importData.calsAsOf([('LHC.BCTDC.A6R4.B1:BEAM_INTENSITY', now, 'last'), ('HX:FILLN', now, 'last')])
+    '''
+    queries=pd.DataFrame(queries, columns=None if isinstance(queries, pd.DataFrame) else ['variable','timestamp','direction'])
+    queries=queries[['variable','timestamp','direction']].reset_index(drop=True)
+    aux=pd.DatetimeIndex(pd.to_datetime(queries['timestamp']))
+    if aux.tz is None: aux=aux.tz_localize('UTC')
+    queries['timestamp']=aux.tz_convert('UTC')
+    instants=queries['timestamp'].map(lambda x: x.timestamp()).values.astype(float)
+    valueTimestamps=np.full(len(queries), np.nan)
+    values=np.full(len(queries), np.nan, dtype=object)
+
+    def resolve(variable, DATAtimestamps, DATAvalues, intervals, myFilter):
+        # fill the queries selected by myFilter for the variable, return the unresolved mask
+        for direction in ['last','next']:
+            selection=myFilter & (queries['variable'].values==variable) & (queries['direction'].values==direction)
+            if not selection.any(): continue
+            myPositions=_asOf(DATAtimestamps, intervals, instants[selection], direction)
+            found=np.where(selection)[0][myPositions>=0]
+            valueTimestamps[found]=DATAtimestamps[myPositions[myPositions>=0]]
+            for i,j in zip(found, myPositions[myPositions>=0]):
+                values[i]=DATAvalues[j]
+
+    # 1. local cache
+    if useCache and calsCache.enabled:
+        for variable in pd.unique(queries['variable']):
+            with _calsCacheLock:
+                cached=_readCache(variable)
+            if cached is not None:
+                resolve(variable, cached[1], cached[2], cached[0], np.ones(len(queries),dtype=bool))
+    if verbose: print((str(int(np.isfinite(valueTimestamps).sum()))+' queries resolved from the cache.'))
+
+    # 2. coalesced windows
+    unresolved=~np.isfinite(valueTimestamps)
+    if unresolved.any():
+        aux=queries[unresolved]
+        isLast=(aux['direction']=='last').values
+        windows=pd.DataFrame({'t1':np.where(isLast, aux['timestamp']-lookback, aux['timestamp']),
+                              't2':np.where(isLast, aux['timestamp'], aux['timestamp']+lookback)})
+        windows['t1']=pd.to_datetime(windows['t1'],utc=True)
+        windows['t2']=pd.to_datetime(windows['t2'],utc=True)
+        requests, windowRequest = _planRequests(windows, gap)
+        if verbose: print((str(len(requests))+' requests for '+str(len(aux))+' queries.'))
+        for i,row in requests.iterrows():
+            myFilter=np.zeros(len(queries),dtype=bool)
+            myFilter[np.where(unresolved)[0][windowRequest==i]]=True
+            variables=list(pd.unique(queries['variable'][myFilter]))
+            DATA=_calsGet(variables, row['t1'].astimezone('CET'), row['t2'].astimezone('CET'),
+                          verbose=verbose, useCache=useCache)
+            for variable in variables:
+                if variable not in DATA: continue
+                resolve(variable, np.asarray(DATA[variable][0],dtype=float), DATA[variable][1],
+                        np.array([[row['t1'].timestamp(), row['t2'].timestamp()]]), myFilter)
+
+    # 3. one request per instant
+    unresolved=~np.isfinite(valueTimestamps)
+    if unresolved.any():
+        aux=queries[unresolved]
+        if verbose: print((str(len(aux))+' queries resolved instant by instant.'))
+        for (timestamp, direction), group in aux.groupby(['timestamp','direction']):
+            DATA=cals.get(list(pd.unique(group['variable'])), timestamp.astimezone('CET'), direction)
+            for i,variable in zip(group.index, group['variable']):
+                if (variable in DATA) and len(DATA[variable][0]):
+                    valueTimestamps[i]=DATA[variable][0][0]
+                    values[i]=DATA[variable][1][0]
+
+    queries['valueTimestamp']=pd.to_datetime(valueTimestamps,unit='s').tz_localize('UTC')
+    queries['value']=values
+    return queries
+
+def cycleStamp2pd(variablesList,cycleStampList,verbose=False,fundamental='',gap=pd.Timedelta('10min'),
+                  tolerance=pd.Timedelta('100us'),useCache=True):
     '''
     Return a pandas DataFrame with the specified variables and cyclestamps.
-    This can be significantly slow since it accesses CALS for each cyclestamp.
+
+    The cyclestamps are clustered in covering windows (two consecutive cyclestamps closer than gap
+    are in the same window), each window is extracted once (with the fundamental filter, if any)
+    and the rows at the cyclestamps are picked out: a row is matched to the nearest cyclestamp within
+    tolerance (the default absorbs the float rounding of the CALS timestamps).
+    Tz-naive cyclestamps will be consider UTC-localized. The index of the output is UTC-localized.
 
     ===Example===     
     startTime=pd.Timestamp('2018-03-27 06:00')
@@ -144,14 +943,34 @@ def cycleStamp2pd(variablesList,cycleStampList,verbose=False):
     # to get the correspind PSB of the 1st batch
     importData.cycleStamp2pd(['PSB.LSA:CYCLE'],CPSDF.index[1:]-pd.offsets.Milli(635))
     '''
-
-    myDF=pd.DataFrame()
-    for i in cycleStampList:
-        if verbose:
-            print(i)
-        aux=cals2pd(variablesList,i,i)
-        myDF=myDF.combine_first(aux)
-    return myDF 
+    stamps=pd.DatetimeIndex(cycleStampList)
+    if len(stamps)==0 or len(variablesList)==0:
+        return pd.DataFrame()
+    if stamps.tz is None: stamps=stamps.tz_localize('UTC')
+    stamps=stamps.tz_convert('UTC').dropna().unique().sort_values()
+    stampsNs=stamps.tz_localize(None).values.astype('datetime64[ns]').astype(np.int64)
+    # a new window starts where the distance from the previous cyclestamp exceeds gap
+    cuts=np.where(np.diff(stampsNs)>pd.Timedelta(gap).value)[0]+1
+    firsts=np.concatenate([[0],cuts])
+    lasts=np.concatenate([cuts,[len(stamps)]])-1
+    tol=pd.Timedelta(tolerance)
+    listDF=[]
+    for a,b in zip(firsts,lasts):
+        if verbose: print(('Window: '+str(stamps[a])+' - '+str(stamps[b])+' ('+str(b-a+1)+' cyclestamps)'))
+        aux=cals2pd(variablesList, stamps[a]-tol, stamps[b]+tol, fundamental=fundamental,
+                    verbose=verbose, useCache=useCache)
+        if len(aux)==0:
+            continue
+        auxNs=aux.index.tz_localize(None).values.astype('datetime64[ns]').astype(np.int64)
+        myStamps=stampsNs[a:b+1]
+        # nearest cyclestamp of each row
+        k=np.clip(np.searchsorted(myStamps, auxNs), 1, max(len(myStamps)-1,1))
+        k=np.where(np.abs(myStamps[k-1]-auxNs)<=np.abs(myStamps[np.minimum(k,len(myStamps)-1)]-auxNs), k-1, k)
+        listDF.append(aux[np.abs(myStamps[k]-auxNs)<=tol.value])
+    if listDF==[]:
+        return pd.DataFrame()
+    myDF=pd.concat(listDF, sort=True)
+    return myDF[~myDF.index.duplicated(keep='first')].sort_index()
 
 def _UTClocalizeMe(x):
     '''
@@ -162,7 +981,107 @@ def _UTClocalizeMe(x):
     except:
          return x # in case NaT or None
 
-def LHCFillsByTime(t1,t2, verbose=False):
+def _fillIndexConnect():
+    '''
+    Return a sqlite3 connection to the local index of the LHC fills (in the calsCache.folder).
+
+    The index has three tables:
+    - fills (fillNumber, startTime, endTime)
+    - modes (fillNumber, mode, startTime, endTime)
+    - meta (key, value) with the interval [syncedFrom, syncedTo] already synchronized with CALS.
+    The times are UNIX seconds (UTC), endTime is NULL for the fill (or the mode) still ongoing.
+    '''
+    import sqlite3
+    if not os.path.exists(calsCache.folder):
+        os.makedirs(calsCache.folder)
+    conn=sqlite3.connect(os.path.join(calsCache.folder,'LHCFills.sqlite'))
+    conn.execute('CREATE TABLE IF NOT EXISTS fills (fillNumber INTEGER PRIMARY KEY, startTime REAL, endTime REAL)')
+    conn.execute('CREATE TABLE IF NOT EXISTS modes (fillNumber INTEGER, mode TEXT, startTime REAL, endTime REAL)')
+    conn.execute('CREATE INDEX IF NOT EXISTS modesFill ON modes (fillNumber)')
+    conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)')
+    return conn
+
+def _syncFillIndex(conn, t1, t2, verbose=False):
+    '''
+    Extend the local fill index to cover [t1,t2] (UNIX seconds).
+    Only the missing parts are requested to CALS, with one cals.getLHCFillsByTime per side.
+    '''
+    meta=dict(conn.execute('SELECT key, value FROM meta').fetchall())
+    t2=min(t2, time.time())
+    if 'syncedFrom' not in meta:
+        toSync=[(t1,t2)]
+    else:
+        toSync=[]
+        if t1<meta['syncedFrom']: toSync.append((t1,meta['syncedFrom']))
+        if t2>meta['syncedTo']: toSync.append((meta['syncedTo'],t2))
+    for a,b in toSync:
+        if verbose: print(('Fill index sync: '+str(pd.Timestamp(a,unit='s'))+' - '+str(pd.Timestamp(b,unit='s'))))
+        DATA=cals.getLHCFillsByTime(pd.Timestamp(a,unit='s',tz='UTC').astimezone('CET'),
+                                    pd.Timestamp(b,unit='s',tz='UTC').astimezone('CET'))
+        openStart=np.inf
+        for i in DATA:
+            conn.execute('DELETE FROM modes WHERE fillNumber=?', (i['fillNumber'],))
+            conn.execute('INSERT OR REPLACE INTO fills VALUES (?,?,?)', (i['fillNumber'],i['startTime'],i['endTime']))
+            conn.executemany('INSERT INTO modes VALUES (?,?,?,?)',
+                             [(i['fillNumber'],j['mode'],j['startTime'],j['endTime']) for j in i['beamModes']])
+            if i['endTime'] is None:
+                openStart=min(openStart,i['startTime'])
+        meta['syncedFrom']=min(meta.get('syncedFrom',a),a)
+        meta['syncedTo']=max(meta.get('syncedTo',b),b)
+        # the ongoing fill has to be synchronized again next time
+        meta['syncedTo']=min(meta['syncedTo'],openStart)
+        conn.executemany('INSERT OR REPLACE INTO meta VALUES (?,?)', list(meta.items()))
+        conn.commit()
+
+def _fills2pd(fills, modes, fillEndFromModes=False):
+    '''
+    Return the fills and their beam modes in the format of LHCFillsByTime/LHCFillsByNumber.
+    fills (fillNumber, startTime, endTime) and modes (fillNumber, mode, startTime, endTime) are dataframes
+    with the times in UNIX seconds (NaN for the fill, or the mode, still ongoing), the modes in chronological order.
+    If fillEndFromModes is True, as cals.getLHCFillData, the ongoing fill ends with its last beam mode.
+    '''
+    fills=fills.copy()
+    if fillEndFromModes and len(fills):
+        lastEnd=modes.groupby('fillNumber')['endTime'].last()
+        fills['endTime']=fills['endTime'].fillna(fills['fillNumber'].map(lastEnd))
+    fills['mode']='FILL'
+    # with a stable sort the FILL row precedes its first beam mode
+    aux=pd.concat([fills,modes], sort=True)
+    for i in ['startTime','endTime']:
+        aux[i]=pd.to_datetime(aux[i].astype(float),unit='s',utc=True)
+    aux['duration']=aux['endTime']-aux['startTime']
+    aux=aux.set_index('fillNumber')
+    aux.index.name=None
+    return aux.sort_values('startTime', kind='mergesort')[['mode','startTime','endTime','duration']]
+
+def _fillIndex2pd(conn, whereClause, parameters, fillEndFromModes=False):
+    '''
+    Return the fills (and their beam modes) of the local index selected by the whereClause on the fills table,
+    in the format of LHCFillsByTime/LHCFillsByNumber.
+    '''
+    fills=pd.read_sql_query('SELECT fillNumber, startTime, endTime FROM fills WHERE '+whereClause, conn, params=parameters)
+    modes=pd.read_sql_query('SELECT fillNumber, mode, startTime, endTime FROM modes WHERE fillNumber IN '+
+                            '(SELECT fillNumber FROM fills WHERE '+whereClause+') ORDER BY rowid', conn, params=parameters)
+    return _fills2pd(fills, modes, fillEndFromModes)
+
+def _fillsDATA2pd(DATA, fillEndFromModes=False):
+    '''
+    Return the list of fill dictionaries of cals.getLHCFillsByTime (or of cals.getLHCFillData)
+    in the format of LHCFillsByTime/LHCFillsByNumber. The None times (ongoing fill or mode) become NaT.
+    '''
+    fills=pd.DataFrame({'fillNumber':[i['fillNumber'] for i in DATA],
+                        'startTime':np.array([i['startTime'] for i in DATA],dtype=float),
+                        'endTime':np.array([np.nan if i['endTime'] is None else i['endTime'] for i in DATA],dtype=float)},
+                       columns=['fillNumber','startTime','endTime'])
+    modes=pd.DataFrame({'fillNumber':[i['fillNumber'] for i in DATA for j in i['beamModes']],
+                        'mode':[j['mode'] for i in DATA for j in i['beamModes']],
+                        'startTime':np.array([j['startTime'] for i in DATA for j in i['beamModes']],dtype=float),
+                        'endTime':np.array([np.nan if j['endTime'] is None else j['endTime']
+                                            for i in DATA for j in i['beamModes']],dtype=float)},
+                       columns=['fillNumber','mode','startTime','endTime'])
+    return _fills2pd(fills, modes, fillEndFromModes)
+
+def LHCFillsByTime(t1,t2, verbose=False, useIndex=True):
     '''
     Retrieve the LHC fills between t1 and t2.
 
@@ -174,6 +1093,10 @@ def LHCFillsByTime(t1,t2, verbose=False):
     If, at the moment of the CALS extraction, the fill is not yet dumped,
     the endTime of the fill is assigned to NaT (Not a Time).
 
+    The fills are read from a local index (in importData.calsCache.folder) that is
+    synchronized with CALS only for the time intervals not yet indexed.
+    To query directly CALS use useIndex=False.
+
     ===Example===
 
     t1 = pd.Timestamp('2017-10-01')  # interpreted as tz='UTC'
@@ -186,433 +1109,284 @@ def LHCFillsByTime(t1,t2, verbose=False):
     summary['startTime']=summary['startTime'].apply(lambda x: x.astimezone('CET'))
     '''
 
-    if t1.tz==None: t1.tz_localize('UTC')
-    else: t1=t1.astimezone('CET')
-
-    if t2.tz==None: t2.tz_localize('UTC')
-    else: t2=t2.astimezone('CET')
-
-    DATA=cals.getLHCFillsByTime(t1,t2)
-
-    fillNumberList, beamModesList = [], []
-    startTimeList, endTimeList = [], []
-    FN, ST, ET =[], [], [] #fillNumber, startTime, endTime
-
-    for i in DATA:
-        FN.append(i['fillNumber']); ST.append(i['startTime']); ET.append(i['endTime'])
-        for j in i['beamModes']:
-            fillNumberList.append(i['fillNumber']); beamModesList.append(j['mode'])
-            startTimeList.append(j['startTime']); endTimeList.append(j['endTime'])
-
-    auxDataFrame=pd.DataFrame()
-    auxDataFrame['mode']=pd.Series(beamModesList, fillNumberList)
-    auxDataFrame['startTime']=pd.Series(pd.to_datetime(startTimeList,unit='s'), fillNumberList)
-    auxDataFrame['endTime']=pd.Series(pd.to_datetime(endTimeList,unit='s'), fillNumberList)
-    auxDataFrame['duration']=auxDataFrame['endTime']-auxDataFrame['startTime']
+    if useIndex and calsCache.enabled:
+        if t1.tz==None: t1=t1.tz_localize('UTC')
+        if t2.tz==None: t2=t2.tz_localize('UTC')
+        with _calsCacheLock:
+            conn=_fillIndexConnect()
+            try:
+                _syncFillIndex(conn, t1.timestamp(), t2.timestamp(), verbose)
+                return _fillIndex2pd(conn, 'startTime<=? AND (endTime>=? OR endTime IS NULL)',
+                                     (t2.timestamp(), t1.timestamp()))
+            finally:
+                conn.close()
 
-    aux=pd.DataFrame()
-    aux['startTime']=pd.Series(pd.to_datetime(ST,unit='s'), FN)
-    aux['endTime']=pd.Series(pd.to_datetime(ET,unit='s'), FN)
-    aux['duration']=aux['endTime']-aux['startTime']
+    if t1.tz==None: t1=t1.tz_localize('UTC')
+    if t2.tz==None: t2=t2.tz_localize('UTC')
 
- 
-    aux['startTime']=aux['startTime'].apply(_UTClocalizeMe)
-    aux['endTime']=aux['endTime'].apply(_UTClocalizeMe)
+    DATA=cals.getLHCFillsByTime(t1.astimezone('CET'),t2.astimezone('CET'))
+    if verbose: print((str(len(DATA))+' fills.'))
+    return _fillsDATA2pd(DATA)
 
-    auxDataFrame['startTime']=auxDataFrame['startTime'].apply(_UTClocalizeMe)
-    auxDataFrame['endTime']=auxDataFrame['endTime'].apply(_UTClocalizeMe)
-    aux['mode']='FILL'
-    fillsSummary=aux;
-    fillsDetails=auxDataFrame;
-    out=pd.DataFrame()
-    if len(fillsSummary)>0:
-        if (len(fillsSummary)==1) & (str(fillsSummary.iloc[0]['duration'])=='NaT'):
-            # If there is only the online FILL (so not yet completed)
-            # TODO: very cumbersome casting (first to string, then concatenation, then to timestamp)
-            # I am no satisfied [GS]
-            if verbose: print('Online FILL...')
-            fillsSummary['endTime']='NaT'
-            fillsSummary['duration']='NaT'
-            fillsDetails['endTime']=fillsDetails['endTime'].astype(str)
-            fillsDetails['duration']=fillsDetails['duration'].astype(str)
-            out=pd.concat([fillsDetails,fillsSummary],sort=True)
-            out=out.sort_values('startTime')[['mode','startTime','endTime','duration']]
-            out['endTime']=out['endTime'].apply(pd.Timestamp)
-            out['duration']=out['endTime']-out['startTime']
-        else:
-            out=pd.concat([fillsDetails,fillsSummary], sort=True)
-            out=out.sort_values('startTime')[['mode','startTime','endTime','duration']]    
-    
-    return out
-
-def LHCFillsByNumber(fillList, verbose=False):
+def LHCFillsByNumber(fillList, verbose=False, useIndex=True):
     '''
-    LHCFillsByNumber(fillList, verbose=False)
+    LHCFillsByNumber(fillList, verbose=False, useIndex=True)
 
     The timestamps are time-zone-aware and by are in 'UTC'.
 
+    The fills are read from a local index (see LHCFillsByTime): if some fills are more recent
+    (older) than the indexed ones, the index is synchronized up to now (down to calsCache.fillIndexStart)
+    with a single CALS query. To query directly CALS (one query per fill) use useIndex=False.
+
     ===Example===
     df=importData.LHCFillsByNumber([6400, 5900, 5901])
     '''
-    fillsSummary, fillsDetails, aux=pd.DataFrame(),pd.DataFrame(),pd.DataFrame()
-    
     # we dilter with unique
     fillList=np.unique(fillList)
 
-    # We iterate in the fills
+    if useIndex and calsCache.enabled:
+        with _calsCacheLock:
+            conn=_fillIndexConnect()
+            try:
+                minFill, maxFill = conn.execute('SELECT MIN(fillNumber), MAX(fillNumber) FROM fills').fetchone()
+                if len(fillList) and ((minFill is None) or (fillList[0]<minFill)):
+                    _syncFillIndex(conn, calsCache.fillIndexStart.timestamp(), time.time(), verbose)
+                elif len(fillList) and (fillList[-1]>maxFill):
+                    syncedTo=conn.execute("SELECT value FROM meta WHERE key='syncedTo'").fetchone()[0]
+                    _syncFillIndex(conn, syncedTo, time.time(), verbose)
+                conn.execute('CREATE TEMP TABLE requestedFills (fillNumber INTEGER)')
+                conn.executemany('INSERT INTO requestedFills VALUES (?)', [(int(i),) for i in fillList])
+                return _fillIndex2pd(conn, 'fillNumber IN (SELECT fillNumber FROM requestedFills)', (),
+                                     fillEndFromModes=True)
+            finally:
+                conn.close()
+
+    DATA=[]
     for i in fillList:
-
         if verbose: print(('Fill ' + str(i)))
+        aux=cals.getLHCFillData(i)
+        if aux!=None:
+            DATA.append(aux)
+    return _fillsDATA2pd(DATA, fillEndFromModes=True)
 
-        DATA=cals.getLHCFillData(i)
-
-        fillNumberList=[]
-        startTimeList=[]
-        endTimeList=[]
-        beamModesList=[]
 
-        # For each fill we parse the DATA dictionary
-        if DATA!=None:
-
-            for j in DATA['beamModes']:
-                beamModesList.append(j['mode'])
-                fillNumberList.append(DATA['fillNumber'])
-                startTimeList.append(j['startTime'])
-                endTimeList.append(j['endTime'])
-
-            auxDataFrame=pd.DataFrame()
-            auxDataFrame['mode']=pd.Series(beamModesList, fillNumberList)
-            auxDataFrame['startTime']=pd.Series(pd.to_datetime(startTimeList,unit='s'), fillNumberList)
-            auxDataFrame['endTime']=pd.Series(pd.to_datetime(endTimeList,unit='s'), fillNumberList)
-            auxDataFrame['duration']=auxDataFrame['endTime']-auxDataFrame['startTime']
-
-            aux=pd.DataFrame()
-            aux['startTime']=pd.Series(pd.to_datetime(DATA['startTime'],unit='s'), [DATA['fillNumber']])
-            if DATA['endTime']==None:
-                aux['endTime']=pd.Series(pd.to_datetime(endTimeList[-1],unit='s'), [DATA['fillNumber']])
-            else:
-                aux['endTime']=pd.Series(pd.to_datetime(DATA['endTime'],unit='s'), [DATA['fillNumber']])
-            try: 
-                aux['duration']=aux['endTime']-aux['startTime']
-            except:
-                aux['duration']=pd.to_datetime(endTimeList[-1],unit='s')
-        else:
-            aux, auxDataFrame=pd.DataFrame(),pd.DataFrame()
-
-        # We concatenate the results
-        fillsSummary=pd.concat([aux,fillsSummary], sort=True)
-        fillsDetails=pd.concat([auxDataFrame,fillsDetails], sort=True)
-
-    # The timestamps are localized and the dataframes are sorted
-    if len(fillsSummary):
-        fillsSummary['startTime']=fillsSummary['startTime'].apply(_UTClocalizeMe)
-        fillsSummary['endTime']=fillsSummary['endTime'].apply(_UTClocalizeMe)
-        fillsSummary=fillsSummary.sort_values(['startTime'])
-
-        fillsDetails['startTime']=fillsDetails['startTime'].apply(_UTClocalizeMe)
-        fillsDetails['endTime']=fillsDetails['endTime'].apply(_UTClocalizeMe)
-
-        fillsDetails=fillsDetails.sort_values(['startTime'])
-
-    fillsSummary['mode']='FILL'
-    # Following two lines important for consecutive fills without modes (e.g., LHCFillsByNumber([6577,6578],verbose=True))
-    aux=fillsSummary
-
-    if len(fillsSummary)>0:
-        aux=aux.sort_values('startTime')[['mode','startTime','endTime','duration']]    
-        if (len(fillsSummary)==1) & (fillsSummary.iloc[0]['duration']==None):
-            # If there is only the online FILL (so not yet completed)
-            # TODO: very cumbersome casting (first to string, then concatenation, then to timestamp)
-            # I am no satisfied [GS]
-            if verbose: print('Online FILL...')
-            fillsSummary['endTime']='NaT'
-            fillsSummary['duration']='NaT'
-            fillsDetails['endTime']=fillsDetails['endTime'].astype(str)
-            fillsDetails['duration']=fillsDetails['duration'].astype(str)
-            aux=pd.concat([fillsDetails,fillsSummary], sort=True)
-            aux=aux.sort_values('startTime')[['mode','startTime','endTime','duration']]
-            aux['endTime']=aux['endTime'].apply(pd.Timestamp)
-            aux['duration']=aux['endTime']-aux['startTime']
-        else:
-            if len(fillsDetails)>0:
-                aux=pd.concat([fillsDetails,fillsSummary], sort=True)
-                aux=aux.sort_values('startTime')[['mode','startTime','endTime','duration']]    
-    return aux
+_massiLumiColumns=['UNIX time UTC',
+                   'Stable Beam Flag',
+                   'Luminosity [Hz/ub]',
+                   'P2P luminosity error [Hz/ub]',
+                   'Specific luminosity [Hz/ub]',
+                   'P2P specific luminosity [Hz/ub]']
 
+def _massiMember2pd(data, bunch, experiment):
+    '''
+    Parse the content (bytes) of a lumi member of a Massi file.
+    '''
+    import io
+    myDF=pd.read_csv(io.BytesIO(data), sep=' ', header=0, names=_massiLumiColumns)
+    myDF['Bunch']=np.int16(bunch)
+    myDF['Experiment']=experiment
+    return myDF
 
-def massiFile2pd(myFileName, myUnzipPath='/tmp'):
+def massiFile2pd(myFileName, myUnzipPath=None, max_workers=4):
     '''
     Transform a Massi file in form of pandas dataframe.
 
+    The members of the tgz file are streamed from the archive (nothing is written on disk,
+    myUnzipPath is kept only for backward compatibility) and parsed by a pool of max_workers threads.
+    Experiment is categorical and Bunch is int16.
+
     ===Example===     
     ATLAS=importData.massiFile2pd('/eos/user/s/sterbini/MD_ANALYSIS/2017/LHC/MD2201/ATLAS_6195.tgz')
 
     Massi files can be found at /afs/cern.ch/user/l/lpc/w0/
     Documentation about the Massi file format can be found at https://lpc.web.cern.ch/MassiFileDefinition_v2.htm
+    For many fills see massiFiles2pd.
     '''
     import tarfile
-    import os
-    import glob
-
-    tar = tarfile.open(myFileName, "r:gz")
-    tar.extractall(path=myUnzipPath)
-    filename,extension=os.path.splitext(myFileName)
-    fillNumber=tar.getnames()[0]
-    pdList=[]
-    myFiles=glob.glob(os.path.join(myUnzipPath,fillNumber)+'/*')
-    for i in myFiles:
-        filename,extension=os.path.splitext(i)
-        aux=filename.split('_')
-        if len(aux)==4:
-            MassiFileType=aux[1]
-            bunch=int(aux[2])/10
-            if MassiFileType=='lumi':
-                experiment=aux[3]
-                myDF=pd.read_csv(i,sep=' ', header=0,names=['UNIX time UTC',
-                                                              'Stable Beam Flag',
-                                                              'Luminosity [Hz/ub]',
-                                                              'P2P luminosity error [Hz/ub]',
-                                                              'Specific luminosity [Hz/ub]',
-                                                              'P2P specific luminosity [Hz/ub]'])
-                myDF['Bunch']=int(bunch)
-                myDF['FILL']=int(fillNumber)
-                myDF['Experiment']=experiment
-                myDF['Timestamp']=myDF['UNIX time UTC'].apply(lambda x: pd.Timestamp(x,unit='s').tz_localize('UTC'))
-                pdList.append(myDF)
-            else:
-                print('Only lumi file implemented.')
-        os.remove(i)
-    massiFile=pd.concat(pdList, sort=True)
-    massiFile=massiFile.set_index('Timestamp')
-    del massiFile.index.name
-    os.rmdir(os.path.join(myUnzipPath,fillNumber))
+    from concurrent.futures import ThreadPoolExecutor
+
+    futures=[]
+    with tarfile.open(myFileName, "r:gz") as tar, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        fillNumber=None
+        # the gzip stream is read sequentially, the members are parsed in parallel
+        for member in tar:
+            if fillNumber is None:
+                fillNumber=member.name.split('/')[0]
+            if not member.isfile():
+                continue
+            aux=os.path.splitext(os.path.basename(member.name))[0].split('_')
+            if len(aux)==4:
+                MassiFileType=aux[1]
+                bunch=int(aux[2])/10
+                if MassiFileType=='lumi':
+                    futures.append(executor.submit(_massiMember2pd, tar.extractfile(member).read(), int(bunch), aux[3]))
+                else:
+                    print('Only lumi file implemented.')
+        pdList=[i.result() for i in futures]
+    massiFile=pd.concat(pdList, ignore_index=True)
+    massiFile['FILL']=int(fillNumber)
+    massiFile['Experiment']=massiFile['Experiment'].astype('category')
+    massiFile.index=pd.to_datetime(massiFile['UNIX time UTC'].values, unit='s', utc=True)
+    massiFile.index.name=None
     return massiFile[['FILL','Stable Beam Flag','Experiment','Bunch','Luminosity [Hz/ub]','P2P luminosity error [Hz/ub]',
               'Specific luminosity [Hz/ub]','P2P specific luminosity [Hz/ub]']]
 
-def calsCSV2pd(myFile):
+def _parquetEngine():
     '''
-    Convert cals CVS file in a pd DataFrame.
-
-    The files are of the type in /eos/project/l/lhc-lumimod/
-    UTC time is always assumed.
+    Return True if pandas can read and write Parquet files (pyarrow or fastparquet is installed).
     '''
-    # I read the full file once to have the line numbers when a new variable starts, its name and its type
-    startLinesList = []
-    variableNameList = []
-    variableTypeList=[]
-    with open(myFile, 'r') as file:
-        lines=file.readlines()
-        i=0
-        for i in range(len(lines)):
-            if lines[i][0:8]=='VARIABLE':
-                variableName=lines[i].split(': ')[1][0:-1]
-                startLinesList.append(i)
-                variableNameList.append(variableName)            
-
-            if lines[i][0:9]=='Timestamp':
-                variableName=lines[i].split(',')[1][0:-1]
-                variableTypeList.append(variableName)
-
-        startLinesList.append(i+1)
+    for i in ['pyarrow', 'fastparquet']:
+        try:
+            __import__(i)
+            return True
+        except ImportError:
+            pass
+    return False
+
+def massiFiles2pd(fileList, cacheFolder=None, max_workers=4, verbose=False):
+    '''
+    Transform a list of Massi files (e.g., one per fill) in a single pandas dataframe (see massiFile2pd).
 
-    # in the second part I fill for each variable a pd DataFrame and I merge the dataframes.
-    # for the moment I assume that only two variable type are used ('Value' and 'Array Values')
-    # TODO: relax the assumptions above.
-    aux=pd.DataFrame()
-    for i in range(len(startLinesList)-1):
-        if variableTypeList[i]=='Value':
-            # in this case I use the pd.read_csv
-            df=pd.read_csv(myFile,skiprows=startLinesList[i]+1, nrows=startLinesList[i+1]-3-startLinesList[i],)
-            df=df.set_index('Timestamp (UTC_TIME)')
-            df=df.rename(index=str, columns={'Value': variableNameList[i] })
-            df.index=pd.DatetimeIndex(df.index)
-        if variableTypeList[i]=='Array Values':
-            # in this case I use a custom solution
-            j=startLinesList[i]+3
-            myTime=[]
-            myArray=[]
-            while j<(startLinesList[i+1]):    
-                myReading=lines[j].split(',')
-                myTime.append(myReading[0])
-                myArray.append(np.double(myReading[1:]))
-                j=j+1
-            df=pd.DataFrame({'Array Values':myArray,'Timestamp (UTC_TIME)':myTime})
-            df=df.set_index('Timestamp (UTC_TIME)')
-            df=df.rename(index=str, columns={'Array Values': variableNameList[i] })     
-            df.index=pd.DatetimeIndex(df.index)
-        # I merge to maintain the index unique
-        aux=pd.merge(aux,df, left_index=True, 
-                         right_index=True, 
-                         how='outer')
-    aux.index=aux.index.tz_localize('UTC')
-    aux=aux.sort_index()
-    del aux.index.name
-    return aux 
+    Each file is converted once: the dataframe is saved as Parquet in the cacheFolder
+    (default importData.calsCache.folder/massi) and read from there until the Massi file is modified.
+    Use cacheFolder=False not to use the cache. The Parquet files require pyarrow (or fastparquet):
+    if none is installed the cache is not used.
 
-def mat2dict(myfile):
+    ===Example===
+    import glob
+    ATLAS=importData.massiFiles2pd(sorted(glob.glob('/afs/cern.ch/user/l/lpc/w0/2018/measurements/ATLAS/lumi/*.tgz')))
     '''
-    Import a matlab file in a python structure 
+    if cacheFolder is not False and not _parquetEngine():
+        if verbose: print('No Parquet engine (pyarrow or fastparquet): the Massi files are not cached.')
+        cacheFolder=False
+    if cacheFolder is None:
+        cacheFolder=os.path.join(calsCache.folder, 'massi')
+    if cacheFolder and not os.path.exists(cacheFolder):
+        os.makedirs(cacheFolder, exist_ok=True)
+    pdList=[]
+    for myFileName in fileList:
+        if not cacheFolder:
+            pdList.append(massiFile2pd(myFileName, max_workers=max_workers))
+            continue
+        cacheFile=os.path.join(cacheFolder, os.path.basename(myFileName)+'_'+
+                               hashlib.md5(os.path.abspath(myFileName).encode()).hexdigest()[:8]+'.parquet')
+        if os.path.exists(cacheFile) and os.path.getmtime(cacheFile)>=os.path.getmtime(myFileName):
+            pdList.append(pd.read_parquet(cacheFile))
+        else:
+            myDF=massiFile2pd(myFileName, max_workers=max_workers)
+            # a temporary name unique to the writer (the cacheFolder can be shared by several processes or hosts)
+            tmpFile=cacheFile+'.'+uuid.uuid4().hex+'.tmp'
+            try:
+                myDF.to_parquet(tmpFile)
+                os.replace(tmpFile, cacheFile)
+            except Exception as e:
+                print(('The cache of '+myFileName+' is not written: '+str(e)))
+                if os.path.exists(tmpFile):
+                    os.remove(tmpFile)
+            pdList.append(myDF)
+    if pdList==[]:
+        return pd.DataFrame()
+    myDF=pd.concat(pdList)
+    # the categories of the different files are merged
+    myDF['Experiment']=myDF['Experiment'].astype('category')
+    return myDF
 
-    ===Example===     
-    aux=importData.mat2dict('/eos/user/s/sterbini/MD_ANALYSIS/2016/MD1780_80b/2016.10.26.22.23.42.135.mat')
+def _csvArrayBlock2pd(text, variableName):
     '''
-    import scipy.io
-    myDataStruct = scipy.io.loadmat(myfile,squeeze_me=True, struct_as_record=False)
-    return myDataStruct['myDataStruct']
-
-def mat2pd(variablesList,filesList, verbose=False, matlabFullInfo=False):
+    Parse the data lines of an 'Array Values' block of a CALS CSV file (timestamp,v0,v1,...)
+    in a pd.Series of 1D arrays (rows of a single 2D float array when the arrays have the same length).
     '''
-    Return a pandas DataFrame given a variable list and a file list.
+    lines=[i for i in text.splitlines() if i.strip()]
+    if len(lines)==0:
+        return pd.Series([], index=pd.DatetimeIndex([]), name=variableName, dtype=object)
+    timestamps, values = zip(*[i.split(',',1) if ',' in i else (i,'') for i in lines])
+    lengths=np.array([i.count(',')+1 if i.strip() else 0 for i in values])
+    if (lengths==lengths[0]).all():
+        array=np.fromstring(','.join(values), sep=',').reshape(len(values), lengths[0])
+        rows=list(array)
+    else:
+        rows=[np.fromstring(i, sep=',') for i in values]
+    myColumn=np.empty(len(rows), dtype=object)
+    myColumn[:]=rows
+    return pd.Series(myColumn, index=pd.to_datetime(list(timestamps)), name=variableName)
 
-    ===Example=== 
-    importData.mat2pd(['CPS_BLM.Acquisition.value.lastLosses'],\
-    ['/eos/user/s/sterbini/MD_ANALYSIS/2016/MD1780_80b/2016.10.26.22.23.42.135.mat',\
-    '/eos/user/s/sterbini/MD_ANALYSIS/2016/MD1780_80b/2016.10.26.22.23.06.147.mat'])
+def calsCSV2pd(myFile):
     '''
-    import os
-    myDataFrame=pd.DataFrame()
-    cycleStampList=[]
-    matlabObject=[]
-    matlabFilePath=[]
-    for j in variablesList:
-        exec(j.replace('.','_')+'=[]')
-    for i in filesList:
-        if verbose:
-            print(i)
-        data=mat2dict(i);
-        if matlabFullInfo:
-            matlabObject.append(data)
-        localCycleStamp=np.max(data.headerCycleStamps);
-        cycleStamp=pd.Timestamp(localCycleStamp,unit='ns')
-        cycleStampList.append(cycleStamp.tz_localize('UTC'))
-        matlabFilePath.append(os.path.abspath(i))
-        for j in variablesList:
-            if hasattr(data,j.split('.')[0]):
-                exec(j.replace('.','_') + '.append(data.' + j + ')')
-            else:
-                exec(j.replace('.','_') + '.append(np.nan)')
-    myDataFrame['matlabFilePath']=pd.Series(matlabFilePath,cycleStampList)
-    if matlabFullInfo:
-        myDataFrame['matlabFullInfo']=pd.Series(matlabObject,cycleStampList)
-    for j in variablesList:
-        exec('myDataFrame[\'' + j + '\']=pd.Series(' +j.replace('.','_')+ ',cycleStampList)')   
-    return myDataFrame.sort_index(axis=1).sort_index(axis=0)
+    Convert cals CVS file in a pd DataFrame.
 
-class _TFS:
-    '''
-       TFS parameters from MADX TFS output.
-       The approach used is mainly inherithed from the class TWISS suggested by H. Bartosik et al.
-    '''
-           
-    def __init__(self, filename): 
-        self.indx={}
-        self.keys=[]
-        alllabels=[]
-        #if '.gz' in filename:
-        #    f=gzip.open(filename, 'rb')
-        #else:
-        f=open(filename, 'r')
-            
-        for line in f:
-            if ("@ " not in line and "@" in line): 
-                line = replace(line, "@" , "@ ")
-            if ("@ " in line and "%" in line and "s" not in line.split()[2]) :
-                label=line.split()[1]
-                try:
-                    exec("self."+label+"= "+str(float((line.replace( '"', '')).split()[3])))
-                except:
-                    print(("Problem parsing: "+ line))
-                    print("Going to be parsed as string")
-                    try:
-                        exec("self."+label+"= \""+(line.split()[3]).replace( '"', '')+"\"")
-                    except:
-                        print("Problem persits, let's ignore it!")
-            elif ("@ " in line and "s"  in line.split()[2]):
-                label=(line.split()[1]).replace(":","")
-                exec("self."+label+"= \""+(line.replace('"', '')).split()[3]+"\"")
+    The files are of the type in /eos/project/l/lhc-lumimod/
+    UTC time is always assumed.
 
-            if ("* " in line or "*\t" in line) :
-                    alllabels=line.split()
-                    for j in range(1,len(alllabels)):
-                        exec("self."+alllabels[j]+"= []")
-                        self.keys.append(alllabels[j])
-                            
-            if ("$ " in line or "$\t" in line) :
-                alltypes=line.split()                
+    The file is read once and split in variable blocks (VARIABLE line, blank line, 'Timestamp...' header, data):
+    the 'Value' blocks are parsed by the C engine of pd.read_csv, the 'Array Values' blocks
+    in 2D float arrays, then all the variables are aligned at once.
+    '''
+    import io
+    with open(myFile, 'r') as file:
+        text=file.read()
 
-            if ("@" not in line and "*" not in line and "$" not in line) :
-                values=line.split()   
-                for j in range(0,len(values)):
-                    if ("%hd" in alltypes[j+1]):                      
-                        exec("self."+alllabels[j+1]+".append("+str(int(values[j]))+")")                 
-                    if ("%le" in alltypes[j+1]):                      
-                        exec("self."+alllabels[j+1]+".append("+str(float(values[j]))+")")
-                    if ("s" in alltypes[j+1]):
-                        try:
-                            exec("self."+alllabels[j+1]+".append("+values[j]+")")
-                        except:
-                            exec("self."+alllabels[j+1]+".append(\""+values[j]+"\")") #To allow with or without ""
-                        if "NAME"==alllabels[j+1]:
-                            self.indx[values[j].replace('"', '')]=len(self.NAME)-1
-                            self.indx[values[j].replace('"', '').upper()]=len(self.NAME)-1
-                            self.indx[values[j].replace('"', '').lower()]=len(self.NAME)-1
-        f.close()
-        
-        for j in range(1,len(alllabels)):
-            if (("%le" in alltypes[j]) | ("%hd" in alltypes[j])  ):  
-                exec("self."+alllabels[j]+"= np.array(self."+alllabels[j]+")") 
+    # for the moment I assume that only two variable type are used ('Value' and 'Array Values')
+    # TODO: relax the assumptions above.
+    blocks=[]
+    start=text.find('VARIABLE: ')
+    while start>=0:
+        if start==0 or text[start-1]=='\n':
+            lineEnd=text.find('\n', start)
+            blocks.append((start, text[start+len('VARIABLE: '):lineEnd if lineEnd>=0 else len(text)].rstrip('\r')))
+        start=text.find('VARIABLE: ', start+1)
+    seriesList=[]
+    for i,(start, variableName) in enumerate(blocks):
+        end=blocks[i+1][0] if i+1<len(blocks) else len(text)
+        header=text.find('Timestamp', start, end)
+        if header<0:
+            continue
+        headerEnd=text.find('\n', header, end)
+        if headerEnd<0:
+            continue
+        variableType=text[header:headerEnd].rstrip('\r').split(',')[1]
+        if variableType=='Value':
+            df=pd.read_csv(io.StringIO(text[headerEnd+1:end]), header=None, names=['Timestamp (UTC_TIME)', variableName],
+                           index_col=0)
+            df.index=pd.to_datetime(df.index)
+            seriesList.append(df[variableName])
+        if variableType=='Array Values':
+            seriesList.append(_csvArrayBlock2pd(text[headerEnd+1:end], variableName))
+    if seriesList==[]:
+        return pd.DataFrame()
+    try:
+        # single alignment of all the variables
+        aux=pd.concat(seriesList, axis=1, sort=True)
+    except Exception:
+        # duplicated timestamps in a variable
+        aux=pd.DataFrame()
+        for i in seriesList:
+            aux=pd.merge(aux, i.to_frame(), left_index=True, right_index=True, how='outer')
+    aux.index=aux.index.tz_localize('UTC')
+    aux=aux.sort_index()
+    aux.index.name=None
+    return aux
 
 
-def _tfs2pd(myFile):
+def _tfs2pd(myFile, useCache=True, columns=None):
         '''
-        Import a MADX TFS file in a pandas dataframe.
+        Import a MADX TFS file in a pandas dataframe (one row indexed by the file path).
+        The header scalars are the columns (sorted alphabetically), the typed table is in the TABLE column
+        (indexed by S, or by NAME if S is missing).
+        The parsed file is cached (see tfsFunctions.readTFS) if useCache.
+        Only the columns of the list columns are in the table (all if None, none if []).
         
         ===Example=== 
-        aux=importData.TFS2pd('/eos/user/s/sterbini/MD_ANALYSIS/2018/LHC MD Optics/collisionAt25cm_180urad/lhcb1_thick.survey')
+        aux=importData._tfs2pd('/eos/user/s/sterbini/MD_ANALYSIS/2018/LHC MD Optics/collisionAt25cm_180urad/lhcb1_thick.survey')
         '''
-        a=_TFS(myFile);
-        aux=[]
-        aux1=[]
-
-        for i in dir(a):
-            if not i[0]=='_':
-                if type(getattr(a,i)) is float:
-                    #print(i + ":"+ str(type(getattr(a,i))))
-                    aux.append(i)
-                    aux1.append(getattr(a,i))
-                if type(getattr(a,i)) is str:
-                    #print(i + ":"+ str(type(getattr(a,i))))
-                    aux.append(i)
-                    aux1.append(getattr(a,i))
-
-        myList=[]
-        myColumns=[]
-        for i in a.keys:
-            myContainer=getattr(a, i)
-            if len(myContainer)==0:
+        header, optics = tfsFunctions.readTFS(myFile, index=['S','NAME'], useCache=useCache, columns=columns)
+        if len(optics)==0:
+            for i in optics.columns:
                 print(("The column "+ i + ' is empty.'))
-            else:
-                myColumns.append(i)
-                myList.append(myContainer)
-                
-        if 'S' in a.keys:
-            optics=pd.DataFrame(np.transpose(myList), index=a.S, columns=myColumns)
-        else:
-            optics=pd.DataFrame(np.transpose(myList), columns=myColumns)
-        #optics=pd.DataFrame(np.transpose(myList), index=a.S,columns=myColumns)
-
-        for i in optics.columns:
-            aux3= optics.iloc[0][i]
-            if type(aux3) is str:
-                aux3=str.replace(aux3, '+', '')
-                aux3=str.replace(aux3, '-', '')
-                aux3=str.replace(aux3, '.', '')
-                aux3=str.replace(aux3, 'e', '')
-                aux3=str.replace(aux3, 'E', '')
+            optics=optics[[]]
 
-
-                if aux3.isdigit():
-                    optics[i]=optics[i].apply(np.double)
+        myKeys=sorted((i.replace(':',''), i) for i in header if not i[0]=='_')
+        aux=[i[0] for i in myKeys]
+        aux1=[header[i[1]] for i in myKeys]
 
         aux.append('FILE_NAME')
         aux1.append(os.path.abspath(myFile))
@@ -625,9 +1399,12 @@ def _tfs2pd(myFile):
         globalDF.index.name=''
         return globalDF 
     
-def tfs2pd(myList):
+def tfs2pd(myList, useCache=True, columns=None):
     '''
         Import a MADX TFS file in a pandas dataframe.
+        The parsed files are cached (see tfsFunctions.readTFS) and loaded again only if modified, unless useCache=False.
+        Only the columns of the list columns are in the tables (all if None, none if [] to read only the headers).
+        For the large scans see tfsFunctions.tfsScan (parallel, tables stacked in a 3D array).
         
         ===Example=== 
         aux=importData.tfs2pd(['/eos/user/s/sterbini/MD_ANALYSIS/2018/LHC MD Optics/collisionAt25cm_180urad/lhcb1_thick.survey',
@@ -636,10 +1413,10 @@ def tfs2pd(myList):
     if isinstance(myList, list):
         aux=[]
         for i in np.unique(myList):
-            aux.append(_tfs2pd(i))
+            aux.append(_tfs2pd(i, useCache, columns))
         return pd.concat(aux, sort=True)
     else:
-        return _tfs2pd(myList)
+        return _tfs2pd(myList, useCache, columns)
     
 def _LHCCals2pd(listOfVariables, fillList ,beamModeList='FILL', split=1, verbose=False):
     '''
@@ -722,9 +1499,213 @@ def LHCInstant(t1,timeSpan_days=1):
             return pd.DataFrame()
     '''
 
+def _modeIntervals(fillsDF, fillGaps=True):
+    '''
+    Return the beam modes of fillsDF (in the LHCFillsByNumber/LHCFillsByTime format) as a DataFrame
+    of non-overlapping intervals sorted by startTime, with the columns fill, mode, startTime and endTime.
+    If fillGaps is True, the gaps between the beam modes are included as mode 'NONE' (as in _fillBeamModes):
+    from the start of the fill to its first beam mode and between two consecutive beam modes.
+    '''
+    if len(fillsDF)==0:
+        return pd.DataFrame(columns=['fill','mode','startTime','endTime'])
+    startTimes=pd.to_datetime(fillsDF['startTime'],utc=True).dt.tz_localize(None).values
+    endTimes=pd.to_datetime(fillsDF['endTime'],utc=True).dt.tz_localize(None).values
+    isMode=(fillsDF['mode']!='FILL').values
+    aux=pd.DataFrame({'fill':fillsDF.index.values[isMode], 'mode':fillsDF['mode'].values[isMode],
+                      'startTime':startTimes[isMode], 'endTime':endTimes[isMode]})
+    if fillGaps and len(aux):
+        # with a stable sort the beam modes of a fill are consecutive and in chronological order
+        aux=aux.sort_values('fill', kind='mergesort').reset_index(drop=True)
+        fills=aux['fill'].values
+        sameFill=fills[1:]==fills[:-1]
+        firstMode=np.r_[True, ~sameFill]
+        # as in _fillBeamModes, a fill starts with its first row (the FILL one)
+        fillStart=pd.Series(startTimes, index=fillsDF.index).groupby(level=0).first()
+        aux=pd.concat([aux,
+                       pd.DataFrame({'fill':fills[1:][sameFill], 'mode':'NONE',
+                                     'startTime':aux['endTime'].values[:-1][sameFill],
+                                     'endTime':aux['startTime'].values[1:][sameFill]}),
+                       pd.DataFrame({'fill':fills[firstMode], 'mode':'NONE',
+                                     'startTime':fillStart.loc[fills[firstMode]].values,
+                                     'endTime':aux['startTime'].values[firstMode]})], ignore_index=True)
+    # the empty intervals (e.g., gaps of zero duration) would hide the modes starting at the same time
+    aux=aux[~(aux['endTime']<=aux['startTime'])]
+    return aux.sort_values('startTime', kind='mergesort').reset_index(drop=True)
+
+def LHCInstants(timeList, fillsDF=None, fillGaps=True):
+    '''
+    LHCInstants(timeList, fillsDF=None, fillGaps=True)
+
+    Return the fill number and the beam mode at each instant of timeList (array, list or pd.DatetimeIndex).
+    This is the vectorized version of LHCInstant: all the instants are tagged at once with a
+    binary search (np.searchsorted) on the sorted beam-mode intervals.
+
+    Tz-naive instants will be consider UTC-localized.
+    fillsDF is the output of LHCFillsByTime/LHCFillsByNumber: if None, LHCFillsByTime is called on the
+    interval spanned by timeList.
+    If fillGaps is True the gaps between the beam modes are tagged as 'NONE' (see _fillBeamModes),
+    otherwise the instants outside the beam modes have fill and mode equal to NaN.
+    A beam mode interval is [startTime, endTime] (as in LHCInstant), the ongoing beam mode has endTime NaT.
+    An instant on the boundary between two beam modes is tagged with the earlier one.
+
+    ===Example===
+    myIndex=pd.date_range('2018-05-22 00:00', '2018-05-23 00:00', freq='1s', tz='CET')
+    importData.LHCInstants(myIndex)
+    '''
+    timeList=pd.DatetimeIndex(timeList)
+    if timeList.tz is None: timeList=timeList.tz_localize('UTC')
+    else: timeList=timeList.tz_convert('UTC')
+    if fillsDF is None:
+        if len(timeList):
+            fillsDF=LHCFillsByTime(timeList.min(), timeList.max())
+        else:
+            fillsDF=pd.DataFrame(columns=['mode','startTime','endTime','duration'])
+    intervals=_modeIntervals(fillsDF, fillGaps)
+
+    # everything in UTC nanoseconds
+    myTimes=timeList.tz_localize(None).values.astype('datetime64[ns]').astype(np.int64)
+    starts=intervals['startTime'].values.astype('datetime64[ns]')
+    ends=intervals['endTime'].values.astype('datetime64[ns]')
+    ends=np.where(np.isnat(ends), np.iinfo(np.int64).max, ends.astype(np.int64))
+    starts=starts.astype(np.int64)
+
+    myPositions=np.searchsorted(starts, myTimes, side='right')-1
+    # both ends are included: on the boundary the instant goes to the beam mode ending there
+    onBoundary=myPositions>=1
+    onBoundary[onBoundary]=myTimes[onBoundary]<=ends[myPositions[onBoundary]-1]
+    myPositions[onBoundary]-=1
+    found=myPositions>=0
+    found[found]=myTimes[found]<=ends[myPositions[found]]
+    fill=np.full(len(timeList), np.nan)
+    mode=np.full(len(timeList), np.nan, dtype=object)
+    fill[found]=intervals['fill'].values[myPositions[found]]
+    mode[found]=intervals['mode'].values[myPositions[found]]
+    return pd.DataFrame({'fill':fill, 'mode':mode}, index=timeList)
 
 # TEST FUNCTIONS
 
+def _benchmarkDATA2pd(noOfVariables=100, noOfPoints=3600, seed=0):
+    '''
+    Compare the time needed by _DATA2pd and by _mergeLoopDATA2pd on a synthetic cals.get dictionary
+    of noOfVariables scalar variables with noOfPoints (not aligned) timestamps each.
+    It returns a pd.Series with the two times in seconds and the check of their equality.
+
+    ===Example===
+    importData._benchmarkDATA2pd(noOfVariables=200)
+    '''
+    np.random.seed(seed)
+    t0=pd.Timestamp('2018-07-01', tz='UTC').timestamp()
+    DATA={}
+    for i in range(noOfVariables):
+        timestamps=t0+np.sort(np.random.uniform(0, noOfPoints, noOfPoints))
+        DATA['VARIABLE_'+format(i,'04d')]=(timestamps, np.random.randn(noOfPoints))
+    listOfVariables=list(DATA.keys())
+
+    aux=time.time()
+    newDF=_DATA2pd(DATA, listOfVariables)
+    newTime=time.time()-aux
+
+    aux=time.time()
+    oldDF=_mergeLoopDATA2pd(DATA, listOfVariables)
+    oldTime=time.time()-aux
+
+    return pd.Series({'_DATA2pd [s]': newTime, '_mergeLoopDATA2pd [s]': oldTime,
+                      'speed-up': oldTime/newTime, 'equal': newDF.equals(oldDF)})
+
+def _applyFillsDATA2pd(DATA):
+    '''
+    The original parsing of the cals.getLHCFillsByTime output in LHCFillsByTime
+    (row-wise lists, _UTClocalizeMe applied on each timestamp, string round trip for the online fill).
+    It is kept as reference for _benchmarkFillsDATA2pd.
+    '''
+    fillNumberList, beamModesList = [], []
+    startTimeList, endTimeList = [], []
+    FN, ST, ET =[], [], [] #fillNumber, startTime, endTime
+
+    for i in DATA:
+        FN.append(i['fillNumber']); ST.append(i['startTime']); ET.append(i['endTime'])
+        for j in i['beamModes']:
+            fillNumberList.append(i['fillNumber']); beamModesList.append(j['mode'])
+            startTimeList.append(j['startTime']); endTimeList.append(j['endTime'])
+
+    auxDataFrame=pd.DataFrame()
+    auxDataFrame['mode']=pd.Series(beamModesList, fillNumberList)
+    auxDataFrame['startTime']=pd.Series(pd.to_datetime(startTimeList,unit='s'), fillNumberList)
+    auxDataFrame['endTime']=pd.Series(pd.to_datetime(endTimeList,unit='s'), fillNumberList)
+    auxDataFrame['duration']=auxDataFrame['endTime']-auxDataFrame['startTime']
+
+    aux=pd.DataFrame()
+    aux['startTime']=pd.Series(pd.to_datetime(ST,unit='s'), FN)
+    aux['endTime']=pd.Series(pd.to_datetime(ET,unit='s'), FN)
+    aux['duration']=aux['endTime']-aux['startTime']
+
+    aux['startTime']=aux['startTime'].apply(_UTClocalizeMe)
+    aux['endTime']=aux['endTime'].apply(_UTClocalizeMe)
+
+    auxDataFrame['startTime']=auxDataFrame['startTime'].apply(_UTClocalizeMe)
+    auxDataFrame['endTime']=auxDataFrame['endTime'].apply(_UTClocalizeMe)
+    aux['mode']='FILL'
+    fillsSummary=aux;
+    fillsDetails=auxDataFrame;
+    out=pd.DataFrame()
+    if len(fillsSummary)>0:
+        if (len(fillsSummary)==1) & (str(fillsSummary.iloc[0]['duration'])=='NaT'):
+            fillsSummary['endTime']='NaT'
+            fillsSummary['duration']='NaT'
+            fillsDetails['endTime']=fillsDetails['endTime'].astype(str)
+            fillsDetails['duration']=fillsDetails['duration'].astype(str)
+            out=pd.concat([fillsDetails,fillsSummary],sort=True)
+            out=out.sort_values('startTime')[['mode','startTime','endTime','duration']]
+            out['endTime']=out['endTime'].apply(pd.Timestamp)
+            out['duration']=out['endTime']-out['startTime']
+        else:
+            out=pd.concat([fillsDetails,fillsSummary], sort=True)
+            out=out.sort_values('startTime')[['mode','startTime','endTime','duration']]    
+    return out
+
+def _benchmarkFillsDATA2pd(noOfFills=1000, noOfModes=15, seed=0):
+    '''
+    Compare the time needed by _fillsDATA2pd and by _applyFillsDATA2pd to parse a synthetic
+    cals.getLHCFillsByTime output of noOfFills fills with noOfModes beam modes each
+    (the default is about a year of LHC fills, the last one still ongoing).
+    The CALS extraction is not included. It returns a pd.Series with the two times in seconds
+    and the check of their equality.
+
+    ===Example===
+    importData._benchmarkFillsDATA2pd()
+    '''
+    np.random.seed(seed)
+    t0=pd.Timestamp('2018-01-01', tz='UTC').timestamp()
+    DATA=[]
+    startTime=t0
+    for i in range(noOfFills):
+        times=startTime+np.cumsum(np.random.uniform(60, 3600, noOfModes+1))
+        modes=[{'mode':'MODE_'+format(j,'02d'), 'startTime':times[j], 'endTime':times[j+1]} for j in range(noOfModes)]
+        endTime=times[-1]
+        if i==noOfFills-1:
+            modes[-1]['endTime']=None
+            endTime=None
+        DATA.append({'fillNumber':6000+i, 'startTime':startTime, 'endTime':endTime, 'beamModes':modes})
+        startTime=times[-1]+1.
+
+    aux=time.time()
+    newDF=_fillsDATA2pd(DATA)
+    newTime=time.time()-aux
+
+    aux=time.time()
+    oldDF=_applyFillsDATA2pd(DATA)
+    oldTime=time.time()-aux
+
+    # the ties between a FILL and its first beam mode are compared in the same order
+    def normalize(myDF):
+        myDF=myDF.reset_index()
+        myDF['endTime']=pd.to_datetime(myDF['endTime'], utc=True)
+        myDF['duration']=pd.to_timedelta(myDF['duration'])
+        return myDF.sort_values(['startTime','mode']).reset_index(drop=True)
+    return pd.Series({'_fillsDATA2pd [s]': newTime, '_applyFillsDATA2pd [s]': oldTime,
+                      'speed-up': oldTime/newTime, 'rows': len(newDF),
+                      'equal': normalize(newDF).equals(normalize(oldDF))})
+
 def _LHCCals2pd_ver1(listOfVariables, fillList ,beamModeList='FILL', split=1, verbose=False,
                      fill_column=False, beamMode_column=False):
     '''
@@ -772,20 +1753,104 @@ def _LHCCals2pd_ver1(listOfVariables, fillList ,beamModeList='FILL', split=1, ve
     else:
         return pd.concat(listDF, sort=True).sort_index()
     
+def _LHCWindows(fillList, beamModeList, flag='', offset=pd.Timedelta(0), duration=pd.Timedelta('5s')):
+    '''
+    Return a DataFrame with the extraction windows (t1, t2) of each fill and beam mode, as used by LHCCals2pd.
+    The fills are retrieved with a single LHCFillsByNumber.
+    The windows are sorted by fill, beam mode and startTime. For flag 'last' or 'next', t2 is the flag.
+    '''
+    fillsDF=LHCFillsByNumber(fillList)
+    aux=fillsDF[fillsDF['mode'].isin(beamModeList)]
+    windows=pd.DataFrame({'fill':aux.index.values, 'mode':aux['mode'].values,
+                          't1':aux['startTime'].values, 'endTime':aux['endTime'].values})
+    windows['t1']=pd.to_datetime(windows['t1'],utc=True)+offset
+    if flag=='':
+        # the ongoing beam mode is extracted up to now
+        windows['t2']=pd.to_datetime(windows['endTime'],utc=True).fillna(pd.Timestamp.now(tz='UTC'))+offset
+    elif flag=='duration':
+        windows['t2']=windows['t1']+duration
+    else:
+        windows['t2']=flag
+    del windows['endTime']
+    return windows.sort_values(['fill','mode','t1'], kind='mergesort').reset_index(drop=True)
+
+def _planRequests(windows, gap=pd.Timedelta(0)):
+    '''
+    Coalesce the overlapping windows (or closer than gap) in the minimum number of CALS requests.
+    It returns the DataFrame of the requests (t1, t2, noOfWindows) and, for each window,
+    the index of the request covering it.
+    '''
+    if len(windows)==0:
+        return pd.DataFrame(columns=['t1','t2','noOfWindows']), np.array([],dtype=int)
+    myOrder=np.argsort(windows['t1'].values, kind='mergesort')
+    t1=windows['t1'].values[myOrder]
+    t2=windows['t2'].values[myOrder]
+    reach=np.maximum.accumulate(t2)
+    # a new request starts when the window begins after the end of all the previous ones
+    newRequest=np.concatenate(([True], t1[1:]>reach[:-1]+np.timedelta64(gap.value,'ns')))
+    requestIndex=np.cumsum(newRequest)-1
+    requests=pd.DataFrame({'t1':t1, 't2':t2, 'request':requestIndex}).groupby('request').agg(
+        t1=('t1','min'), t2=('t2','max'), noOfWindows=('t1','size'))
+    for i in ['t1','t2']:
+        requests[i]=pd.to_datetime(requests[i],utc=True)
+    windowRequest=np.empty(len(windows),dtype=int)
+    windowRequest[myOrder]=requestIndex
+    return requests, windowRequest
+
+def _expectedPoints(listOfVariables, t1, t2):
+    '''
+    Return the number of points that CALS will return for listOfVariables in [t1,t2]
+    (NaN if the statistics are not available).
+    '''
+    try:
+        stats=cals.getStats(listOfVariables, t1.astimezone('CET'), t2.astimezone('CET'))
+        return np.sum([stats[i].ValueCount for i in stats])
+    except Exception:
+        return np.nan
+
+def _sliceWindows(myDF, windows, fill_column, beamMode_column):
+    '''
+    Interval join: return the rows of myDF (sorted by time) within each [t1,t2] of windows,
+    with the fill and mode columns if requested. A row is repeated for each window containing it.
+    '''
+    if len(myDF)==0:
+        return myDF
+    starts=myDF.index.searchsorted(pd.DatetimeIndex(windows['t1']), side='left')
+    ends=myDF.index.searchsorted(pd.DatetimeIndex(windows['t2']), side='right')
+    lengths=np.maximum(ends-starts,0)
+    # concatenation of the ranges [starts,ends) without python loops
+    positions=np.repeat(ends-lengths.cumsum(), lengths)+np.arange(lengths.sum())
+    out=myDF.iloc[positions].copy()
+    if fill_column:
+        out['fill']=np.repeat(windows['fill'].values, lengths)
+    if beamMode_column:
+        out['mode']=np.repeat(windows['mode'].values, lengths)
+    return out
+
 def LHCCals2pd(listOfVariables, fillList ,beamModeList='FILL', split=1, verbose=False,
-                     fill_column=False, beamMode_column=False, flag='', offset=pd.Timedelta(0), duration=pd.Timedelta('5s')):
+                     fill_column=False, beamMode_column=False, flag='', offset=pd.Timedelta(0), duration=pd.Timedelta('5s'),
+                     useCache=True, dryRun=False, gap=pd.Timedelta(0)):
     '''
     LHCCals2pd(listOfVariables, fillList ,beamModeList='FILL', split=1, verbose=False,
-                     fill_column=False, beamMode_column=False, flag='', offset=pd.Timedelta(0), duration=pd.Timedelta('5s')
+                     fill_column=False, beamMode_column=False, flag='', offset=pd.Timedelta(0), duration=pd.Timedelta('5s'),
+                     useCache=True, dryRun=False, gap=pd.Timedelta(0))
     Return the listOfVariables in the fill of the fillList for a given list of beamModeList. 
     It can be used in the verbose mode if the corresponding flag is True.
-    The data extraction can be done splitting it in several n intervals (split=n).
+    The data extraction can be done splitting it in several n intervals (split=n),
+    or split='auto' to size each CALS request from the estimated data volume (see cals2pd).
     If fill_column and beamMode_column are True then also the fill and the mode is included 
     in the df.
     It is possible to add an offset (default is offset=pd.Timedelta(0)): this will offset the the startTime and endTime.
     If flag is 'next' or 'last', the next or last  measurement after or before the startTime (+offset) will be returned.
     if flag is 'duration' the extraction will be between [t1,t2], with t1=(startTime+offset) and t2=(startTime+offset+duration).
     The default value of duration is pd.Timedelta('5s')
+    The local CALS cache is used unless useCache is False (see cals2pd).
+
+    The windows of all the fills and beam modes are first planned: the overlapping or adjacent ones
+    (or closer than gap) are coalesced in a single CALS request (e.g., RAMP, FLATTOP and SQUEEZE of a fill),
+    then the rows of each request are labelled with their windows.
+    If dryRun is True nothing is extracted and the planned requests (with the expected number of points,
+    when CALS can provide it) are returned.
     
     ===Example===     
     importData.LHCCals2pd(['RPHFC.UL14.RQX.L1:I_MEAS'],[6278, 6666],['RAMP','FLATTOP'])
@@ -793,6 +1858,8 @@ def LHCCals2pd(listOfVariables, fillList ,beamModeList='FILL', split=1, verbose=
     importData.LHCCals2pd(['RPHFC.UL14.RQX.L1:I_MEAS'],[6278, 6666,6690],['RAMP','FLATTOP'],flag='duration',fill_column=True, beamMode_column=True, offset=pd.Timedelta('5s'),duration=pd.Timedelta('60s'))
     
     importData.LHCCals2pd(['RPHFC.UL14.RQX.L1:I_MEAS'],[6278, 6666,6690],['RAMP','FLATTOP'],flag='next',fill_column=True, beamMode_column=True,fill_column=True, beamMode_column=True,)
+
+    importData.LHCCals2pd(['RPHFC.UL14.RQX.L1:I_MEAS'],[6278, 6666],['RAMP','FLATTOP','SQUEEZE'],dryRun=True)
     '''
     if len(listOfVariables)==0:
         return pd.DataFrame()
@@ -800,81 +1867,122 @@ def LHCCals2pd(listOfVariables, fillList ,beamModeList='FILL', split=1, verbose=
     fillList=np.unique(fillList)
     beamModeList=np.unique(beamModeList)
 
+    if flag not in ['', 'last', 'next', 'duration']:
+        return None
+
+    windows=_LHCWindows(fillList, beamModeList, flag, offset, duration)
     listDF=[]
-    
-    if flag=='':
-        for fill in fillList: 
-            if verbose: print(('Fill: '+str(fill)))
-            fillDF=LHCFillsByNumber(fill)
-            for BM in beamModeList:
-                aux=fillDF[fillDF['mode']==BM]
-                if verbose: print(('Beam mode: '+BM))
-
-                for index,row in aux.iterrows():
-                    t1=row.startTime+offset
-                    t2=row.endTime+offset
-                    if verbose: print(('Start time: '+str(t1)))
-                    if verbose: print(('End time: '+str(t2)))
-                    out=cals2pd(listOfVariables,t1,t2, split=split, verbose=verbose)
-                    if fill_column:
-                        out['fill']=fill
-                    if beamMode_column:
-                        out['mode']=BM
-                    listDF.append(out)
-        if listDF==[]:
-            return pd.DataFrame()
-        else:
-            return pd.concat(listDF, sort=True).sort_index()
-        
+
     if (flag=='last') or (flag=='next'):
-        for fill in fillList: 
-            if verbose: print(('Fill: '+str(fill)))
-            fillDF=LHCFillsByNumber(fill)
-            for BM in beamModeList:
-                aux=fillDF[fillDF['mode']==BM]
-                if verbose: print(('Beam mode: '+BM))
-
-                for index,row in aux.iterrows():
-                    t1=row.startTime+offset
-                    t2=flag
-                    if verbose: print(('Start time: '+str(t1)))
-                    if verbose: print(('End time: '+str(t2)))
-                    out=cals2pd(listOfVariables,t1,t2, split=split, verbose=verbose)
-                    if fill_column:
-                        out['fill']=fill
-                    if beamMode_column:
-                        out['mode']=BM
-                    listDF.append(out)
-        if listDF==[]:
-            return pd.DataFrame()
-        else:
-            return pd.concat(listDF, sort=True).sort_index()
-        
-    if (flag=='duration'):
-        for fill in fillList: 
-            if verbose: print(('Fill: '+str(fill)))
-            fillDF=LHCFillsByNumber(fill)
-            for BM in beamModeList:
-                aux=fillDF[fillDF['mode']==BM]
-                if verbose: print(('Beam mode: '+BM))
-
-                for index,row in aux.iterrows():
-                    t1=row.startTime+offset
-                    t2=t1+duration
-                    if verbose: print(('Start time: '+str(t1)))
-                    if verbose: print(('End time: '+str(t2)))
-                    out=cals2pd(listOfVariables,t1,t2, split=split, verbose=verbose)
-                    if fill_column:
-                        out['fill']=fill
-                    if beamMode_column:
-                        out['mode']=BM
-                    listDF.append(out)
-        if listDF==[]:
-            return pd.DataFrame()
-        else:
-            return pd.concat(listDF, sort=True).sort_index()
+        if dryRun:
+            return windows
+        # all the (variable, instant) pairs are resolved together
+        variables=_smartList(listOfVariables)
+        queries=pd.DataFrame({'window':np.repeat(np.arange(len(windows)),len(variables)),
+                              'variable':np.tile(variables,len(windows)),
+                              'timestamp':np.repeat(windows['t1'].values,len(variables)),
+                              'direction':flag})
+        result=calsAsOf(queries, verbose=verbose, useCache=useCache)
+        result['window']=queries['window']
+        result=result.dropna(subset=['valueTimestamp'])
+        if len(result):
+            out=result.set_index(['window','valueTimestamp','variable'])['value'].unstack('variable').infer_objects()
+            out=out.reset_index(level='window')
+            if fill_column:
+                out['fill']=windows['fill'].values[out['window'].values]
+            if beamMode_column:
+                out['mode']=windows['mode'].values[out['window'].values]
+            del out['window']
+            out.index.name=None
+            out.columns.name=None
+            listDF.append(out)
+    else:
+        requests, windowRequest = _planRequests(windows, gap)
+        if verbose: print((str(len(windows))+' windows in '+str(len(requests))+' requests.'))
+        if dryRun:
+            variables=_smartList(listOfVariables)
+            requests['expectedPoints']=[_expectedPoints(variables,row['t1'],row['t2']) for index,row in requests.iterrows()]
+            return requests
+        for i,row in requests.iterrows():
+            if verbose: print(('Request: '+str(row['t1'])+' - '+str(row['t2'])))
+            myDF=cals2pd(listOfVariables,row['t1'],row['t2'], split=split, verbose=verbose, useCache=useCache)
+            listDF.append(_sliceWindows(myDF.sort_index(), windows[windowRequest==i], fill_column, beamMode_column))
+
+    if listDF==[]:
+        return pd.DataFrame()
+    else:
+        return pd.concat(listDF, sort=True).sort_index(kind='mergesort')
+
+def _checkpointKey(*args):
+    '''
+    Return a short hash of the arguments of a call (lists, dicts, strings, numbers, timestamps and functions,
+    the latter identified by their name and their code) to name the checkpoints of _fillsMapReduce.
+    '''
+    def normalize(x):
+        if callable(x):
+            aux=getattr(x, '__module__', '')+'.'+getattr(x, '__qualname__', repr(x))
+            code=getattr(x, '__code__', None)
+            if code is not None:
+                aux+=':'+hashlib.md5(code.co_code+repr(code.co_consts).encode()).hexdigest()
+            return aux
+        if isinstance(x, dict):
+            return sorted((repr(i), normalize(j)) for i,j in x.items())
+        if isinstance(x, (list, tuple, range, np.ndarray, pd.Index)):
+            return [normalize(i) for i in x]
+        return repr(x)
+    return hashlib.md5(repr(normalize(args)).encode()).hexdigest()[:12]
+
+def _fillsMapReduce(fillNos, reduceFill, max_workers=4, checkpointFolder=None, key=()):
+    '''
+    Apply reduceFill (a function of a fill number returning a DataFrame) to each fill of fillNos
+    in a pool of max_workers threads (pytimber runs in a JVM that cannot be forked, so no process pool)
+    and return the concatenation of the results in the order of fillNos.
+    Only the reduced DataFrames are kept in memory.
+    If checkpointFolder is not None, each result is saved there as soon as it is ready
+    (checkpointFolder/call_<hash of key>/fill_<fillNumber>.pkl, key being the arguments of the call, e.g.,
+    the function name, the variables, the modes and the reduce functions) and the fills already saved
+    for the same key are not processed again: an interrupted survey resumes where it stopped.
+    A failing fill does not stop the others; the failed fills are listed in the exception raised at the end.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    fillNos=list(pd.unique(np.asarray(fillNos)))
+    if checkpointFolder is not None:
+        # a different call in the same checkpointFolder never reuses these results
+        checkpointFolder=os.path.join(checkpointFolder, 'call_'+_checkpointKey(*key))
+        os.makedirs(checkpointFolder, exist_ok=True)
+
+    def checkpointFile(fill):
+        return os.path.join(checkpointFolder, 'fill_'+str(fill)+'.pkl')
+
+    def worker(fill):
+        if checkpointFolder is not None and os.path.exists(checkpointFile(fill)):
+            return pd.read_pickle(checkpointFile(fill))
+        out=reduceFill(fill)
+        if checkpointFolder is not None:
+            tmpFile=checkpointFile(fill)+'.'+uuid.uuid4().hex+'.tmp'
+            pd.to_pickle(out, tmpFile)
+            os.replace(tmpFile, checkpointFile(fill))
+        return out
+
+    listDF=[]
+    failedFills=[]
+    with ThreadPoolExecutor(max_workers=max(1,min(max_workers,len(fillNos)))) as executor:
+        futures=[executor.submit(worker, fill) for fill in fillNos]
+        for fill, future in zip(fillNos, futures):
+            try:
+                listDF.append(future.result())
+            except Exception as e:
+                failedFills.append((fill, e))
+    if len(failedFills):
+        raise RuntimeError('The reduction failed for the fills: '+
+                           ', '.join([str(fill)+' ('+str(e)+')' for fill,e in failedFills]))
+    listDF=[i for i in listDF if len(i)]
+    if listDF==[]:
+        return pd.DataFrame()
+    return pd.concat(listDF, sort=False)
 
-def LHCFillsAggregation (listOfVariables, fillNos, beamModeList = None, functionList = None, mapInsteadAgg = False, flag = None, offset = None, duration = None):
+def LHCFillsAggregation (listOfVariables, fillNos, beamModeList = None, functionList = None, mapInsteadAgg = False, flag = None, offset = None, duration = None,
+                         max_workers = 1, checkpointFolder = None):
     '''
     
     For the selected fill numbers, beam modes and list of variables, this function creates 
@@ -888,6 +1996,11 @@ def LHCFillsAggregation (listOfVariables, fillNos, beamModeList = None, function
     If flag is 'next' or 'last', the next or last  measurement after or before the startTime (+offset) will be returned.
     if flag is 'duration' the extraction will be between [t1,t2], with t1=(startTime+offset) and t2=(startTime+offset+duration).
     If some of these parameters are not set, the default ones from the function _LHCCals2pd_ver2 are used.
+
+    If max_workers>1 or a checkpointFolder is given, the fills are processed one by one (extraction and reduction)
+    by a pool of max_workers threads and only the reduced rows are kept, so that the memory depends on a single fill.
+    Each reduced fill is saved in a subfolder of checkpointFolder named after the arguments of the call:
+    running again the same call after an interruption processes only the missing fills.
     
     ===EXAMPLE===
     LHCFillsAggregation(['LHC.BQM.B2:NO_BUNCHES', 'LHC.BQM.B1:NO_BUNCHES'], range(6500, 6800))
@@ -895,6 +2008,7 @@ def LHCFillsAggregation (listOfVariables, fillNos, beamModeList = None, function
     LHCFillsAggregation(['LHC.BQM.B2:NO_BUNCHES', 'LHC.BQM.B1:NO_BUNCHES'], range(6500, 6800), ['INJPHYS','INJPROT'], [pd.Series.mean, pd.Series.max], 'last')
     LHCFillsAggregation(['LHC.BQM.B2:NO_BUNCHES', 'LHC.BQM.B1:NO_BUNCHES'], range(6500, 6800), 'PRERAMP', pd.Series.max, 'last')
     LHCFillsAggregation(['LHC.BCTFR.A6R4.B%:BUNCH_INTENSITY'],6666, ['FLATTOP'],flag='duration',duration=pd.Timedelta('1m'), functionList = np.mean, mapInsteadAgg = True)
+    LHCFillsAggregation(['LHC.BQM.B2:NO_BUNCHES', 'LHC.BQM.B1:NO_BUNCHES'], range(6500, 6800), ['STABLE'], pd.Series.max, max_workers = 8, checkpointFolder = '/tmp/NO_BUNCHES_survey')
     
     '''
     # FOR DEBUGGING 
@@ -913,7 +2027,7 @@ def LHCFillsAggregation (listOfVariables, fillNos, beamModeList = None, function
     # ('offset', Timedelta('0 days 00:00:00')),
     # ('duration', Timedelta('0 days 00:00:05'))]
     
-    a = inspect.getargspec(LHCCals2pd)
+    a = inspect.getfullargspec(LHCCals2pd)
     defaultValues = list(zip(a.args[-len(a.defaults):],a.defaults))
     
     defaultBeamModeList = defaultValues[0][1]
@@ -955,8 +2069,17 @@ def LHCFillsAggregation (listOfVariables, fillNos, beamModeList = None, function
     NoOfFills = len(fillNos)
     NoOfModes = len(beamModeList)
     
+    if max_workers > 1 or checkpointFolder is not None:
+        # map-reduce: each worker extracts and reduces a single fill
+        return _fillsMapReduce(fillNos, lambda fill: LHCFillsAggregation(listOfVariables, [fill], beamModeList, functionList, mapInsteadAgg, flag, offset, duration),
+                               max_workers, checkpointFolder,
+                               key=('LHCFillsAggregation', listOfVariables, beamModeList, functionList, mapInsteadAgg, flag, offset, duration))
+
     resultDF = pd.DataFrame()
     data = LHCCals2pd(listOfVariables, fillNos, beamModeList, fill_column=True, beamMode_column=True, flag = flag, offset = offset, duration = duration)
+    if len(data) == 0:
+        # no data in the fills
+        return pd.DataFrame()
     
     # In case of regex variables, number of variables have to be counted this way 
     listOfVariables = data.columns.drop('fill').drop('mode')
@@ -994,7 +2117,8 @@ def LHCFillsAggregation (listOfVariables, fillNos, beamModeList = None, function
 
     return resultDF.join(timeData)
 
-def LHCFillsMappingAggregation (listOfVariables, fillNos, beamModeList = None, mapFunctionList = [], aggFunctionList = [], flag = None, offset = None, duration = None):
+def LHCFillsMappingAggregation (listOfVariables, fillNos, beamModeList = None, mapFunctionList = [], aggFunctionList = [], flag = None, offset = None, duration = None,
+                                max_workers = 1, checkpointFolder = None):
     '''
     
     For the selected fill numbers, beam modes and list of variables, this function creates 
@@ -1008,6 +2132,11 @@ def LHCFillsMappingAggregation (listOfVariables, fillNos, beamModeList = None, m
     If flag is 'next' or 'last', the next or last  measurement after or before the startTime (+offset) will be returned.
     if flag is 'duration' the extraction will be between [t1,t2], with t1=(startTime+offset) and t2=(startTime+offset+duration).
     If some of these parameters are not set, the default ones from the function _LHCCals2pd_ver2 are used.
+
+    If max_workers>1 or a checkpointFolder is given, the fills are processed one by one (extraction and reduction)
+    by a pool of max_workers threads and only the reduced rows are kept, so that the memory depends on a single fill.
+    Each reduced fill is saved in a subfolder of checkpointFolder named after the arguments of the call:
+    running again the same call after an interruption processes only the missing fills.
     
     ===EXAMPLE===
     importData.LHCFillsMappingAggregation(['LHC.BCTFR.A6R4.B%:BUNCH_INTENSITY'],6666, ['FLATTOP'],flag='duration',duration=pd.Timedelta('1m'), aggFunctionList = np.mean, mapFunctionList = np.mean)
@@ -1031,7 +2160,7 @@ def LHCFillsMappingAggregation (listOfVariables, fillNos, beamModeList = None, m
     # ('offset', Timedelta('0 days 00:00:00')),
     # ('duration', Timedelta('0 days 00:00:05'))]
     
-    a = inspect.getargspec(LHCCals2pd)
+    a = inspect.getfullargspec(LHCCals2pd)
     defaultValues = list(zip(a.args[-len(a.defaults):],a.defaults))
     
     defaultBeamModeList = defaultValues[0][1]
@@ -1077,8 +2206,17 @@ def LHCFillsMappingAggregation (listOfVariables, fillNos, beamModeList = None, m
     NoOfFills = len(fillNos)
     NoOfModes = len(beamModeList)
     
+    if max_workers > 1 or checkpointFolder is not None:
+        # map-reduce: each worker extracts and reduces a single fill
+        return _fillsMapReduce(fillNos, lambda fill: LHCFillsMappingAggregation(listOfVariables, [fill], beamModeList, mapFunctionList, aggFunctionList, flag, offset, duration),
+                               max_workers, checkpointFolder,
+                               key=('LHCFillsMappingAggregation', listOfVariables, beamModeList, mapFunctionList, aggFunctionList, flag, offset, duration))
+
     resultDF = pd.DataFrame()
     data = LHCCals2pd(listOfVariables, fillNos, beamModeList, fill_column=True, beamMode_column=True, flag = flag, offset = offset, duration = duration)
+    if len(data) == 0:
+        # no data in the fills
+        return pd.DataFrame()
     
     # In case of regex variables, number of variables have to be counted this way 
     listOfVariables = data.columns.drop('fill').drop('mode')
@@ -1123,7 +2261,8 @@ def LHCFillsMappingAggregation (listOfVariables, fillNos, beamModeList = None, m
 
     return resultDF.join(timeData)
 
-def LHCFillsMappingAggregation_v2 (listOfVariables, fillNos, beamModeList = None, mapFunctionList = [], aggFunctionList = [], flag = None, offset = None, duration = None):
+def LHCFillsMappingAggregation_v2 (listOfVariables, fillNos, beamModeList = None, mapFunctionList = [], aggFunctionList = [], flag = None, offset = None, duration = None,
+                                   max_workers = 1, checkpointFolder = None):
     '''
     
     For the selected fill numbers, beam modes and list of variables, this function creates 
@@ -1137,6 +2276,11 @@ def LHCFillsMappingAggregation_v2 (listOfVariables, fillNos, beamModeList = None
     If flag is 'next' or 'last', the next or last  measurement after or before the startTime (+offset) will be returned.
     if flag is 'duration' the extraction will be between [t1,t2], with t1=(startTime+offset) and t2=(startTime+offset+duration).
     If some of these parameters are not set, the default ones from the function _LHCCals2pd_ver2 are used.
+
+    If max_workers>1 or a checkpointFolder is given, the fills are processed one by one (extraction and reduction)
+    by a pool of max_workers threads and only the reduced rows are kept, so that the memory depends on a single fill.
+    Each reduced fill is saved in a subfolder of checkpointFolder named after the arguments of the call:
+    running again the same call after an interruption processes only the missing fills.
     
     ===EXAMPLE===
     importData.LHCFillsMappingAggregation(['LHC.BCTFR.A6R4.B%:BUNCH_INTENSITY'],6666, ['FLATTOP'],flag='duration',duration=pd.Timedelta('1m'), aggFunctionList = np.mean, mapFunctionList = np.mean)
@@ -1160,7 +2304,7 @@ def LHCFillsMappingAggregation_v2 (listOfVariables, fillNos, beamModeList = None
     # ('offset', Timedelta('0 days 00:00:00')),
     # ('duration', Timedelta('0 days 00:00:05'))]
     
-    a = inspect.getargspec(LHCCals2pd)
+    a = inspect.getfullargspec(LHCCals2pd)
     defaultValues = list(zip(a.args[-len(a.defaults):],a.defaults))
     
     defaultBeamModeList = defaultValues[0][1]
@@ -1206,8 +2350,17 @@ def LHCFillsMappingAggregation_v2 (listOfVariables, fillNos, beamModeList = None
     NoOfFills = len(fillNos)
     NoOfModes = len(beamModeList)
     
+    if max_workers > 1 or checkpointFolder is not None:
+        # map-reduce: each worker extracts and reduces a single fill
+        return _fillsMapReduce(fillNos, lambda fill: LHCFillsMappingAggregation_v2(listOfVariables, [fill], beamModeList, mapFunctionList, aggFunctionList, flag, offset, duration),
+                               max_workers, checkpointFolder,
+                               key=('LHCFillsMappingAggregation_v2', listOfVariables, beamModeList, mapFunctionList, aggFunctionList, flag, offset, duration))
+
     resultDF = pd.DataFrame()
     data = LHCCals2pd(listOfVariables, fillNos, beamModeList, fill_column=True, beamMode_column=True, flag = flag, offset = offset, duration = duration)
+    if len(data) == 0:
+        # no data in the fills
+        return pd.DataFrame()
     
     # In case of regex variables, number of variables have to be counted this way 
     listOfVariables = data.columns.drop('fill').drop('mode')
@@ -1246,26 +2399,33 @@ def LHCFillsMappingAggregation_v2 (listOfVariables, fillNos, beamModeList = None
 
     return resultDF.reset_index().set_index('fill')
 
-def LHCInjectionTree (fill_no, beam_mode = ['INJPROT', 'INJPHYS']):
+def _fillPatternChanges(paternDF, pattern_var):
     '''
-    For a given fill number, this function constructs its injection tree. Treshold number might have to be adjusted.
-    It represents the smallest jump in beam intensity that is the result of the injections.
-    
-    ========EXAMPLE========
-    tree = importData.injectionTree(6666)
-    
-    for SPS, i in zip(tree.beam1.atSPS, range(len(tree.beam1.atSPS))):
-        print('SPS '+str(i) + ': '+ str(SPS.atTime))
-        for PS, j in zip(SPS.atPS, range(len(SPS.atPS))):
-            print('\tPS '+str(i) + '.' + str(j) +': '+ str(PS.atTime))    
-            for PSB, k in zip(PS.atPSB, range(len(PS.atPSB))):
-                print('\t\tPSB '+str(i) + '.' + str(j) +'.'+str(k)+': '+ str(PSB.atTime))
-    '''   
-    patern1_var = 'LHC.BCTFR.A6R4.B1:BUNCH_FILL_PATTERN'
-    patern2_var = 'LHC.BCTFR.A6R4.B2:BUNCH_FILL_PATTERN'
+    Return the changes of the fill pattern pattern_var of paternDF (one row per change):
+    the timestamp (time), the slots added and removed (arrays) and if the pattern is empty after the change.
+    The patterns are stacked in a 2D array and differentiated once.
+    '''
+    aux = paternDF[pattern_var].dropna()
+    if len(aux) < 2:
+        return pd.DataFrame(columns=['time', 'added', 'removed', 'empty'])
+    patterns = np.stack(aux.map(np.asarray).values).astype(float)
+    diff = np.diff(patterns, axis=0)
+    rows, slots = np.where(diff == 1.0)
+    added = np.split(slots, np.searchsorted(rows, np.arange(1, len(diff))))
+    rows, slots = np.where(diff == -1.0)
+    removed = np.split(slots, np.searchsorted(rows, np.arange(1, len(diff))))
+    out = pd.DataFrame({'time': aux.index[1:], 'added': added, 'removed': removed,
+                        'empty': patterns[1:].sum(axis=1) == 0.0})
+    return out[(diff != 0).any(axis=1)].reset_index(drop=True)
+
+def _LHCInjectionTables(fill_no, beam_mode = ['INJPROT', 'INJPHYS']):
+    '''
+    Return the flat injection table (see LHCInjectionTable) and the fill pattern changes of both beams
+    (with a beam column), from a single LHCCals2pd extraction (hence from the local CALS cache, if already extracted).
+    '''
+    patern_vars = ['LHC.BCTFR.A6R4.B1:BUNCH_FILL_PATTERN', 'LHC.BCTFR.A6R4.B2:BUNCH_FILL_PATTERN']
 
-    # Parameters for injection data extractions
-    all_injection_vars = ['%.TGM:BATCH', '%PS%.TGM:%DEST%']
+    # Only the needed injector telegrams
     sps_destination_var = 'SPS.TGM:DDEST'
     cps_destination_var = 'CPS.TGM:DEST'
     psb_destination_var = 'PSB.TGM:DEST_G'
@@ -1273,8 +2433,7 @@ def LHCInjectionTree (fill_no, beam_mode = ['INJPROT', 'INJPHYS']):
     cps_batch_var = 'CPS.TGM:BATCH'
     psb_batch_var = 'PSB.TGM:BATCH'
 
-    sps_destination_beam1 = 'LHC1_TI2'
-    sps_destination_beam2 = 'LHC2_TI8'
+    sps_destination_beam = ['LHC1_TI2', 'LHC2_TI8']
     cps_destination = 'LHC'
     psb_destination = 'LHC'
 
@@ -1284,147 +2443,285 @@ def LHCInjectionTree (fill_no, beam_mode = ['INJPROT', 'INJPHYS']):
     psb_t_begin = pd.Timedelta('635ms')
     psb_t_end = pd.Timedelta('565ms')
 
-    # This function can be used to construct an injection three in beam 1 and 2.
-    # First the BEAM intensity data is extracted as it is the only reliable
-    # source of information for the final level (SPS) injections to the beams
-    paternDF = LHCCals2pd([patern1_var, patern2_var],fill_no, beam_mode)
-
-    patern1DF = pd.DataFrame(paternDF['LHC.BCTFR.A6R4.B1:BUNCH_FILL_PATTERN'].map(np.array))
-    patern2DF = pd.DataFrame(paternDF['LHC.BCTFR.A6R4.B2:BUNCH_FILL_PATTERN'].map(np.array))
-
-    diff1DF = patern1DF.diff().dropna()
-    bunches_added_b1 = pd.DataFrame(diff1DF['LHC.BCTFR.A6R4.B1:BUNCH_FILL_PATTERN'].map(lambda x : np.where(x == 1.0)[0]))
-    bunches_added_b1['change in B1'] = (bunches_added_b1['LHC.BCTFR.A6R4.B1:BUNCH_FILL_PATTERN'].map(lambda x : x.size is not 0))
+    data = LHCCals2pd(patern_vars + [sps_destination_var, cps_destination_var, psb_destination_var,
+                                     cps_batch_var, psb_batch_var], fill_no, beam_mode)
+    data = data[~data.index.duplicated(keep='first')].sort_index()
+    for i in patern_vars + [sps_destination_var, cps_destination_var, psb_destination_var, cps_batch_var, psb_batch_var]:
+        if i not in data: data[i] = np.nan
 
-    diff2DF = patern2DF.diff().dropna()
-    bunches_added_b2 = pd.DataFrame(diff2DF['LHC.BCTFR.A6R4.B2:BUNCH_FILL_PATTERN'].map(lambda x : np.where(x == 1.0)[0]))
-    bunches_added_b2['change in B2'] = (bunches_added_b2['LHC.BCTFR.A6R4.B2:BUNCH_FILL_PATTERN'].map(lambda x : x.size is not 0))
-
-
-    # In the end, all maxima that are lower than some treshold are discarded
-    only_max_b1 = bunches_added_b1[bunches_added_b1['change in B1'] == True]
-    only_max_b2 = bunches_added_b2[bunches_added_b2['change in B2'] == True]
-
-    only_max = [only_max_b1, only_max_b2]
-    # To get exact moments of injections, it is required to get all of the injection data
-    injection_data = LHCCals2pd(all_injection_vars, fill_no, beam_mode)
+    # The BEAM intensity data is the only reliable source of information for the SPS injections into the LHC
+    changes = []
+    sps = []
+    for b in range(0, 2):
+        aux = _fillPatternChanges(data, patern_vars[b])
+        aux['beam'] = b + 1
+        changes.append(aux)
+        bct = aux[aux['added'].map(len) > 0][['time', 'added']].rename(columns={'time': 'bctTime', 'added': 'bunches'})
+        extractions = pd.DataFrame({'spsTime': data.index[(data[sps_destination_var] == sps_destination_beam[b]).values]})
+        # each BCT jump is paired with the last SPS extraction to the beam in the previous 30 s
+        bct = pd.merge_asof(bct, extractions, left_on='bctTime', right_on='spsTime', direction='backward',
+                            tolerance=sps_t_delta, allow_exact_matches=False)
+        bct = bct.dropna(subset=['spsTime']).drop_duplicates(subset=['spsTime'], keep='first')
+        bct['beam'] = b + 1
+        bct['spsIndex'] = np.arange(len(bct))
+        sps.append(bct)
+    changes = pd.concat(changes, ignore_index=True)
+    changes['empty'] = changes['empty'].astype(bool)
+    sps = pd.concat(sps, ignore_index=True).sort_values('spsTime', kind='mergesort')
+
+    # PS extractions: t_sps - ps_t_begin <= t_ps <= t_sps + ps_t_end
+    selection = (data[cps_destination_var] == cps_destination).values
+    ps = pd.DataFrame({'psTime': data.index[selection], 'psBatch': data[cps_batch_var].values[selection]})
+    ps['key'] = ps['psTime'] + ps_t_begin
+    ps = pd.merge_asof(ps, sps[['spsTime', 'beam', 'spsIndex']], left_on='key', right_on='spsTime',
+                       direction='backward', tolerance=ps_t_begin + ps_t_end).dropna(subset=['spsTime'])
+    ps = ps.drop(columns='key')
+    ps['psIndex'] = ps.groupby(['beam', 'spsIndex']).cumcount()
+
+    # PSB extractions: t_ps - psb_t_begin <= t_psb <= t_ps + psb_t_end
+    selection = (data[psb_destination_var] == psb_destination).values
+    psb = pd.DataFrame({'psbTime': data.index[selection]})
+    psb['key'] = psb['psbTime'] + psb_t_begin
+    psb = pd.merge_asof(psb, ps[['psTime', 'beam', 'spsIndex', 'psIndex']], left_on='key', right_on='psTime',
+                        direction='backward', tolerance=psb_t_begin + psb_t_end).dropna(subset=['psTime'])
+    psb = psb.drop(columns=['key', 'psTime'])
+    psb['psbIndex'] = psb.groupby(['beam', 'spsIndex', 'psIndex']).cumcount()
+
+    table = sps.merge(ps.drop(columns='spsTime'), on=['beam', 'spsIndex'], how='left')
+    table = table.merge(psb, on=['beam', 'spsIndex', 'psIndex'], how='left')
+    table = table.sort_values(['beam', 'spsIndex', 'psIndex', 'psbIndex'], kind='mergesort').reset_index(drop=True)
+    table = table[['beam', 'spsIndex', 'spsTime', 'bctTime', 'bunches', 'psIndex', 'psTime', 'psBatch', 'psbIndex', 'psbTime']]
+    return table, changes
+
+def LHCInjectionTable (fill_no, beam_mode = ['INJPROT', 'INJPHYS']):
+    '''
+    For a given fill number, this function returns its injections as a flat table, one row per PSB injection
+    (an SPS or PS injection without the injector data has a single row with NaN for the missing levels):
+    - beam (1 or 2), spsIndex (order of the SPS injection in the beam), spsTime, bctTime (time of the jump of the
+      fill pattern) and bunches (the slots filled by the SPS injection),
+    - psIndex (order in the SPS injection), psTime and psBatch,
+    - psbIndex (order in the PS injection) and psbTime.
+
+    The fill pattern jumps are joined with the SPS, PS and PSB telegrams by sorted-time interval joins:
+    the last SPS extraction to the beam in the 30 s before the jump, then each PS extraction to the SPS injection
+    in [t_sps-4.235 s, t_sps+7.765 s] and each PSB extraction to the PS injection in [t_ps-0.635 s, t_ps+0.565 s].
+    The data come from one LHCCals2pd extraction, so they are taken from the local CALS cache the second time.
 
-    spsDF_b1 = injection_data[injection_data[sps_destination_var]== sps_destination_beam1][[sps_destination_var]]
-    spsDF_b2 = injection_data[injection_data[sps_destination_var]== sps_destination_beam2][[sps_destination_var]]
-    psDF = injection_data[injection_data[cps_destination_var] == cps_destination][[cps_batch_var]]
-    psbDF = injection_data[injection_data[psb_destination_var] == psb_destination][[psb_batch_var]]
+    ========EXAMPLE========
+    table = importData.LHCInjectionTable(6666)
+    # number of PS batches per SPS injection
+    table.groupby(['beam','spsIndex'])['psIndex'].nunique()
+    '''
+    return _LHCInjectionTables(fill_no, beam_mode)[0]
 
-    # You have to extract only those injections that made it to the beams.
-    # That is why the maximum extraction method is used.
+def LHCInjectionTree (fill_no, beam_mode = ['INJPROT', 'INJPHYS']):
+    '''
+    For a given fill number, this function constructs its injection tree (derived from LHCInjectionTable).
     
-    sps_injections_b1 = pd.DataFrame()
-    sps_injections_b2 = pd.DataFrame()
-
-    for t2 in only_max_b1.index:
-        t1 = t2 - sps_t_delta
-        new_injection = spsDF_b1[(spsDF_b1.index > t1) & (spsDF_b1.index < t2)]
-        if not new_injection.index.empty and new_injection.index[0] not in sps_injections_b1.index:
-            sps_injections_b1 = sps_injections_b1.append(new_injection)
-        else:
-            only_max_b1.drop(t2)
-
-    for t2 in only_max_b2.index:
-        t1 = t2 - sps_t_delta
-        new_injection = spsDF_b2[(spsDF_b2.index > t1) & (spsDF_b2.index < t2)]
-        if not new_injection.index.empty and new_injection.index[0] not in sps_injections_b2.index:
-            sps_injections_b2 = sps_injections_b2.append(new_injection)
-        else:
-            only_max_b2.drop(t2)
-
-    # These lists are related to the dotdictonary that will contain all of the other injections
-    tree = dotdict()
-    sps_list = [[], []]
+    ========EXAMPLE========
+    tree = importData.LHCInjectionTree(6666)
     
-    # This list containts the two sps injection dataframes needed for the creation of the tree
-    sps_injections = [sps_injections_b1, sps_injections_b2]
+    for SPS, i in zip(tree.beam1.atSPS, range(len(tree.beam1.atSPS))):
+        print('SPS '+str(i) + ': '+ str(SPS.atTime))
+        for PS, j in zip(SPS.atPS, range(len(SPS.atPS))):
+            print('\tPS '+str(i) + '.' + str(j) +': '+ str(PS.atTime))    
+            for PSB, k in zip(PS.atPSB, range(len(PS.atPSB))):
+                print('\t\tPSB '+str(i) + '.' + str(j) +'.'+str(k)+': '+ str(PSB.atTime))
+    '''   
+    table, changes = _LHCInjectionTables(fill_no, beam_mode)
 
-    # First we iterate through beam numbers (b)
+    tree = dotdict()
     for b in range(0, 2):
-        
-        #Then we iterate through all the sps injectios in particular beam 
-        for i in range(0, len(sps_injections[b].index)):
-
-
-            t_sps = sps_injections[b].index[i]
-            sps_injections_dict = dotdict({"atTime":t_sps})
-            sps_injections_dict.update({"atTimeBCT":only_max[b].index[i]})
-
-            ps_injections = psDF[(psDF.index >= t_sps - ps_t_begin) & (psDF.index <= t_sps + ps_t_end)]
-
+        sps_list = []
+        for spsIndex, spsDF in table[table['beam'] == b + 1].groupby('spsIndex', sort=True):
             ps_list = []
-            
-            #Then we iterate through all the ps injectios in particular sps injection
-            for j in range(0, len(ps_injections.index)):
-
-                t_ps = ps_injections.index[j]
-                ps_injections_dict = dotdict({"atTime":t_ps, "atBatch" : ps_injections[cps_batch_var][j]})
+            for psIndex, psDF in spsDF.dropna(subset=['psIndex']).groupby('psIndex', sort=True):
+                psb_list = [dotdict({"atTime": t_psb}) for t_psb in psDF['psbTime'].dropna()]
+                ps_list.append(dotdict({"atTime": psDF['psTime'].iloc[0], "atBatch": psDF['psBatch'].iloc[0],
+                                        "atPSB": psb_list}))
+            sps_list.append(dotdict({"atTime": spsDF['spsTime'].iloc[0], "atTimeBCT": spsDF['bctTime'].iloc[0],
+                                     "atPS": ps_list, "atBunches": spsDF['bunches'].iloc[0]}))
+
+        # DETECTION OF DUMPS (the pattern is empty after the change) AND OF LOST BUNCHES
+        aux = changes[(changes['beam'] == b + 1) & (changes['removed'].map(len) > 0)]
+        dump_list = [dotdict({"atTime": t, "atBunches": bunches})
+                     for t, bunches in zip(aux['time'][aux['empty']], aux['removed'][aux['empty']])]
+        lost_list = [dotdict({"atTime": t, "atBunches": bunches})
+                     for t, bunches in zip(aux['time'][~aux['empty']], aux['removed'][~aux['empty']])]
+
+        tree["beam"+str(b + 1)] = dotdict({"atSPS": sps_list, "atDump": dump_list, "atLost": lost_list})
+    return tree
 
-                psb_injections = psbDF[(psbDF.index >= t_ps - psb_t_begin) & (psbDF.index <= t_ps + psb_t_end)]
-                psb_list = []
-                
-                #Then we iterate through all the psb injectios in particular ps injection
-                for k in range(0, len(psb_injections.index)):
-                    t_psb = psb_injections.index[k]
-                    psb_injections_dict = dotdict({"atTime":t_psb})
-                    psb_list.append(psb_injections_dict)
+def _UTCTimestamp(t):
+    '''
+    Return t as UTC pd.Timestamp (tz-naive t is considered UTC), None if t is None.
+    '''
+    if t is None:
+        return None
+    t=pd.Timestamp(t)
+    if t.tz is None:
+        return t.tz_localize('UTC')
+    return t.tz_convert('UTC')
+
+def _dBLMKeyIndexFiles(fileName):
+    '''
+    Return the candidate names of the key index of the dBLM file: next to the file and,
+    if its folder is read-only, in the calsCache.folder.
+    '''
+    folder, name = os.path.split(os.path.abspath(fileName))
+    return [os.path.join(folder, '.'+name+'.keys.npz'),
+            os.path.join(calsCache.folder, 'dBLM',
+                         name+'_'+hashlib.md5(os.path.abspath(fileName).encode()).hexdigest()[:8]+'.keys.npz')]
 
-                ps_injections_dict.update(dotdict({"atPSB" : psb_list}))
-                ps_list.append(ps_injections_dict)
+def dBLMKeyIndex(fileName, useCache=True):
+    '''
+    Return the keys of the dBLM file (pd.DataFrame with the column KEY) indexed by their UTC timestamps
+    (the keys are CET times, e.g., '2018-07-24 19:51:10.443826') in chronological order.
 
-            sps_injections_dict.update({"atPS": ps_list})
-            sps_injections_dict.update({"atBunches": only_max[b].iloc[i, 0]})
-            sps_list[b].append(sps_injections_dict)
+    The keys are parsed at once (pd.to_datetime with an explicit format) and the index is saved
+    next to the file (or in importData.calsCache.folder if the folder is read-only):
+    it is parsed again only if the file is modified.
 
-    tree["beam1"] = dotdict({"atSPS":sps_list[0]})
-    tree["beam2"] = dotdict({"atSPS":sps_list[1]})
+    ===Example===
+    importData.dBLMKeyIndex('/eos/project/dblm/TZ76/TCP_18_B2/hist_BOX2_0724-195110_f6972_ADJUST.hdf5')
+    '''
+    mtime=os.path.getmtime(fileName)
+    for indexFile in _dBLMKeyIndexFiles(fileName):
+        if useCache and os.path.exists(indexFile):
+            try:
+                with np.load(indexFile, allow_pickle=False) as aux:
+                    if aux['mtime']==mtime:
+                        return pd.DataFrame({'KEY':aux['keys'].astype(str)},
+                                            index=pd.to_datetime(aux['timestamps']).tz_localize('UTC'))
+            except Exception:
+                pass # a corrupted index is built again
+    with h5py.File(fileName,'r') as a:
+        keys=np.array(list(a['data'].keys()), dtype=str)
+    timestamps=pd.to_datetime(pd.Series(keys), format='%Y-%m-%d %H:%M:%S.%f', errors='coerce')
+    if timestamps.isnull().any():
+        # keys in other formats
+        timestamps[timestamps.isnull()]=pd.to_datetime(pd.Series(keys)[timestamps.isnull()], errors='coerce')
+    timestamps=pd.DatetimeIndex(timestamps).tz_localize('CET', ambiguous='infer').tz_convert('UTC')
+    order=np.argsort(timestamps.values, kind='mergesort')
+    keys, timestamps = keys[order], timestamps[order]
+    for indexFile in (_dBLMKeyIndexFiles(fileName) if useCache else []):
+        # a temporary name unique to the writer (the folder can be shared by several processes or hosts)
+        tmpFile=indexFile+'.'+uuid.uuid4().hex+'.tmp'
+        try:
+            if not os.path.exists(os.path.dirname(indexFile)):
+                os.makedirs(os.path.dirname(indexFile), exist_ok=True)
+            with open(tmpFile, 'wb') as f:
+                np.savez(f, keys=keys, mtime=mtime,
+                         timestamps=timestamps.tz_localize(None).values.astype('datetime64[ns]'))
+            os.replace(tmpFile, indexFile)
+            break
+        except OSError:
+            # read-only folder, next candidate
+            if os.path.exists(tmpFile):
+                try:
+                    os.remove(tmpFile)
+                except OSError:
+                    pass
+    return pd.DataFrame({'KEY':keys}, index=timestamps)
 
-    # DETECTION OF DUMPS
+def dBLMFiles(folder, t1=None, t2=None, pattern='*.hdf5'):
+    '''
+    Return the dBLM files of the folder (glob pattern, e.g., 'TCP_18_B2/*_f6972_*.hdf5') with keys in [t1,t2]:
+    a pd.DataFrame with the columns fileName, startTime, endTime (first and last key, UTC) and noOfKeys (in [t1,t2]),
+    sorted by startTime. t1 and t2 are tz-aware pandas datetime (tz-naive ones are considered UTC), None for no limit.
 
+    ===Example===
+    importData.dBLMFiles('/eos/project/dblm/TZ76', pd.Timestamp('2018-07-24 18:00', tz='UTC'),
+                         pd.Timestamp('2018-07-24 20:00', tz='UTC'), pattern='TCP_18_B2/*.hdf5')
+    '''
+    import glob
+    t1, t2 = _UTCTimestamp(t1), _UTCTimestamp(t2)
+    out=[]
+    for fileName in sorted(glob.glob(os.path.join(folder, pattern))):
+        aux=dBLMKeyIndex(fileName).index
+        if len(aux)==0:
+            continue
+        noOfKeys=aux.slice_indexer(t1, t2)
+        noOfKeys=len(range(*noOfKeys.indices(len(aux))))
+        if noOfKeys:
+            out.append({'fileName':fileName, 'startTime':aux[0], 'endTime':aux[-1], 'noOfKeys':noOfKeys})
+    return pd.DataFrame(out, columns=['fileName','startTime','endTime','noOfKeys']).sort_values('startTime').reset_index(drop=True)
+
+def dBLMFolder2pd(folder, bunchList, rollInterval, t1=None, t2=None, pattern='*.hdf5', max_workers=4):
+    '''
+    As dBLM2pd but for all the dBLM files of the folder (glob pattern, see dBLMFiles) with keys in [t1,t2].
+    The files are read by a pool of max_workers threads and the result is sorted by time
+    (the .diff() is done file by file, so the first row of each file is NaN).
 
-    bunches_removed_b1 = pd.DataFrame(diff1DF['LHC.BCTFR.A6R4.B1:BUNCH_FILL_PATTERN'].map(lambda x : np.where(x == -1.0)[0]))
-    bunches_removed_b1['change in B1'] = (bunches_removed_b1['LHC.BCTFR.A6R4.B1:BUNCH_FILL_PATTERN'].map(lambda x : x.size is not 0))
-    bunches_removed_b1['empty'] = patern1DF['LHC.BCTFR.A6R4.B1:BUNCH_FILL_PATTERN'].map(lambda x : np.sum(x) == 0.0)
+    ===Example===
+    aux=importData.dBLMFolder2pd('/eos/project/dblm/TZ76', [10,390], 13332,
+                                 pd.Timestamp('2018-07-24 18:00', tz='UTC'), pd.Timestamp('2018-07-24 20:00', tz='UTC'),
+                                 pattern='TCP_18_B2/*.hdf5')
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    files=dBLMFiles(folder, t1, t2, pattern)
+    if len(files)==0:
+        return pd.DataFrame()
+    with ThreadPoolExecutor(max_workers=max(1,min(max_workers,len(files)))) as executor:
+        listDF=list(executor.map(lambda fileName: dBLM2pd(fileName, bunchList, rollInterval, t1, t2), files['fileName']))
+    return pd.concat(listDF).sort_index(kind='mergesort')
 
-    bunches_removed_b2 = pd.DataFrame(diff2DF['LHC.BCTFR.A6R4.B2:BUNCH_FILL_PATTERN'].map(lambda x : np.where(x == -1.0)[0]))
-    bunches_removed_b2['change in B2'] = (bunches_removed_b2['LHC.BCTFR.A6R4.B2:BUNCH_FILL_PATTERN'].map(lambda x : x.size is not 0))
-    bunches_removed_b2['empty'] = patern2DF['LHC.BCTFR.A6R4.B2:BUNCH_FILL_PATTERN'].map(lambda x : np.sum(x) == 0.0)
-    
-    dump_b1 = bunches_removed_b1[(bunches_removed_b1['change in B1'] == True) & (bunches_removed_b1['empty'] == True)]
-    dump_b2 = bunches_removed_b2[(bunches_removed_b2['change in B2'] == True) & (bunches_removed_b2['empty'] == True)]    
-    
-    dump_list = [[], []]
-    dump_bunches = [dump_b1, dump_b2]
-    
-    for b in range(0, 2):
-        for i in range(0, len(dump_bunches[b].index)):
-            dump_dict = dotdict({"atTime":dump_bunches[b].index[i]})
-            dump_dict.update({"atBunches":dump_bunches[b].iloc[i, 0]})
-            dump_list[b].append(dump_dict)
-    
-    tree["beam1"].update({"atDump":dump_list[0]})      
-    tree["beam2"].update({"atDump":dump_list[1]})
-    
-    lost_b1 = bunches_removed_b1[(bunches_removed_b1['change in B1'] == True) & (bunches_removed_b1['empty'] == False)]
-    lost_b2 = bunches_removed_b2[(bunches_removed_b2['change in B2'] == True) & (bunches_removed_b2['empty'] == False)]    
-    
-    lost_list = [[], []]
-    lost_bunches = [lost_b1, lost_b2]
-    
-    for b in range(0, 2):
-        for i in range(0, len(lost_bunches[b].index)):
-            lost_dict = dotdict({"atTime":lost_bunches[b].index[i]})
-            lost_dict.update({"atBunches":lost_bunches[b].iloc[i, 0]})
-            lost_list[b].append(lost_dict)
-    
-    tree["beam1"].update({"atLost":lost_list[0]})      
-    tree["beam2"].update({"atLost":lost_list[1]})
-            
-    return tree
+def _dBLMPieces(bunchList, rollInterval, noOfBins):
+    '''
+    Return, for the bunch windows [5%,95%] of the slot in the rolled signal, the corresponding pieces
+    [start,end) of the raw signal (rolled y[j]=x[(j-rollInterval) mod noOfBins]): a window wrapping around
+    the end of the raw signal gives two pieces. It returns the arrays start, end and owner (position in bunchList).
+    '''
+    bunchList=np.asarray(bunchList)
+    lo=((bunchList+0.05)/3564.*55578).astype(int)
+    hi=((bunchList+0.95)/3564.*55578).astype(int)
+    length=np.maximum(hi-lo,0)
+    start=np.mod(lo-rollInterval, noOfBins)
+    first=np.minimum(length, noOfBins-start)
+    owner=np.arange(len(bunchList))
+    wrapped=first<length
+    return (np.concatenate([start, np.zeros(wrapped.sum(),dtype=int)]),
+            np.concatenate([start+first, (length-first)[wrapped]]),
+            np.concatenate([owner, owner[wrapped]]))
+
+def _dBLMIntegrate(group, keys, bunchList, rollInterval, maxGap=4096):
+    '''
+    Return the (len(keys), len(bunchList)) array of the integrals of the bunch windows of the datasets keys of group.
+    Only the bins of the windows are read (hyperslabs of the pieces closer than maxGap bins are merged),
+    then all the windows are integrated with a single cumulative sum of the stacked (keys, bins) array.
+    '''
+    out=np.zeros((len(keys), len(bunchList)))
+    if len(keys)==0 or len(bunchList)==0:
+        return out
+    dataset=group[keys[0]]
+    start, end, owner = _dBLMPieces(bunchList, rollInterval, dataset.shape[0])
+    keep=end>start
+    start, end, owner = start[keep], end[keep], owner[keep]
+    if len(start)==0:
+        return out
+    # merge the pieces in few contiguous hyperslabs
+    order=np.argsort(start, kind='mergesort')
+    segments=[]
+    for a,b in zip(start[order], end[order]):
+        if len(segments) and a<=segments[-1][1]+maxGap:
+            segments[-1][1]=max(segments[-1][1], b)
+        else:
+            segments.append([a,b])
+    segments=np.array(segments)
+    offsets=np.concatenate([[0], np.cumsum(segments[:,1]-segments[:,0])])
+    accumulator=np.int64 if np.issubdtype(dataset.dtype, np.integer) else float
+    buffer=np.empty((len(keys), offsets[-1]), dtype=accumulator)
+    for i,key in enumerate(keys):
+        dataset=group[key]
+        for j,(a,b) in enumerate(segments):
+            buffer[i, offsets[j]:offsets[j+1]]=dataset[a:b]
+    cumulative=np.zeros((len(keys), offsets[-1]+1), dtype=accumulator)
+    np.cumsum(buffer, axis=1, out=cumulative[:,1:])
+    # position of each piece in the buffer
+    segment=np.searchsorted(segments[:,0], start, side='right')-1
+    position=offsets[segment]+start-segments[segment,0]
+    np.add.at(out.T, owner, (cumulative[:, position+end-start]-cumulative[:, position]).T)
+    return out
 
 def dBLM2pd(fileName, bunchList,rollInterval,t1=None,t2=None):
     '''
@@ -1446,7 +2743,11 @@ def dBLM2pd(fileName, bunchList,rollInterval,t1=None,t2=None):
         For checking the delay have a look to the exa ple below.
     
     t1 and t2 are the timestamps to consider to windowing the analysis. 
-    
+    The timestamps of the keys are read from the index of the file (see dBLMKeyIndex).
+    For the files of a folder see dBLMFolder2pd.
+
+    Only the bins of the requested bunches are read from the file and all the bunches are integrated
+    at once (cumulative sum), so that all the 3564 bunches cost about as much as two.
     
     Thanks to A. Gorzawski and A. Poyet for providing the insight and the original code.
 
@@ -1506,22 +2807,16 @@ def dBLM2pd(fileName, bunchList,rollInterval,t1=None,t2=None):
         final_DF['bunch_'+str(fill[i])] = myDF.ix[:,(bunchCenters[i]-nbBins/2):(bunchCenters[i]+nbBins/2)].sum(axis=1).diff().resample(str(secondOfResampling)+'s').sum()/secondOfResampling
     return final_DF
     '''
-    a = h5py.File(fileName,'r')
-    b = a['data']
+    with h5py.File(fileName,'r') as a:
+        b = a['data']
     
-    myDF=pd.DataFrame()
-    
-    aux=pd.DataFrame(list(b.keys()),index=list(map(pd.Timestamp,list(b.keys()))),columns=['KEY'] )
-    aux.index=aux.index.tz_localize('CET').tz_convert('UTC')
-    if t1==None: t1=aux.index[0]
-    if t2==None: t2=aux.index[-1]
-    aux=aux[t1:t2].copy()
-    # the rollInterval depends on the electric delay of the acquisition device wrt the bunch 0
-    aux['VALUE']=aux['KEY'].apply(lambda x:np.roll(b[x],rollInterval,axis=0)) 
-    for i in bunchList:
-        # Integrating between 5 and 95% of the bunch slot and differentiating
-        myDF['bunch_'+str(i)]=aux['VALUE'].apply(lambda x:np.sum(x[int((i+0.05)/3564.*55578):int((i+0.95)/3564.*55578)])).diff()
-    return myDF
+        aux=dBLMKeyIndex(fileName)
+        aux=aux[_UTCTimestamp(t1):_UTCTimestamp(t2)]
+        # Integrating between 5 and 95% of the bunch slot (the rollInterval, i.e., the electric delay of the
+        # acquisition device wrt the bunch 0, is folded in the positions of the bins to read) and differentiating
+        bunchList=pd.unique(np.asarray(bunchList))
+        values=_dBLMIntegrate(b, list(aux['KEY']), bunchList, rollInterval)
+    return pd.DataFrame(values, index=aux.index, columns=['bunch_'+str(i) for i in bunchList]).diff()
 
 def LHCBunchLifeTimeInSquezee (noOfFill, resample_second = 60, duration_of_stable = pd.Timedelta('0 days 00:10:00')):
     '''
@@ -1534,47 +2829,104 @@ def LHCBunchLifeTimeInSquezee (noOfFill, resample_second = 60, duration_of_stabl
     
     '''
     
+    from . import MDanalysis
+
     bunch_intensity = LHCCals2pd(['LHC.BCTFR.A6R4.B%:BUNCH_INTENSITY'], noOfFill, ['SQUEEZE'])#, flag='duration', duration=pd.Timedelta('0 days 00:05:00'))
-    bunch_intensity = bunch_intensity.append(LHCCals2pd(['LHC.BCTFR.A6R4.B%:BUNCH_INTENSITY'], noOfFill, ['STABLE'], flag='duration', duration = duration_of_stable))
+    bunch_intensity = pd.concat([bunch_intensity, LHCCals2pd(['LHC.BCTFR.A6R4.B%:BUNCH_INTENSITY'], noOfFill, ['STABLE'], flag='duration', duration = duration_of_stable)], sort=True)
+
+    out=[]
+    for beam in ['B1','B2']:
+        # all the bunches at once: one 2D array, one resampling, one diff (see MDanalysis.BunchLifetime)
+        aux = bunch_intensity['LHC.BCTFR.A6R4.'+beam+':BUNCH_INTENSITY'].dropna().sort_index()
+        engine = MDanalysis.BunchLifetime(resample_second)
+        if len(aux):
+            engine.update(aux.index, np.stack(aux.values))
+            engine.flush()
+        out.append(engine.lifetime)
+    beam1DF, beam2DF = out
     
-    noOfBunch = len(bunch_intensity['LHC.BCTFR.A6R4.B1:BUNCH_INTENSITY'].iloc[0])
+    return beam1DF, beam2DF
 
-    beam1DF=pd.DataFrame()
-    beam2DF=pd.DataFrame()
+class SPSInjectionIndex:
+    '''
+    Inverted index from (beam, bunch slot) to the SPS injections (the positions in tree.beam1.atSPS
+    and tree.beam2.atSPS) of an LHCInjectionTree result, built once and queried for many slots at once.
 
-    for i in range(0, noOfBunch):
-        a1 = bunch_intensity['LHC.BCTFR.A6R4.B1:BUNCH_INTENSITY'].dropna().apply(lambda x: x[i]).resample(str(resample_second)+'s').mean()
-        b1 = a1.diff()/resample_second
-        beam1DF['lifetime of bunch ' + str(i)+ ' [h]'] = - ((a1/b1).dropna())/3600
+    The (slot, injection) pairs of each beam are sorted by slot: the injections of a slot are a contiguous
+    range of the sorted array, so that the first/last injection and the number of injections of all
+    the slots are obtained without python loops.
 
-        a2 = bunch_intensity['LHC.BCTFR.A6R4.B2:BUNCH_INTENSITY'].dropna().apply(lambda x: x[i]).resample(str(resample_second)+'s').mean()
-        b2 = a2.diff()/resample_second
-        beam2DF['lifetime of bunch ' + str(i)+ ' [h]'] = - ((a2/b2).dropna())/3600
-    
-    return beam1DF, beam2DF
+    ===Example===
+    tree = importData.LHCInjectionTree(6666)
+    index = importData.SPSInjectionIndex(tree)
+    index.injections(1, 522)       # all the SPS injections of beam 1 that filled the slot 522
+    index.last(1)                  # the last SPS injection of each of the 3564 slots of beam 1 (-1 if never filled)
+    index.count(2, [10, 11, 12])   # how many times the slots were filled in beam 2
+    '''
+    def __init__(self, tree, noOfSlots=3564):
+        self.noOfSlots=noOfSlots
+        self._injections={}
+        self._offsets={}
+        for b in [1, 2]:
+            atSPS=tree['beam'+str(b)].atSPS
+            slots=[np.asarray(i.atBunches, dtype=int) for i in atSPS]
+            injections=[np.full(len(j), i, dtype=int) for i,j in enumerate(slots)]
+            slots=np.concatenate(slots) if len(slots) else np.zeros(0, dtype=int)
+            injections=np.concatenate(injections) if len(injections) else np.zeros(0, dtype=int)
+            order=np.lexsort((injections, slots))
+            self._injections[b]=injections[order]
+            self._offsets[b]=np.searchsorted(slots[order], np.arange(noOfSlots+1))
+
+    def _slots(self, slots):
+        if slots is None:
+            return np.arange(self.noOfSlots)
+        return np.asarray(slots, dtype=int)
+
+    def injections(self, beam, slot):
+        '''
+        Return the array of the SPS injections of the beam that filled the slot (chronological order).
+        '''
+        return self._injections[beam][self._offsets[beam][slot]:self._offsets[beam][slot+1]]
+
+    def count(self, beam, slots=None):
+        '''
+        Return the number of SPS injections that filled each slot (all the slots if None).
+        '''
+        slots=self._slots(slots)
+        return self._offsets[beam][slots+1]-self._offsets[beam][slots]
+
+    def first(self, beam, slots=None):
+        '''
+        Return the first SPS injection that filled each slot (all the slots if None), -1 if never filled.
+        '''
+        slots=self._slots(slots)
+        aux=self._injections[beam][np.minimum(self._offsets[beam][slots], len(self._injections[beam])-1)] \
+            if len(self._injections[beam]) else np.zeros(len(slots), dtype=int)
+        return np.where(self.count(beam, slots)>0, aux, -1)
+
+    def last(self, beam, slots=None):
+        '''
+        Return the last SPS injection that filled each slot (all the slots if None), -1 if never filled.
+        '''
+        slots=self._slots(slots)
+        aux=self._injections[beam][np.maximum(self._offsets[beam][slots+1]-1, 0)] \
+            if len(self._injections[beam]) else np.zeros(len(slots), dtype=int)
+        return np.where(self.count(beam, slots)>0, aux, -1)
 
 def bunch2SPSInjection (tree, noBunch):
     '''
     This function identifies in which SPS injection of a paricular tree a bunch is located.
+    For many bunches (or many calls on the same tree) use SPSInjectionIndex.
     ===EXAMPLE===
     fillNo = 6666
-    bunchNo = 522
+    noBunch = 522
     tree = importData.LHCInjectionTree(fillNo)
     noOfSPS = importData.bunch2SPSInjection (tree, noBunch)
     # Last time bunchNo was injected in beam 1
     noOfSPS = noOfSPS[0][-1]
     '''
-    noBunch = 522
-    noOfSPS = [[], []]
-
-    beam = [tree.beam1, tree.beam2]
-
-    for b in range(0, 2):
-        for i in range(len(beam[b].atSPS)):
-            if noBunch in beam[b].atSPS[i].atBunches:
-                noOfSPS[b].append(i)
-                
-    return noOfSPS
+    index = SPSInjectionIndex(tree)
+    return [index.injections(1, noBunch).tolist(), index.injections(2, noBunch).tolist()]
 
 def _fillBeamModes(fillDF):
     auxNoFill=fillDF[fillDF['mode']!='FILL']
@@ -1614,3 +2966,184 @@ def _LHCInstant(t1):
         return aux
     else:
         return pd.DataFrame()
+
+class _TFS:
+    '''
+       TFS parameters from MADX TFS output.
+       The approach used is mainly inherithed from the class TWISS suggested by H. Bartosik et al.
+    '''
+           
+    def __init__(self, filename): 
+        self.indx={}
+        self.keys=[]
+        alllabels=[]
+        #if '.gz' in filename:
+        #    f=gzip.open(filename, 'rb')
+        #else:
+        f=open(filename, 'r')
+            
+        for line in f:
+            if ("@ " not in line and "@" in line): 
+                line = replace(line, "@" , "@ ")
+            if ("@ " in line and "%" in line and "s" not in line.split()[2]) :
+                label=line.split()[1]
+                try:
+                    exec("self."+label+"= "+str(float((line.replace( '"', '')).split()[3])))
+                except:
+                    print(("Problem parsing: "+ line))
+                    print("Going to be parsed as string")
+                    try:
+                        exec("self."+label+"= \""+(line.split()[3]).replace( '"', '')+"\"")
+                    except:
+                        print("Problem persits, let's ignore it!")
+            elif ("@ " in line and "s"  in line.split()[2]):
+                label=(line.split()[1]).replace(":","")
+                exec("self."+label+"= \""+(line.replace('"', '')).split()[3]+"\"")
+
+            if ("* " in line or "*\t" in line) :
+                    alllabels=line.split()
+                    for j in range(1,len(alllabels)):
+                        exec("self."+alllabels[j]+"= []")
+                        self.keys.append(alllabels[j])
+                            
+            if ("$ " in line or "$\t" in line) :
+                alltypes=line.split()                
+
+            if ("@" not in line and "*" not in line and "$" not in line) :
+                values=line.split()   
+                for j in range(0,len(values)):
+                    if ("%hd" in alltypes[j+1]):                      
+                        exec("self."+alllabels[j+1]+".append("+str(int(values[j]))+")")                 
+                    if ("%le" in alltypes[j+1]):                      
+                        exec("self."+alllabels[j+1]+".append("+str(float(values[j]))+")")
+                    if ("s" in alltypes[j+1]):
+                        try:
+                            exec("self."+alllabels[j+1]+".append("+values[j]+")")
+                        except:
+                            exec("self."+alllabels[j+1]+".append(\""+values[j]+"\")") #To allow with or without ""
+                        if "NAME"==alllabels[j+1]:
+                            self.indx[values[j].replace('"', '')]=len(self.NAME)-1
+                            self.indx[values[j].replace('"', '').upper()]=len(self.NAME)-1
+                            self.indx[values[j].replace('"', '').lower()]=len(self.NAME)-1
+        f.close()
+        
+        for j in range(1,len(alllabels)):
+            if (("%le" in alltypes[j]) | ("%hd" in alltypes[j])  ):  
+                exec("self."+alllabels[j]+"= np.array(self."+alllabels[j]+")") 
+
+
+def _execTFS2pd(myFile):
+        '''
+        The original (exec-based) import of a MADX TFS file in a pandas dataframe.
+        It is kept as reference for _benchmarkTFS2pd.
+        '''
+        a=_TFS(myFile);
+        aux=[]
+        aux1=[]
+
+        for i in dir(a):
+            if not i[0]=='_':
+                if type(getattr(a,i)) is float:
+                    #print(i + ":"+ str(type(getattr(a,i))))
+                    aux.append(i)
+                    aux1.append(getattr(a,i))
+                if type(getattr(a,i)) is str:
+                    #print(i + ":"+ str(type(getattr(a,i))))
+                    aux.append(i)
+                    aux1.append(getattr(a,i))
+
+        myList=[]
+        myColumns=[]
+        for i in a.keys:
+            myContainer=getattr(a, i)
+            if len(myContainer)==0:
+                print(("The column "+ i + ' is empty.'))
+            else:
+                myColumns.append(i)
+                myList.append(myContainer)
+                
+        if 'S' in a.keys:
+            optics=pd.DataFrame(np.transpose(myList), index=a.S, columns=myColumns)
+        else:
+            optics=pd.DataFrame(np.transpose(myList), columns=myColumns)
+        #optics=pd.DataFrame(np.transpose(myList), index=a.S,columns=myColumns)
+
+        for i in optics.columns:
+            aux3= optics.iloc[0][i]
+            if type(aux3) is str:
+                aux3=str.replace(aux3, '+', '')
+                aux3=str.replace(aux3, '-', '')
+                aux3=str.replace(aux3, '.', '')
+                aux3=str.replace(aux3, 'e', '')
+                aux3=str.replace(aux3, 'E', '')
+
+
+                if aux3.isdigit():
+                    optics[i]=optics[i].apply(np.double)
+
+        aux.append('FILE_NAME')
+        aux1.append(os.path.abspath(myFile))
+
+        aux.append('TABLE')
+        aux1.append(optics)
+
+        globalDF=pd.DataFrame([aux1], columns=aux)
+        globalDF=globalDF.set_index('FILE_NAME')
+        globalDF.index.name=''
+        return globalDF
+
+def _benchmarkTFS2pd(fileList):
+    '''
+    Compare the time needed by _tfs2pd and by _execTFS2pd on the TFS files of fileList (e.g., twiss and survey).
+    It returns a pd.DataFrame indexed by file with the two times in seconds, the speed-up and the check of
+    the equality of the tables (numeric columns with a relative tolerance, string columns exactly).
+    The rows containing '$', '@' or '*' (e.g., LHCB1$START) are dropped by _execTFS2pd and are not compared.
+
+    ===Example===
+    importData._benchmarkTFS2pd(['lhcb1_thick.twiss','lhcb1_thick.survey'])
+    '''
+    result=[]
+    for i in fileList:
+        t0=time.time()
+        old=_execTFS2pd(i)
+        t1=time.time()
+        new=_tfs2pd(i, useCache=False)
+        t2=time.time()
+        oldTable=old['TABLE'].iloc[0]
+        newTable=new['TABLE'].iloc[0]
+        strings=[j for j in newTable.columns if newTable[j].dtype.kind not in 'biuf']
+        kept=~newTable[strings].apply(lambda x: x.str.contains(r'[$@*]')).any(axis=1) if len(strings) else np.ones(len(newTable), bool)
+        newTable=newTable[np.asarray(kept)]
+        equal=(list(oldTable.columns)==list(newTable.columns)) and len(oldTable)==len(newTable)
+        if equal:
+            for j in newTable.columns:
+                if newTable[j].dtype.kind in 'biuf':
+                    equal=equal and np.allclose(oldTable[j].values.astype(float), newTable[j].values, rtol=1e-12, equal_nan=True)
+                else:
+                    equal=equal and (oldTable[j].astype(str).values==newTable[j].values).all()
+        result.append({'exec [s]':t1-t0, 'vectorized [s]':t2-t1, 'speed-up':(t1-t0)/(t2-t1), 'equal':equal})
+    return pd.DataFrame(result, index=fileList)
+
+def _testChunks2parquet(fileName='sparse.parquet'):
+    '''
+    Write with _chunks2parquet synthetic chunks where the first one has no data for two variables
+    (a string telegram and a vector), read the Parquet file back and compare it with the concatenated chunks.
+    It returns True if they agree. It requires pyarrow.
+    '''
+    import tempfile
+    index=lambda start: pd.date_range(start, periods=2, freq='1s', tz='UTC')
+    chunks=[pd.DataFrame({'A':[1., 2.]}, index=index('2018-01-01 00:00')),
+            pd.DataFrame({'A':[3., np.nan], 'TELEGRAM':['INJ', np.nan], 'VECTOR':[np.nan, np.arange(3.)]},
+                         index=index('2018-01-01 01:00')),
+            pd.DataFrame({'A':[5., 6.]}, index=index('2018-01-01 02:00'))]
+    samples={'TELEGRAM':'INJ', 'VECTOR':np.arange(3.)}
+    with tempfile.TemporaryDirectory() as folder:
+        myFile=os.path.join(folder, fileName)
+        noOfRows=_chunks2parquet(chunks, ['A','TELEGRAM','VECTOR'], myFile, lambda x: {i: samples[i] for i in x})
+        myDF=pd.read_parquet(myFile)
+    reference=pd.concat(chunks).reindex(columns=['A','TELEGRAM','VECTOR'])
+    return noOfRows==6 and myDF.index.equals(reference.index) \
+        and np.array_equal(myDF['A'].values, reference['A'].values, equal_nan=True) \
+        and myDF['TELEGRAM'].isna().tolist()==reference['TELEGRAM'].isna().tolist() and myDF['TELEGRAM'].iloc[2]=='INJ' \
+        and myDF['VECTOR'].isna().tolist()==reference['VECTOR'].isna().tolist() \
+        and np.array_equal(myDF['VECTOR'].iloc[3], np.arange(3.))
@@ -7,70 +7,39 @@ from matplotlib import pyplot as plt
 import numpy as np
 import pandas as pd
 from collections import OrderedDict
+from . import tfsFunctions
 
-def _tfsFormat(myValue, myFormat):
-    if 'd' in myFormat:
-        myValue=int(myValue)
-    if 'l' in myFormat:
-        myValue=float(myValue)
-    if 's' in myFormat:
-        myValue=myValue.replace('"','')
-    return myValue
-
-def _tfs2pd(file_name):
-    myDictionaryComment=OrderedDict()
-    myDictionaryTableFieldName=[]
-    myDictionaryTableFieldFormat=[]
-    myDictionaryTable=OrderedDict()
-    f = open(file_name, "r")
-    for line in f: 
-        # This is a comment line
-        if line[0]=='@':
-            aux=line.split()
-            value=" ".join(str(x) for x in aux[3:])
-            myDictionaryComment[aux[1]]=_tfsFormat(value, aux[2])
-
-        # This is the field name
-        if line[0]=='*':
-            aux=line.split()
-            for i in aux[1:]:
-                myDictionaryTableFieldName.append(i)
-
-            for i in range(len(myDictionaryTableFieldName)):
-                myDictionaryTable[myDictionaryTableFieldName[i]]=[]
-
-        if line[0]=='$':
-            aux=line.split()
-            for i in aux[1:]:
-                myDictionaryTableFieldFormat.append(i)
-
-        if line[0]==' ':
-            aux=line.split()
-            for i in range(len(myDictionaryTableFieldName)):
-                myDictionaryTable[myDictionaryTableFieldName[i]].append(_tfsFormat(aux[i], myDictionaryTableFieldFormat[i]))
-
-    f.close()
-    aux=pd.DataFrame([myDictionaryComment])
-    aux['TABLE']=[pd.DataFrame(myDictionaryTable)]
+def _tfs2pd(file_name, useCache=True, columns=None):
+    '''
+    Import a MADX TFS file in a one-row pandas dataframe indexed by file_name.
+    The header scalars are the columns (in the file order), the typed table (RangeIndex) is in the TABLE column.
+    The parsed file is cached (see tfsFunctions.readTFS) if useCache.
+    Only the columns of the list columns are in the table (all if None, none if []).
+    '''
+    header, table = tfsFunctions.readTFS(file_name, useCache=useCache, columns=columns)
+    aux=pd.DataFrame([header])
+    aux['TABLE']=[table]
     aux['FILE_NAME']=file_name
     aux=aux.set_index('FILE_NAME')
     aux.index.name=''
     return aux
 
-def tfs2pd(listOfFile):
+def tfs2pd(listOfFile, useCache=True, columns=None):
     '''
         Import a MADX TFS file in a pandas dataframe.
+        The parsed files are cached (see tfsFunctions.readTFS) and loaded again only if modified, unless useCache=False.
+        Only the columns of the list columns are in the tables (all if None, none if [] to read only the headers).
         
         ===Example=== 
         aux=importData.tfs2pd(['/eos/user/s/sterbini/MD_ANALYSIS/2018/LHC MD Optics/collisionAt25cm_180urad/lhcb1_thick.survey',
         '/eos/user/s/sterbini/MD_ANALYSIS/2018/LHC MD Optics/collisionAt25cm_180urad/lhcb1_thick.twiss'])
     '''
     if isinstance(listOfFile,str):
-        return _tfs2pd(listOfFile)
+        return _tfs2pd(listOfFile, useCache, columns)
     else:
         aux=[]
         for i in listOfFile:
-            aux.append(tfs2pd(i))
+            aux.append(tfs2pd(i, useCache, columns))
         return pd.concat(aux)
     
 class MadX:
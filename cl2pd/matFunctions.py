@@ -0,0 +1,138 @@
+'''
+The import of the matlab files (e.g., the ones of the injectors MD data) in pandas.
+
+This module does not import pytimber: the processes of the pool of mat2pd import only this module
+and do not start (or fork) a JVM. mat2dict, mat2pd and MatlabFile are also available in importData.
+
+===Example===
+from cl2pd import matFunctions
+matFunctions.mat2pd(['CPS_BLM.Acquisition.value.lastLosses'], glob.glob('/eos/user/s/sterbini/MD_ANALYSIS/2016/MD1780_80b/*.mat'))
+'''
+import numpy as np
+import pandas as pd
+import os
+import h5py
+
+
+def mat2dict(myfile):
+    '''
+    Import a matlab file in a python structure 
+
+    ===Example===     
+    aux=matFunctions.mat2dict('/eos/user/s/sterbini/MD_ANALYSIS/2016/MD1780_80b/2016.10.26.22.23.42.135.mat')
+    '''
+    import scipy.io
+    myDataStruct = scipy.io.loadmat(myfile,variable_names=['myDataStruct'],squeeze_me=True, struct_as_record=False)
+    return myDataStruct['myDataStruct']
+
+class MatlabFile:
+    '''
+    Lazy handle of a matlab file (see mat2pd with matlabFullInfo='lazy'):
+    the file is read only when load() is called.
+
+    - path: the absolute path of the file
+    - load(): the myDataStruct (as mat2dict) for the v5 files, the h5py group myDataStruct for the v7.3 (HDF5) ones
+    '''
+    def __init__(self, path):
+        self.path=path
+
+    def __repr__(self):
+        return 'MatlabFile('+self.path+')'
+
+    def load(self):
+        if h5py.is_hdf5(self.path):
+            return h5py.File(self.path,'r')['myDataStruct']
+        return mat2dict(self.path)
+
+def _matField(data, field):
+    '''
+    Return the field (e.g., 'CPS_BLM.Acquisition.value.lastLosses') of a myDataStruct (mat2dict or h5py group),
+    np.nan if it does not exist.
+    '''
+    try:
+        for i in field.split('.'):
+            data=data[i] if isinstance(data, h5py.Group) else getattr(data, i)
+    except (AttributeError, KeyError):
+        return np.nan
+    if isinstance(data, h5py.Dataset):
+        # matlab stores the arrays in column-major order
+        data=np.squeeze(data[()].T)
+        if data.ndim==0:
+            data=data.item()
+    return data
+
+def _mat2row(fileName, variablesList, matlabFullInfo):
+    '''
+    Read from the matlab file only the variablesList and the headerCycleStamps of myDataStruct.
+    For the v7.3 (HDF5) files only the requested fields are read, for the v5 ones scipy.io.loadmat reads only
+    the myDataStruct variable (see mat2dict: it cannot select the fields inside a struct).
+    Return the cycle stamp [ns], the absolute path, the list of values and the full info.
+    '''
+    path=os.path.abspath(fileName)
+    if h5py.is_hdf5(fileName):
+        with h5py.File(fileName,'r') as f:
+            data=f['myDataStruct']
+            cycleStamp=np.max(_matField(data, 'headerCycleStamps'))
+            values=[_matField(data, j) for j in variablesList]
+        fullInfo=MatlabFile(path) if matlabFullInfo else None
+    else:
+        data=mat2dict(fileName)
+        cycleStamp=np.max(data.headerCycleStamps)
+        values=[_matField(data, j) for j in variablesList]
+        fullInfo=None
+        if matlabFullInfo=='lazy':
+            fullInfo=MatlabFile(path)
+        elif matlabFullInfo:
+            fullInfo=data
+    return cycleStamp, path, values, fullInfo
+
+def _matColumn(values):
+    '''
+    Return the values of a variable as a typed array when they are all scalars, otherwise as an object array.
+    '''
+    if all(np.ndim(i)==0 for i in values):
+        aux=np.asarray(values)
+        if aux.dtype!=object:
+            return aux
+    aux=np.empty(len(values), dtype=object)
+    aux[:]=values
+    return aux
+
+def mat2pd(variablesList,filesList, verbose=False, matlabFullInfo=False, max_workers=1):
+    '''
+    Return a pandas DataFrame given a variable list and a file list.
+
+    Only the myDataStruct variable is read from the files (only the requested fields for the v7.3 files).
+    The files can be read in parallel by a pool of max_workers processes. The processes are spawned
+    (not forked, as the JVM of pytimber is not fork-safe) and they import only this module.
+    If matlabFullInfo is True the full myDataStruct of each file is in the matlabFullInfo column,
+    if it is 'lazy' the column contains MatlabFile handles, loading the file only on request
+    (the full info of the v7.3 files is always a MatlabFile handle).
+
+    ===Example=== 
+    matFunctions.mat2pd(['CPS_BLM.Acquisition.value.lastLosses'],\
+    ['/eos/user/s/sterbini/MD_ANALYSIS/2016/MD1780_80b/2016.10.26.22.23.42.135.mat',\
+    '/eos/user/s/sterbini/MD_ANALYSIS/2016/MD1780_80b/2016.10.26.22.23.06.147.mat'])
+    '''
+    filesList=list(filesList)
+    if max_workers>1 and len(filesList)>1:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            rows=list(executor.map(_mat2row, filesList, [variablesList]*len(filesList), [matlabFullInfo]*len(filesList),
+                                   chunksize=max(1,len(filesList)//(4*max_workers))))
+    else:
+        rows=[]
+        for i in filesList:
+            if verbose:
+                print(i)
+            rows.append(_mat2row(i, variablesList, matlabFullInfo))
+
+    cycleStampList=pd.to_datetime(np.array([i[0] for i in rows], dtype=np.int64), unit='ns').tz_localize('UTC')
+    myDataFrame=pd.DataFrame(index=cycleStampList)
+    myDataFrame['matlabFilePath']=[i[1] for i in rows]
+    if matlabFullInfo:
+        myDataFrame['matlabFullInfo']=_matColumn([i[3] for i in rows])
+    for k,j in enumerate(variablesList):
+        myDataFrame[j]=_matColumn([i[2][k] for i in rows])
+    return myDataFrame.sort_index(axis=1).sort_index(axis=0)
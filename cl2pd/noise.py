@@ -264,19 +264,15 @@ class ADT:
           myTimestampList=[]
           pus = []
           status = []
-          if myFileList:
-            fills = np.unique([int(filename.split('/')[-1].split('_')[0]) for filename in myFileList])
-            df = {}
-            for fill in fills:
-                df[fill] = importData.LHCFillsByNumber(fill)
-                df[fill] = df[fill][df[fill]['mode']!='FILL']
-                df[fill] = df[fill].reset_index(drop=True)
+          fileFills = []
           for fileName in myFileList:
-            fill  = int((fileName.split('/')[-1].split('_'))[0])
-            time  = self.fromName2Timestamp(fileName.split('/')[-1])
-            status.append(self.getStatus(time,fill, df))
-            myTimestampList.append(time)
+            fileFills.append(int((fileName.split('/')[-1].split('_'))[0]))
+            myTimestampList.append(self.fromName2Timestamp(fileName.split('/')[-1]))
             pus.append(self.fromName2PU(fileName.split('/')[-1]))    
+          if myFileList:
+            # all the files are tagged at once, the file has a status only during a mode of its own fill
+            instants = importData.LHCInstants(myTimestampList, importData.LHCFillsByNumber(np.unique(fileFills)), fillGaps=False)
+            status = list(np.where(instants['fill'].values == np.array(fileFills), instants['mode'].values, 'NOSTATUS'))
           myDATA['at'+x]=pd.DataFrame(index=np.array(myTimestampList))
           myDATA['at'+x]['fileName']=np.array(myFileList)
           myDATA['at'+x]['Status'] = status
@@ -324,7 +320,7 @@ class BBQ:
     """
 
     def FindStatus(self,time):
-        return importData.LHCInstant(time)['mode'].values[0]
+        return importData.LHCInstants([time])['mode'].values[0]
 
     def flattenoverlap(self, v,timestamps, frf,test=100,start=0):
       """
@@ -370,7 +366,7 @@ class BBQ:
             for time in time_list:
               raw_data = importData.cals2pd(var, time[0], time[1])
               if return_status:
-                raw_data['status'] = raw_data.index.map(FindStatus)
+                raw_data['status'] = importData.LHCInstants(raw_data.index)['mode'].values
               raw_data[var[1]] = raw_data[var[1]].interpolate(limit_direction='both')
               raw_data['frev'] = raw_data[var[1]]/35640.
               raw_data.dropna(subset=[var[0]], inplace=True)
@@ -0,0 +1,349 @@
+'''
+A vectorized reader of the MADX TFS files, shared by importData.tfs2pd and madx.tfs2pd.
+
+The '@' header is parsed once, the '$' formats are mapped to numpy dtypes and the table
+is read in one shot by the C engine of pd.read_csv.
+The parsed files are cached (see tfsCache and readTFS): an unchanged file is not parsed again.
+The files of a scan can be loaded in parallel and stacked in a 3D array with tfsScan.
+Only the requested columns and rows can be loaded (see readTFS and the lazy handle TFSFile).
+
+===Example===
+from cl2pd import tfsFunctions
+header, table = tfsFunctions.readTFS('lhcb1_thick.twiss')
+'''
+import numpy as np
+import pandas as pd
+import os
+import json
+import shutil
+import hashlib
+import uuid
+from collections import OrderedDict
+from . import dotdict
+
+# Configuration of the cache of the parsed TFS files (see readTFS).
+# The user can change it at run time, e.g.
+# tfsFunctions.tfsCache.enabled=False
+# - folder: where the parsed files are stored if the folder of the TFS file is read-only
+#   or if nextToFile is False
+# - nextToFile: store the parsed file next to the TFS file (as .<name>.tfscache)
+tfsCache=dotdict.dotdict({'folder': os.environ.get('CL2PD_TFS_CACHE_FOLDER',
+                                                   os.path.join(os.path.expanduser('~'),'.cl2pd','tfsCache')),
+                          'nextToFile': True,
+                          'enabled': True})
+# the tokens of the not-a-number values written by MADX (as read by float())
+_tfsNaN=['nan', '-nan', 'NaN', '-NaN', 'NAN', '-NAN']
+
+def _tfsDtype(myFormat):
+    '''
+    Return the numpy dtype of a TFS format (e.g., '%le', '%hd', '%s').
+    '''
+    if 's' in myFormat:
+        return str
+    if 'd' in myFormat:
+        return np.int64
+    return np.float64
+
+def _tfsValue(myValue, myFormat):
+    '''
+    Return the value of a TFS header line (the text after the format) with the type of its format.
+    '''
+    myValue=myValue.strip()
+    if 's' in myFormat:
+        return myValue.replace('"','')
+    if 'd' in myFormat:
+        return int(myValue)
+    return float(myValue)
+
+def readTFSHeader(fileName):
+    '''
+    Return the header of a TFS file without reading its table:
+    - the OrderedDict of the '@' lines (in the file order, typed by their formats),
+    - the list of the column names ('*' line),
+    - the list of the column formats ('$' line),
+    - the number of lines before the table.
+
+    ===Example===
+    header, columns, formats, noOfLines = tfsFunctions.readTFSHeader('lhcb1_thick.twiss')
+    header['Q1'], header['Q2']
+    '''
+    header=OrderedDict()
+    columns=[]
+    formats=[]
+    noOfLines=0
+    with open(fileName, 'r') as f:
+        for line in f:
+            noOfLines+=1
+            if line[0]=='@':
+                aux=line[1:].split(None, 2)
+                if len(aux)<2:
+                    continue
+                header[aux[0]]=_tfsValue(aux[2] if len(aux)>2 else '', aux[1])
+            elif line[0]=='*':
+                columns=line.split()[1:]
+            elif line[0]=='$':
+                formats=line.split()[1:]
+                break
+    return header, columns, formats, noOfLines
+
+def _tfsCacheFolders(fileName):
+    '''
+    Return the candidate folders of the parsed TFS file: next to the file (if tfsCache.nextToFile)
+    and in tfsCache.folder.
+    '''
+    folder, name = os.path.split(os.path.abspath(fileName))
+    aux=[os.path.join(tfsCache.folder,
+                      name+'_'+hashlib.md5(os.path.abspath(fileName).encode()).hexdigest()[:8]+'.tfscache')]
+    if tfsCache.nextToFile:
+        aux.insert(0, os.path.join(folder, '.'+name+'.tfscache'))
+    return aux
+
+def _tfsStamp(fileName):
+    '''
+    Return the size and the mtime (ns) of the TFS file, the key of its cache.
+    '''
+    aux=os.stat(fileName)
+    return [aux.st_size, aux.st_mtime_ns]
+
+def _readTFSCache(fileName, usecols=None):
+    '''
+    Return the cached (header, columns, table) of the TFS file or None if missing or stale.
+    Only the usecols columns are loaded (all if None), the numeric ones are memory-mapped
+    (copy-on-write: the cache is never modified).
+    '''
+    stamp=_tfsStamp(fileName)
+    for folder in _tfsCacheFolders(fileName):
+        try:
+            with open(os.path.join(folder, 'header.json'), 'r') as f:
+                info=json.load(f)
+            if info['stamp']!=stamp:
+                continue
+            myColumns=[i for i in info['columns'] if usecols is None or i in usecols]
+            table=pd.DataFrame({column: np.load(os.path.join(folder, str(info['columns'].index(column))+'.npy'),
+                                                mmap_mode='c', allow_pickle=False)
+                                for column in myColumns}, columns=myColumns, copy=False)
+            for column, myFormat in zip(info['columns'], info['formats']):
+                if column in myColumns and _tfsDtype(myFormat) is str:
+                    table[column]=table[column].astype(str)
+            return OrderedDict(info['header']), info['columns'], table
+        except (OSError, ValueError, KeyError):
+            pass # missing or corrupted, next candidate
+    return None
+
+def _writeTFSCache(fileName, stamp, header, columns, formats, table):
+    '''
+    Save the parsed TFS file (one .npy per column and a header.json) in the first writable candidate folder.
+    '''
+    for folder in _tfsCacheFolders(fileName):
+        # unique for each writer (threads, processes and hosts sharing the folder)
+        tmp=folder+'.tmp'+uuid.uuid4().hex
+        try:
+            if not os.path.exists(os.path.dirname(folder)):
+                os.makedirs(os.path.dirname(folder), exist_ok=True)
+            os.makedirs(tmp)
+            for i, column in enumerate(columns):
+                aux=table[column].to_numpy(dtype=str if _tfsDtype(formats[i]) is str else None)
+                np.save(os.path.join(tmp, str(i)+'.npy'), aux, allow_pickle=False)
+            with open(os.path.join(tmp, 'header.json'), 'w') as f:
+                json.dump({'stamp':stamp, 'header':list(header.items()), 'columns':columns, 'formats':formats}, f)
+            if os.path.exists(folder):
+                shutil.rmtree(folder, ignore_errors=True)
+            try:
+                os.replace(tmp, folder)
+            except OSError:
+                # another writer has just cached the file: its entry is as good as this one
+                if not os.path.exists(os.path.join(folder, 'header.json')):
+                    raise
+                shutil.rmtree(tmp, ignore_errors=True)
+            return
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True) # read-only folder, next candidate
+
+def readTFS(fileName, index=None, useCache=True, columns=None, names=None):
+    '''
+    Return the header (see readTFSHeader) and the table of a TFS file.
+    The table is a pd.DataFrame with the dtypes of the '$' formats
+    (float64 for '%le', int64 for '%d'/'%hd', str without quotes for '%s').
+    It is indexed by the first column of the index list present in the file (e.g., ['S','NAME']),
+    the index is unnamed. If none is present (or index=None) a RangeIndex is used.
+
+    Only the columns of the list columns are returned (all if None, the table is not read if []),
+    only the rows whose NAME matches the regular expression names (re.search) are returned (all if None).
+
+    If useCache (and tfsCache.enabled) the parsed file is saved next to the file (or in tfsCache.folder)
+    and loaded from there, with memory-mapped numeric columns, until the size or the mtime of the file change.
+    A file not yet cached is parsed entirely (and cached) only if all its columns are requested.
+
+    ===Example===
+    header, table = tfsFunctions.readTFS('lhcb1_thick.twiss', index=['S','NAME'])
+    header, table = tfsFunctions.readTFS('lhcb1_thick.twiss', columns=['S','BETX','BETY'], names=r'^IP\d')
+    '''
+    useCache=useCache and tfsCache.enabled
+    if isinstance(index, str):
+        index=[index]
+    if columns is not None and len(columns)==0:
+        return readTFSHeader(fileName)[0], pd.DataFrame()
+
+    if columns is None:
+        usecols=None
+    else:
+        usecols=list(columns)+[i for i in (index or [])]+(['NAME'] if names is not None else [])
+    cached=_readTFSCache(fileName, usecols) if useCache else None
+    if cached is None:
+        stamp=_tfsStamp(fileName)
+        header, allColumns, formats, noOfLines = readTFSHeader(fileName)
+        dtypes=dict(zip(allColumns, [_tfsDtype(i) for i in formats]))
+        # the nan of MADX only in the float columns (an element can be named "nan")
+        naValues={i: _tfsNaN for i in allColumns if dtypes[i] is np.float64}
+        table=pd.read_csv(fileName, sep=r'\s+', skiprows=noOfLines, header=None, names=allColumns,
+                          usecols=None if usecols is None else [i for i in allColumns if i in usecols],
+                          dtype=dtypes, quotechar='"', engine='c', na_values=naValues, keep_default_na=False)
+        if useCache and usecols is None and stamp==_tfsStamp(fileName):
+            _writeTFSCache(fileName, stamp, header, allColumns, formats, table)
+    else:
+        header, allColumns, table = cached
+
+    missing=[i for i in list(columns or [])+(['NAME'] if names is not None else []) if i not in allColumns]
+    if len(missing):
+        raise ValueError('The columns '+str(missing)+' are not in '+fileName+'.')
+    if names is not None:
+        table=table[table['NAME'].str.contains(names, regex=True).values]
+    for i in (index or []):
+        if i in table.columns:
+            table.index=table[i].values
+            break
+    if columns is not None:
+        table=table[list(columns)]
+    return header, table
+
+class TFSFile:
+    '''
+    A lazy handle of a TFS file: the header is read (without scanning the table) only when requested,
+    the table only with the requested columns and rows (see readTFS).
+
+    ===Example===
+    twiss=tfsFunctions.TFSFile('lhcb1_thick.twiss')
+    twiss.header['Q1'], twiss.header['Q2']
+    twiss.columns
+    twiss.table(['S','BETX','BETY'], names=r'^BPM')
+    '''
+    def __init__(self, fileName, useCache=True):
+        self.fileName=fileName
+        self.useCache=useCache
+        self._header=None
+
+    def _readHeader(self):
+        if self._header is None:
+            self._header=readTFSHeader(self.fileName)[:3]
+        return self._header
+
+    @property
+    def header(self):
+        '''The OrderedDict of the '@' lines.'''
+        return self._readHeader()[0]
+
+    @property
+    def columns(self):
+        '''The list of the column names.'''
+        return self._readHeader()[1]
+
+    @property
+    def formats(self):
+        '''The list of the column formats.'''
+        return self._readHeader()[2]
+
+    def table(self, columns=None, names=None, index=None):
+        '''
+        Return the table with the columns of the list columns (all if None) and the rows
+        whose NAME matches the regular expression names (all if None), see readTFS.
+        '''
+        return readTFS(self.fileName, index=index, useCache=self.useCache, columns=columns, names=names)[1]
+
+def _tfsScanRow(fileName, useCache, cacheConfig, columns, names):
+    '''
+    Return the header, the element names (NAME, or None), the numeric column names and
+    the 2D float array (element x column) of a TFS file. It is the worker of tfsScan.
+    '''
+    tfsCache.update(cacheConfig)
+    if columns is not None and 'NAME' not in columns and 'NAME' in readTFSHeader(fileName)[1]:
+        columns=list(columns)+['NAME']
+    header, table = readTFS(fileName, useCache=useCache, columns=columns, names=names)
+    numeric=[i for i in table.columns if table[i].dtype.kind in 'biuf']
+    names=table['NAME'].to_numpy(dtype=str) if 'NAME' in table.columns else None
+    return dict(header), names, numeric, table[numeric].to_numpy(dtype=np.float64)
+
+def tfsScan(fileList, max_workers=4, useCache=True, columns=None, names=None):
+    '''
+    Load the TFS files of a scan (e.g., one twiss per point of a parametric scan) in a pool of max_workers processes
+    (spawned, they import only this module).
+    It returns a dotdict with
+    - atHeader: pd.DataFrame of the header scalars (one row per file, indexed as fileList),
+    - atTable: 3D np.array (file x element x column) of the numeric columns (float64),
+    - atElements: pd.Index of the elements (the NAME column, or the row number if missing),
+    - atColumns: pd.Index of the columns of atTable.
+    Only the columns of the list columns (all if None) and the elements whose NAME matches
+    the regular expression names (all if None) are loaded (see readTFS).
+    If the files do not have the same elements they are aligned by NAME (NaN for the missing ones);
+    the columns missing in a file are NaN.
+
+    ===Example===
+    scan=tfsFunctions.tfsScan(sorted(glob.glob('scan/*.twiss')), columns=['BETX','BETY'])
+    betx=scan.atTable[:,:,scan.atColumns.get_loc('BETX')]
+    plt.plot(scan.atHeader['MASKED_klwire'], np.max(np.abs(betx/betx[0]-1), axis=1))
+    '''
+    fileList=list(fileList)
+    arguments=[fileList, [useCache]*len(fileList), [dict(tfsCache)]*len(fileList),
+               [columns]*len(fileList), [names]*len(fileList)]
+    if max_workers>1 and len(fileList)>1:
+        # spawned, not forked: the session could have started the JVM of pytimber (not fork-safe)
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            rows=list(executor.map(_tfsScanRow, *arguments, chunksize=max(1,len(fileList)//(4*max_workers))))
+    else:
+        rows=list(map(_tfsScanRow, *arguments))
+
+    columns=pd.Index([])
+    for i in rows:
+        columns=columns.append(pd.Index(i[2]).difference(columns, sort=False))
+    if all(i[1] is None for i in rows):
+        elements=pd.RangeIndex(max([len(i[3]) for i in rows]+[0]))
+    elif all(i[1] is not None and np.array_equal(i[1], rows[0][1]) for i in rows):
+        elements=pd.Index(rows[0][1])
+    else:
+        if any(i[1] is None or not pd.Index(i[1]).is_unique for i in rows):
+            raise ValueError('The files have different elements and they cannot be aligned by NAME (missing or not unique).')
+        elements=pd.Index([])
+        for i in rows:
+            elements=elements.append(pd.Index(i[1]).difference(elements, sort=False))
+
+    table=np.full((len(rows), len(elements), len(columns)), np.nan)
+    for k, (header, names, numeric, values) in enumerate(rows):
+        myColumns=columns.get_indexer(numeric)
+        if names is None or len(names)==len(elements) and np.array_equal(names, elements.values):
+            table[k, :len(values)][:, myColumns]=values
+        else:
+            table[k][np.ix_(elements.get_indexer(names), myColumns)]=values
+    return dotdict.dotdict({'atHeader': pd.DataFrame([i[0] for i in rows], index=fileList),
+                            'atTable': table,
+                            'atElements': elements,
+                            'atColumns': columns})
+
+# TEST FUNCTIONS
+
+def _testReadTFSNaN():
+    '''
+    Write in a temporary folder a TFS table with the nan, -nan, inf and -inf tokens of MADX
+    (and an element named "nan") and check that readTFS reads it as float() does. It returns True if they agree.
+    '''
+    import tempfile
+    with tempfile.TemporaryDirectory() as folder:
+        fileName=os.path.join(folder, 'nan.tfs')
+        with open(fileName, 'w') as f:
+            f.write('@ Q1 %le nan\n* NAME S BETX DX\n$ %s %le %le %le\n'
+                    ' "nan" 0 nan 1\n "B" 1 -nan inf\n "C" 2 3.5 -inf\n')
+        header, table = readTFS(fileName, useCache=False)
+    reference=np.array([[0, float('nan'), 1], [1, float('-nan'), float('inf')], [2, 3.5, float('-inf')]])
+    return np.isnan(header['Q1']) and table['NAME'].tolist()==['nan', 'B', 'C'] \
+        and all(table[i].dtype==np.float64 for i in ['S', 'BETX', 'DX']) \
+        and np.array_equal(table[['S', 'BETX', 'DX']].values, reference, equal_nan=True)